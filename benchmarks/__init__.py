@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for the BetterContact connector. They run against the local
+mock in mock_bettercontact.py and never call the real API.
+"""
@@ -0,0 +1,191 @@
+"""
+Offline load test of the connector's modules against the mock BetterContact API.
+
+Starts the mock, points the connector at it and drives the Flask app in
+process with concurrent virtual users for a fixed duration. Each user runs,
+at random per the --sync-share mix, either:
+
+- an async flow: Enrich Lead, then Get Enrichment Results every
+  --client-poll-interval seconds until the results are ready;
+- a sync flow: one Enrich Lead (Sync) call.
+
+Every lead is unique, so deduplication never short-circuits a call. The
+report gives requests per second and p50/p95/p99 latency per module (plus
+the async flow end to end). It also reports outbound API calls per lead,
+as counted by the mock. Run from the repo root:
+
+    python -m benchmarks.load_test --users 50 --duration 60 --enrichment-seconds 3 --throttle-rate 0.02
+
+Save a run with --save baseline.json. A later run with --baseline
+baseline.json exits with status 1 when a latency percentile or the calls
+per lead got worse by more than --tolerance.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import report
+from benchmarks.mock_bettercontact import add_tuning_arguments, start_mock_server, tuning_options
+
+API_KEY = "load-test-key"
+
+
+class Recorder:
+    """
+    Latencies and error counts per operation, shared by all virtual users.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, operation, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(operation, [])
+            self.errors.setdefault(operation, 0)
+            if ok:
+                self.latencies[operation].append(seconds)
+            else:
+                self.errors[operation] += 1
+
+
+def call(client, recorder, operation, payload):
+    started = time.perf_counter()
+    response = client.post(f"/{operation}/v1/execute", json={"data": payload})
+    elapsed = time.perf_counter() - started
+    body = response.get_json(silent=True) or {}
+    # Closing runs the connector's end-of-request hooks (metrics), as a WSGI server would
+    response.close()
+    ok = response.status_code == 200 and not body.get("error")
+    recorder.add(operation, elapsed, ok)
+    return body if ok else None
+
+
+def lead_payload():
+    return {
+        "connection": {"api_key_bearer": API_KEY},
+        "first_name": "Load",
+        "last_name": uuid.uuid4().hex[:12],
+        "company_domain": "example.com"
+    }
+
+
+def async_flow(client, recorder, poll_interval, timeout):
+    started = time.perf_counter()
+    submitted = call(client, recorder, "enrich_leads", lead_payload())
+    request_id = (submitted or {}).get("data", {}).get("request_id")
+    if not request_id:
+        recorder.add("async flow (end to end)", 0, False)
+        return
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(poll_interval)
+        result = call(client, recorder, "get_enrichment_results", {
+            "connection": {"api_key_bearer": API_KEY},
+            "request_id": request_id
+        })
+        if result is None:
+            break
+        if result.get("metadata", {}).get("status") == "completed":
+            recorder.add("async flow (end to end)", time.perf_counter() - started, True)
+            return
+    recorder.add("async flow (end to end)", 0, False)
+
+
+def sync_flow(client, recorder):
+    call(client, recorder, "enrich_lead_sync", lead_payload())
+
+
+def virtual_user(app, recorder, deadline, args, seed):
+    client = app.test_client()
+    chooser = random.Random(seed)
+    while time.time() < deadline:
+        if chooser.random() < args.sync_share:
+            sync_flow(client, recorder)
+        else:
+            async_flow(client, recorder, args.client_poll_interval, args.async_timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the BetterContact connector")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds new flows are started")
+    parser.add_argument("--sync-share", type=float, default=0.5, help="Share of flows using Enrich Lead (Sync)")
+    parser.add_argument("--client-poll-interval", type=float, default=1.0)
+    parser.add_argument("--async-timeout", type=float, default=60)
+    parser.add_argument("--enrichment-seconds", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every API response")
+    add_tuning_arguments(parser)
+    parser.add_argument("--save", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a report saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative worsening before a metric counts as a regression")
+    args = parser.parse_args()
+
+    server, state = start_mock_server(
+        enrichment_seconds=args.enrichment_seconds,
+        latency_seconds=args.latency,
+        **tuning_options(args)
+    )
+
+    # The connector reads its settings at import time
+    state_dir = tempfile.mkdtemp(prefix="bettercontact-load-")
+    os.environ["BETTERCONTACT_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["BETTERCONTACT_STATE_DB"] = os.path.join(state_dir, "state.db")
+    import main as connector
+
+    recorder = Recorder()
+    started = time.time()
+    deadline = started + args.duration
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        for user in range(args.users):
+            executor.submit(virtual_user, connector.app, recorder, deadline, args, user)
+    wall_time = time.time() - started
+
+    stats = state.stats
+    server.shutdown()
+
+    submitted_leads = stats["submitted_leads"]
+    result = {
+        "title": (
+            f"{args.users} users for {args.duration:g}s ({args.sync_share:.0%} sync), "
+            f"{args.enrichment_seconds:g}s enrichment, {args.latency:g}s API latency, "
+            f"{args.throttle_rate:.0%} throttled"
+        ),
+        "operations": {
+            operation: report.summarize(recorder.latencies[operation], recorder.errors[operation], wall_time)
+            for operation in sorted(recorder.latencies)
+        },
+        "outbound": {
+            "leads_submitted": submitted_leads,
+            "api_calls": stats["api_calls"],
+            "calls_per_lead": round(stats["api_calls"] / submitted_leads, 2) if submitted_leads else None,
+            "throttled_calls": stats["throttled"],
+            "responses": stats["responses"]
+        }
+    }
+
+    report.print_report(result)
+    if args.save:
+        report.save(result, args.save)
+
+    if args.baseline:
+        regressions = report.compare(result, args.baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""
+Local mock of the BetterContact async API.
+
+Implements POST /api/v2/async and GET /api/v2/async/{id} (plus the unversioned
+/api/async/{id}). A submitted request answers 202 "in progress" until its
+enrichment time has passed and 200 with enriched leads afterwards.
+
+Behaviour is tunable to mimic a real, imperfect API:
+
+- latency_seconds / latency_jitter: time added to every API response
+  (jitter is the upper bound of an extra uniform delay);
+- slow_rate / slow_seconds: share of API responses delayed by slow_seconds
+  more, a slow tail like a stalled connection or an overloaded backend;
+- enrichment_seconds / enrichment_jitter: how long a request answers 202
+  (jitter is the sigma of a log-normal spread around enrichment_seconds);
+- not_found_rate: share of requests whose results answer 404 (lost/expired);
+- not_ready_rate: share of requests whose first poll answers 406 "Unvalid
+  request_id", as the API does right after a submission;
+- throttle_rate: share of API calls answered 429 with Retry-After: 1;
+- error_rate: share of API calls answered 503, to mimic an outage (it can
+  be changed on a running mock through state.error_rate);
+- rejected_keys: API keys every call is answered 401 for;
+- webhook_secret: key of the HMAC-SHA256 webhook pushes are signed with
+  (X-BetterContact-Signature header), as BETTERCONTACT_WEBHOOK_SECRET.
+
+Run standalone and point the connector at it:
+
+    python -m benchmarks.mock_bettercontact --port 8765 --enrichment-seconds 5 --throttle-rate 0.05
+    BETTERCONTACT_BASE_URL=http://127.0.0.1:8765 python main.py
+
+When a submit carries a "webhook" URL, the results are POSTed to it once the
+enrichment time has passed, like the real API does.
+
+GET /__stats returns call counters (with a count per response status); POST
+/__reset clears them. POST /__callback
+records any JSON body it receives and GET /__callbacks lists them, so the mock
+can also play the caller's callback endpoint in offline tests.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import math
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MockState:
+    """
+    Submitted requests and call counters, shared by all handler threads.
+    """
+
+    def __init__(self, enrichment_seconds=5.0, latency_seconds=0.0, latency_jitter=0.0,
+                 enrichment_jitter=0.0, not_found_rate=0.0, not_ready_rate=0.0, throttle_rate=0.0,
+                 error_rate=0.0, rejected_keys=(), slow_rate=0.0, slow_seconds=5.0, webhook_secret="",
+                 seed=None):
+        self.enrichment_seconds = enrichment_seconds
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.enrichment_jitter = enrichment_jitter
+        self.not_found_rate = not_found_rate
+        self.not_ready_rate = not_ready_rate
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.rejected_keys = set(rejected_keys or ())
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.webhook_secret = webhook_secret
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.callbacks = []
+            self.stats = {
+                "submits": 0,
+                "submitted_leads": 0,
+                "polls": 0,
+                "completed_polls": 0,
+                "webhooks_sent": 0,
+                "api_calls": 0,
+                "throttled": 0,
+                "failed": 0,
+                "rejected": 0,
+                "in_flight": 0,
+                "peak_in_flight": 0,
+                "responses": {}
+            }
+
+    def delay(self):
+        """
+        Sleep for this response's latency.
+        """
+        with self.lock:
+            seconds = self.latency_seconds + self.random.uniform(0, self.latency_jitter)
+            if self.random.random() < self.slow_rate:
+                seconds += self.slow_seconds
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def throttle(self):
+        """
+        Count an API call and decide whether it is answered 429.
+        """
+        with self.lock:
+            self.stats["api_calls"] += 1
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.stats["throttled"] += 1
+        return throttled
+
+    def fails(self):
+        """
+        Decide whether an API call is answered 503.
+        """
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.stats["failed"] += 1
+        return failed
+
+    def rejects(self, api_key):
+        """
+        Whether a call made with this API key is answered 401.
+        """
+        if api_key not in self.rejected_keys:
+            return False
+        with self.lock:
+            self.stats["rejected"] += 1
+        return True
+
+    def count_response(self, status_code):
+        with self.lock:
+            key = str(status_code)
+            self.stats["responses"][key] = self.stats["responses"].get(key, 0) + 1
+
+    def enrichment_time(self):
+        # Caller holds self.lock
+        if self.enrichment_jitter:
+            return self.enrichment_seconds * math.exp(self.random.gauss(0, self.enrichment_jitter))
+        return self.enrichment_seconds
+
+    def submit(self, leads, webhook=None):
+        request_id = uuid.uuid4().hex[:20]
+        with self.lock:
+            enrichment_time = self.enrichment_time()
+            self.requests[request_id] = {
+                "leads": leads,
+                "ready_at": time.time() + enrichment_time,
+                "delivered": False,
+                "lost": self.random.random() < self.not_found_rate,
+                "not_ready_once": self.random.random() < self.not_ready_rate
+            }
+            self.stats["submits"] += 1
+            self.stats["submitted_leads"] += len(leads)
+            self.stats["in_flight"] += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+        if webhook:
+            timer = threading.Timer(enrichment_time, self.push_webhook, args=(request_id, webhook))
+            timer.daemon = True
+            timer.start()
+        return request_id
+
+    def push_webhook(self, request_id, webhook):
+        status_code, body = self.poll(request_id, count=False)
+        if status_code != 200:
+            return
+        data = json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.webhook_secret:
+            headers["X-BetterContact-Signature"] = hmac.new(
+                self.webhook_secret.encode(), data, hashlib.sha256
+            ).hexdigest()
+        request = urllib.request.Request(webhook, data=data, headers=headers, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+            with self.lock:
+                self.stats["webhooks_sent"] += 1
+        except OSError:
+            pass
+
+    def poll(self, request_id, count=True):
+        with self.lock:
+            if count:
+                self.stats["polls"] += 1
+            entry = self.requests.get(request_id)
+            if entry is None or entry["lost"]:
+                return 404, {"success": False, "message": "Request not found"}
+            if count and entry["not_ready_once"]:
+                entry["not_ready_once"] = False
+                return 406, {"success": False, "message": "Unvalid request_id"}
+            if time.time() < entry["ready_at"]:
+                return 202, {"id": request_id, "status": "in progress"}
+            self.stats["completed_polls"] += 1
+            if not entry["delivered"]:
+                entry["delivered"] = True
+                self.stats["in_flight"] -= 1
+            leads = entry["leads"]
+        return 200, {
+            "id": request_id,
+            "status": "terminated",
+            "credits_consumed": len(leads),
+            "credits_left": "1000.0",
+            "data": [enriched_lead(lead) for lead in leads]
+        }
+
+
+def enriched_lead(lead):
+    """
+    Build a plausible enriched record for a submitted lead.
+    """
+    first_name = (lead.get("first_name") or "jane").strip()
+    last_name = (lead.get("last_name") or "doe").strip()
+    domain = lead.get("company_domain") or f"{(lead.get('company') or 'example').lower().replace(' ', '')}.com"
+    return {
+        "enriched": True,
+        "email_provider": "mock",
+        "contact_first_name": first_name,
+        "contact_last_name": last_name,
+        "contact_full_name": f"{first_name} {last_name}",
+        "contact_email_address": f"{first_name}.{last_name}@{domain}".lower(),
+        "contact_email_address_status": "deliverable",
+        "contact_phone_number": "+1 555-0100",
+        "company_name": lead.get("company", ""),
+        "company_domain": domain,
+        "contact_linkedin_profile_url": lead.get("linkedin_url", ""),
+        "custom_fields": lead.get("custom_fields", {})
+    }
+
+
+def make_handler(state):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status_code, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def send_api_json(self, status_code, body):
+            state.count_response(status_code)
+            self.send_json(status_code, body)
+
+        def send_throttled(self):
+            state.count_response(429)
+            self.send_json(429, {"success": False, "message": "Too many requests"}, {"Retry-After": "1"})
+
+        def send_unavailable(self):
+            state.count_response(503)
+            self.send_json(503, {"success": False, "message": "Service unavailable"})
+
+        def send_unauthorized(self):
+            state.count_response(401)
+            self.send_json(401, {"success": False, "message": "Unauthorized"})
+
+        def api_key(self):
+            return (parse_qs(urlparse(self.path).query).get("api_key") or [None])[0]
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            try:
+                return json.loads(self.rfile.read(length))
+            except ValueError:
+                return {}
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            body = self.read_json()
+            if path == "/__reset":
+                state.reset()
+                return self.send_json(200, {"success": True})
+            if path == "/__callback":
+                with state.lock:
+                    state.callbacks.append(body)
+                return self.send_json(200, {"success": True})
+            if path != "/api/v2/async":
+                return self.send_json(404, {"success": False, "message": "Not found"})
+            state.delay()
+            if state.throttle():
+                return self.send_throttled()
+            if state.fails():
+                return self.send_unavailable()
+            if state.rejects(self.api_key()):
+                return self.send_unauthorized()
+            leads = body.get("data") or []
+            if not leads:
+                return self.send_api_json(400, {"success": False, "message": "data must be a non-empty array"})
+            request_id = state.submit(leads, webhook=body.get("webhook"))
+            self.send_api_json(201, {
+                "success": True,
+                "id": request_id,
+                "message": "Processing. Once done, data will be pushed to your webhook."
+            })
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/__stats":
+                with state.lock:
+                    return self.send_json(200, dict(state.stats, responses=dict(state.stats["responses"])))
+            if path == "/__callbacks":
+                with state.lock:
+                    return self.send_json(200, {"callbacks": list(state.callbacks)})
+            for prefix in ("/api/v2/async/", "/api/async/"):
+                if path.startswith(prefix):
+                    state.delay()
+                    if state.throttle():
+                        return self.send_throttled()
+                    if state.fails():
+                        return self.send_unavailable()
+                    if state.rejects(self.api_key()):
+                        return self.send_unauthorized()
+                    status_code, body = state.poll(path[len(prefix):])
+                    return self.send_api_json(status_code, body)
+            self.send_json(404, {"success": False, "message": "Not found"})
+
+    return MockHandler
+
+
+def start_mock_server(port=0, enrichment_seconds=5.0, latency_seconds=0.0, **options):
+    """
+    Start the mock in a background thread. Extra keyword arguments are the
+    MockState tuning options (latency_jitter, throttle_rate, ...).
+    Returns (server, state); the bound port is server.server_address[1].
+    """
+    state = MockState(enrichment_seconds=enrichment_seconds, latency_seconds=latency_seconds, **options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, state
+
+
+def add_tuning_arguments(parser):
+    """
+    Add the mock's tuning options to a benchmark's argument parser.
+    """
+    parser.add_argument("--latency-jitter", type=float, default=0.0,
+                        help="Upper bound of an extra random delay per API response (seconds)")
+    parser.add_argument("--enrichment-jitter", type=float, default=0.0,
+                        help="Log-normal sigma of the per-request enrichment time")
+    parser.add_argument("--not-found-rate", type=float, default=0.0,
+                        help="Share of requests whose results answer 404")
+    parser.add_argument("--not-ready-rate", type=float, default=0.0,
+                        help="Share of requests whose first poll answers 406")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Share of API calls answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of API calls answered 503")
+    parser.add_argument("--rejected-key", action="append", default=[],
+                        help="API key answered 401 (repeatable)")
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="Share of API responses delayed by --slow-seconds more")
+    parser.add_argument("--slow-seconds", type=float, default=5.0,
+                        help="Extra delay of slow responses (seconds)")
+    parser.add_argument("--webhook-secret", default="",
+                        help="Sign webhook pushes with this BETTERCONTACT_WEBHOOK_SECRET")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def tuning_options(args):
+    return {
+        "latency_jitter": args.latency_jitter,
+        "enrichment_jitter": args.enrichment_jitter,
+        "not_found_rate": args.not_found_rate,
+        "not_ready_rate": args.not_ready_rate,
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+        "rejected_keys": args.rejected_key,
+        "slow_rate": args.slow_rate,
+        "slow_seconds": args.slow_seconds,
+        "webhook_secret": args.webhook_secret,
+        "seed": args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the BetterContact async API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--enrichment-seconds", type=float, default=5.0,
+                        help="Seconds a request answers 202 before results are ready")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Extra seconds added to every API response")
+    add_tuning_arguments(parser)
+    args = parser.parse_args()
+
+    state = MockState(
+        enrichment_seconds=args.enrichment_seconds,
+        latency_seconds=args.latency,
+        **tuning_options(args)
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"Mock BetterContact API listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Replay a completion-time trace against the fixed and the adaptive poll schedules.
+
+Each trace row is a request of some enrichment type that completed N seconds
+after submission. For every request the replay places polls the way the
+poller would, with the fixed progressive schedule and with the adaptive
+schedule learned (as in production) only from the requests replayed before
+it, and reports polls per request and how late the completion was noticed.
+Run from the repo root:
+
+    python -m benchmarks.poll_replay --trace benchmarks/traces/completion_times_sample.csv
+
+The bundled trace is a synthetic sample (log-normal, medians of 6 s for
+email, 12 s for phone and 15 s for both). To replay real traffic, point
+--state-db at a state database the connector has been recording into; its
+completion intervals are replayed at their midpoints.
+"""
+import argparse
+import csv
+import sqlite3
+
+from src.core import poll_schedule
+from src.core.poller import DEFAULT_MAX_WAIT, INITIAL_DELAY, next_delay
+
+# Replayed requests per type between schedule recomputations (REFRESH_SECONDS in production)
+REFRESH_EVERY = 25
+
+
+def load_trace(path):
+    with open(path, newline="") as trace:
+        return [
+            (row["enrichment_type"], float(row["completion_seconds"]))
+            for row in csv.DictReader(trace)
+        ]
+
+
+def load_recorded(state_db):
+    connection = sqlite3.connect(state_db)
+    rows = connection.execute(
+        "SELECT enrichment_type, lower_seconds, upper_seconds FROM poll_completion_samples ORDER BY id"
+    ).fetchall()
+    connection.close()
+    return [(label, (lower + upper) / 2) for label, lower, upper in rows]
+
+
+def poll_times(offsets, max_wait):
+    """
+    Poll times after submission: the learned offsets (if any), then the
+    fixed progressive delays, as ResultPoller schedules them.
+    """
+    times = []
+    elapsed = offsets[0] if offsets else INITIAL_DELAY
+    while elapsed <= max_wait:
+        times.append(elapsed)
+        later = [offset for offset in offsets or () if offset >= elapsed + poll_schedule.MIN_GAP]
+        elapsed = later[0] if later else elapsed + next_delay(len(times))
+    return times
+
+
+def replay(trace, adaptive, max_wait):
+    samples = {}
+    schedules = {}
+    polls = []
+    lateness = []
+    timeouts = 0
+
+    for index, (label, completion) in enumerate(trace):
+        offsets = None
+        if adaptive:
+            known = samples.setdefault(label, [])
+            if label not in schedules or index % REFRESH_EVERY == 0:
+                recent = known[-poll_schedule.MAX_SAMPLES:]
+                schedules[label] = (
+                    poll_schedule.quantile_offsets(recent) if len(recent) >= poll_schedule.MIN_SAMPLES else None
+                )
+            offsets = schedules[label]
+
+        previous = 0.0
+        for count, at in enumerate(poll_times(offsets, max_wait), start=1):
+            if at >= completion:
+                polls.append(count)
+                lateness.append(at - completion)
+                if adaptive:
+                    samples[label].append((previous, at))
+                break
+            previous = at
+        else:
+            timeouts += 1
+
+    lateness.sort()
+    return {
+        "polls": sum(polls) / len(polls) if polls else 0,
+        "mean": sum(lateness) / len(lateness) if lateness else 0,
+        "p50": lateness[len(lateness) // 2] if lateness else 0,
+        "p95": lateness[int(len(lateness) * 0.95)] if lateness else 0,
+        "timeouts": timeouts
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed vs adaptive poll schedule on a completion-time trace")
+    parser.add_argument("--trace", default="benchmarks/traces/completion_times_sample.csv")
+    parser.add_argument("--state-db", help="Replay completions recorded in this state database instead")
+    parser.add_argument("--max-wait", type=float, default=DEFAULT_MAX_WAIT)
+    args = parser.parse_args()
+
+    trace = load_recorded(args.state_db) if args.state_db else load_trace(args.trace)
+
+    print(f"\n{len(trace)} requests, {args.max_wait:g}s max wait\n")
+    print(f"{'schedule':<10}{'polls/request':>15}{'late mean':>12}{'late p50':>11}{'late p95':>11}{'timeouts':>10}")
+    for name, adaptive in (("fixed", False), ("adaptive", True)):
+        row = replay(trace, adaptive, args.max_wait)
+        print(
+            f"{name:<10}{row['polls']:>15.2f}{row['mean']:>11.2f}s{row['p50']:>10.2f}s"
+            f"{row['p95']:>10.2f}s{row['timeouts']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
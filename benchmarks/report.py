@@ -0,0 +1,85 @@
+"""
+Latency/throughput summaries for the benchmarks, and regression checks
+against a saved baseline.
+"""
+import json
+
+
+def percentile(ordered, quantile):
+    """
+    Nearest-rank percentile of an already sorted list (None when empty).
+    """
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(quantile * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, wall_time):
+    """
+    Summary of one operation: request count, errors, requests per second and
+    p50/p95/p99 latency in seconds.
+    """
+    ordered = sorted(latencies)
+    total = len(ordered) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / wall_time, 2) if wall_time else 0,
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99)
+    }
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1:
+        return f"{value * 1000:.0f}ms"
+    return f"{value:.2f}s"
+
+
+def print_report(report):
+    print(f"\n{report['title']}\n")
+    print(f"{'operation':<26}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, row in report["operations"].items():
+        print(
+            f"{name:<26}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9.2f}"
+            f"{format_seconds(row['p50']):>10}{format_seconds(row['p95']):>10}{format_seconds(row['p99']):>10}"
+        )
+    print()
+    for name, value in report["outbound"].items():
+        print(f"{name:<26}{str(value):>10}")
+
+
+def save(report, path):
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+
+
+def compare(report, baseline_path, tolerance):
+    """
+    List the metrics that got worse than the baseline by more than `tolerance`
+    (a fraction): higher latency percentiles and more outbound calls per lead.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = []
+    for name, row in report["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p50", "p95", "p99"):
+            if row[metric] is None or not before.get(metric):
+                continue
+            if row[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {before[metric]:.3f}s -> {row[metric]:.3f}s")
+
+    before = baseline.get("outbound", {}).get("calls_per_lead")
+    after = report["outbound"].get("calls_per_lead")
+    if before and after and after > before * (1 + tolerance):
+        regressions.append(f"calls_per_lead: {before} -> {after}")
+
+    return regressions
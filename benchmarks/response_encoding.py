@@ -0,0 +1,91 @@
+"""
+Size and encode/decode cost of enrichment result payloads.
+
+Builds a BetterContact results payload of N leads (with the mock's enriched
+lead records) and reports, for the full payload and for a projection to the
+email and phone fields:
+
+- bytes on the wire as JSON, and gzip / brotli compressed (brotli only when
+  the package is installed);
+- time to serialize with the json module and with orjson (when installed);
+- time the receiving side spends parsing it (json.loads).
+
+Run from the repo root:
+
+    python -m benchmarks.response_encoding --sizes 200,1000,5000
+
+The mock's lead records carry fewer fields than the real API's, so the real
+savings from projection are larger than reported here.
+"""
+import argparse
+import gzip
+import json
+import time
+
+from benchmarks.mock_bettercontact import enriched_lead
+from src.core import encoding, projection
+
+# What most workflows read
+DEFAULT_FIELDS = "contact_email_address,contact_email_address_status,contact_phone_number"
+
+
+def make_payload(count):
+    leads = [
+        {
+            "first_name": f"First{index}",
+            "last_name": "Last",
+            "company": "Example Corp",
+            "linkedin_url": f"https://www.linkedin.com/in/profile{index}",
+            "custom_fields": {"uuid": f"lead-{index}", "list_name": "Benchmark"}
+        }
+        for index in range(count)
+    ]
+    return {
+        "id": "e66d7d067cd7c84582dc",
+        "status": "terminated",
+        "credits_consumed": count,
+        "credits_left": "1000.0",
+        "data": [enriched_lead(lead) for lead in leads]
+    }
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="200,1000,5000", help="Comma-separated lead counts")
+    parser.add_argument("--fields", default=DEFAULT_FIELDS, help="Projection to compare with the full payload")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (the fastest is reported)")
+    args = parser.parse_args()
+
+    fields = projection.parse_fields(args.fields)
+    print(f"serializer: {'orjson' if encoding.orjson is not None else 'json (orjson not installed)'}, "
+          f"brotli: {'installed' if encoding.brotli is not None else 'not installed'}")
+    print(f"{'Leads':>6} {'Payload':<10} {'JSON':>10} {'gzip':>10} {'br':>10} "
+          f"{'json.dumps':>11} {'fast dumps':>11} {'parse':>9}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        full = make_payload(size)
+        for label, payload in (("full", full), ("projected", projection.project(full, fields))):
+            body = encoding.dumps(payload).encode("utf-8")
+            gzipped = len(gzip.compress(body, compresslevel=encoding.GZIP_LEVEL))
+            brotli_size = (
+                f"{len(encoding.brotli.compress(body, quality=encoding.BROTLI_QUALITY)):>10}"
+                if encoding.brotli is not None else f"{'-':>10}"
+            )
+            stdlib = best_time(lambda: json.dumps(payload), args.repeat)
+            fast = best_time(lambda: encoding.dumps(payload), args.repeat)
+            parse = best_time(lambda: json.loads(body), args.repeat)
+            print(f"{size:>6} {label:<10} {len(body):>10} {gzipped:>10} {brotli_size} "
+                  f"{stdlib * 1000:>9.2f}ms {fast * 1000:>9.2f}ms {parse * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Cold-start cost of the connector: app import time and gunicorn boot time.
+
+First imports main (and with it every module's route.py) in fresh
+interpreters with -X importtime and reports the median import time and the
+packages it goes to, then the same with BETTERCONTACT_LAZY_ROUTES, where no
+route.py is imported. Then boots gunicorn with and without
+GUNICORN_PRELOAD_APP and with lazy routes, and reports how long it takes
+until the first request is answered and how much memory (PSS) the master
+and workers use together.
+Run from the repo root (Linux only):
+
+    python -m benchmarks.startup_time --runs 5 --workers 4
+
+With preload the app is imported once in the master and the workers fork
+from it, so boot time stops growing with the number of workers and the
+imported code is shared between them.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.sync_capacity import REPO_ROOT, free_port
+
+# Packages listed in the import breakdown
+TOP_PACKAGES = 12
+
+
+def import_profile(state_db, lazy=False):
+    """
+    Import main in a fresh interpreter. Returns the total import time and the
+    self time per top-level package, in seconds.
+    """
+    env = dict(os.environ, BETTERCONTACT_STATE_DB=state_db, BETTERCONTACT_LAZY_ROUTES="true" if lazy else "false")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    packages = {}
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return sum(packages.values()), packages
+
+
+def process_pss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as rollup:
+            for line in rollup:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def boot(workers, preload, state_db, lazy=False, timeout=60):
+    """
+    Start gunicorn and wait for its first answered request. Returns the
+    seconds that took and the PSS (kB) of the master plus its workers.
+    """
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "BETTERCONTACT_STATE_DB": state_db,
+        "GUNICORN_WORKERS": str(workers),
+        "GUNICORN_PRELOAD_APP": "true" if preload else "false",
+        "BETTERCONTACT_LAZY_ROUTES": "true" if lazy else "false"
+    })
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--config", os.path.join(REPO_ROOT, "gunicorn_config.py"),
+            "--bind", f"127.0.0.1:{port}",
+            "main:app"
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        ready = None
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1):
+                    ready = time.perf_counter() - started
+                    break
+            except OSError:
+                time.sleep(0.02)
+        if ready is None:
+            raise RuntimeError("gunicorn did not answer in time")
+
+        # Let every worker finish booting before measuring memory
+        time.sleep(2)
+        with open(f"/proc/{server.pid}/task/{server.pid}/children") as children:
+            pids = [server.pid] + [int(pid) for pid in children.read().split()]
+        return ready, sum(process_pss_kb(pid) for pid in pids)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Repetitions of every measurement (median is reported)")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers to boot")
+    args = parser.parse_args()
+
+    state_db = os.path.join(tempfile.mkdtemp(prefix="bettercontact-startup-"), "state.db")
+
+    profiles = [import_profile(state_db) for _ in range(args.runs)]
+    print(f"import main: {statistics.median(total for total, _ in profiles) * 1000:.0f} ms (median of {args.runs})")
+    packages = {}
+    for _, profile in profiles:
+        for package, seconds in profile.items():
+            packages.setdefault(package, []).append(seconds)
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, seconds in ranked[:TOP_PACKAGES]:
+        print(f"  {package:<24} {statistics.median(seconds) * 1000:7.1f} ms")
+    lazy_total = statistics.median(import_profile(state_db, lazy=True)[0] for _ in range(args.runs))
+    print(f"import main with lazy routes: {lazy_total * 1000:.0f} ms")
+
+    print()
+    print(f"{'gunicorn boot':<16} {'workers':>7} {'first response':>15} {'total PSS':>12}")
+    for label, preload, lazy in (("no preload", False, False), ("preload", True, False), ("lazy routes", False, True)):
+        runs = [boot(args.workers, preload, state_db, lazy) for _ in range(args.runs)]
+        ready = statistics.median(seconds for seconds, _ in runs)
+        pss = statistics.median(kb for _, kb in runs)
+        print(f"{label:<16} {args.workers:>7} {ready:>14.2f}s {pss / 1024:>10.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
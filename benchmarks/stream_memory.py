@@ -0,0 +1,165 @@
+"""
+Peak worker memory of Enrich Leads (Stream) for growing upload sizes.
+
+Starts the mock BetterContact API, then for every row count boots a single
+gevent gunicorn worker, uploads that many NDJSON leads with chunked transfer
+encoding while reading the streamed results, and reports the worker's peak
+RSS (VmHWM). Run from the repo root (Linux only):
+
+    python -m benchmarks.stream_memory --rows 1000,10000,100000
+
+Peak RSS should stay about the same for every size, since the endpoint never
+holds more than its pending-submission window in memory.
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.mock_bettercontact import start_mock_server
+from benchmarks.sync_capacity import REPO_ROOT, free_port, wait_for_port
+
+# Leads per chunk of the chunked upload
+UPLOAD_BATCH = 500
+
+
+def start_app(port, mock_url, state_db):
+    env = dict(os.environ)
+    env.update({
+        "BETTERCONTACT_BASE_URL": mock_url,
+        "BETTERCONTACT_STATE_DB": state_db,
+        "GUNICORN_WORKER_CLASS": "gevent",
+        "GUNICORN_WORKERS": "1"
+    })
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--config", os.path.join(REPO_ROOT, "gunicorn_config.py"),
+            "--bind", f"127.0.0.1:{port}",
+            "main:app"
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def worker_peak_rss_kb(master_pid):
+    """
+    Peak resident memory (kB) of the gunicorn worker forked by master_pid.
+    """
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as children:
+        worker_pid = int(children.read().split()[0])
+    with open(f"/proc/{worker_pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return None
+
+
+def upload_blocks(row_count):
+    for start in range(0, row_count, UPLOAD_BATCH):
+        lines = [
+            json.dumps({
+                "first_name": "Lead",
+                "last_name": f"Number{index}",
+                "company_domain": "example.com"
+            })
+            for index in range(start, min(start + UPLOAD_BATCH, row_count))
+        ]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def stream_rows(port, row_count):
+    """
+    Upload row_count leads and read the results at the same time.
+    Returns (completed rows, summary).
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    connection.putrequest("POST", "/enrich_leads_stream/v1/execute?chunk_size=200")
+    connection.putheader("Authorization", "Bearer benchmark")
+    connection.putheader("Content-Type", "application/x-ndjson")
+    connection.putheader("Transfer-Encoding", "chunked")
+    connection.endheaders()
+
+    def upload():
+        for block in upload_blocks(row_count):
+            connection.send(b"%x\r\n%s\r\n" % (len(block), block))
+        connection.send(b"0\r\n\r\n")
+
+    # The endpoint streams results while it is still reading, so send and receive concurrently
+    uploader = threading.Thread(target=upload, daemon=True)
+    uploader.start()
+
+    response = connection.getresponse()
+    completed = 0
+    summary = None
+    for line in response:
+        row = json.loads(line)
+        if "summary" in row:
+            summary = row["summary"]
+        elif row.get("status") == "completed":
+            completed += 1
+    uploader.join()
+    connection.close()
+    return completed, summary
+
+
+def measure(row_count, mock_url):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as state_dir:
+        process = start_app(port, mock_url, os.path.join(state_dir, "state.db"))
+        try:
+            if not wait_for_port(port):
+                raise RuntimeError("gunicorn did not start")
+            started = time.time()
+            completed, summary = stream_rows(port, row_count)
+            wall_time = time.time() - started
+            peak_rss = worker_peak_rss_kb(process.pid)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    return {
+        "rows": row_count,
+        "completed": completed,
+        "submissions": (summary or {}).get("submissions"),
+        "wall_time": wall_time,
+        "peak_rss_mb": peak_rss / 1024 if peak_rss else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrich Leads (Stream) memory per upload size")
+    parser.add_argument("--rows", default="1000,10000,100000")
+    parser.add_argument("--enrichment-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server, state = start_mock_server(enrichment_seconds=args.enrichment_seconds)
+    mock_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results = []
+    for row_count in (int(value) for value in args.rows.split(",")):
+        state.reset()
+        results.append(measure(row_count, mock_url))
+
+    server.shutdown()
+
+    print(f"\nStreaming enrichment, 1 gevent worker, {args.enrichment_seconds}s enrichment time\n")
+    print(f"{'rows':>9}{'completed':>11}{'submissions':>13}{'wall time':>12}{'peak RSS':>12}")
+    for row in results:
+        peak = f"{row['peak_rss_mb']:.1f} MB" if row["peak_rss_mb"] is not None else "-"
+        print(
+            f"{row['rows']:>9}{row['completed']:>11}{row['submissions'] or 0:>13}"
+            f"{row['wall_time']:>11.1f}s{peak:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Concurrent-request capacity of Enrich Lead (Sync) per gunicorn worker class.
+
+Starts the mock BetterContact API, then for every worker class boots gunicorn
+with the repo's gunicorn_config.py, fires N concurrent sync enrichments and
+reports how many completed and how long they took. Run from the repo root:
+
+    python -m benchmarks.sync_capacity --concurrency 200 --enrichment-seconds 5
+
+With the sync worker (2 workers x 1 thread) requests are served two at a time,
+so wall time grows with N / 2 and most requests miss the deadline. With the
+gevent worker all N wait concurrently; their API calls are then paced by the
+client-side rate limiter (BETTERCONTACT_RATE_LIMIT calls per second per API
+key, shared by all workers), so with the defaults wall time is about
+API calls / 20 seconds rather than one enrichment time.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.mock_bettercontact import start_mock_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def start_app(worker_class, port, mock_url, workers):
+    env = dict(os.environ)
+    env.update({
+        "BETTERCONTACT_BASE_URL": mock_url,
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_WORKERS": str(workers)
+    })
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--config", os.path.join(REPO_ROOT, "gunicorn_config.py"),
+            "--bind", f"127.0.0.1:{port}",
+            "main:app"
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+
+def run_sync_enrichment(url, index, request_timeout):
+    payload = {
+        "data": {
+            "first_name": "Lead",
+            "last_name": f"Number{index}",
+            "company_domain": "example.com"
+        }
+    }
+    started = time.time()
+    try:
+        response = requests.post(url, json=payload, timeout=request_timeout)
+        ok = response.status_code == 200 and response.json().get("metadata", {}).get("status") == "completed"
+    except requests.exceptions.RequestException:
+        ok = False
+    return ok, time.time() - started
+
+
+def measure(worker_class, concurrency, mock_url, workers, request_timeout):
+    port = free_port()
+    process = start_app(worker_class, port, mock_url, workers)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"gunicorn ({worker_class}) did not start")
+
+        url = f"http://127.0.0.1:{port}/enrich_lead_sync/v1/execute"
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(
+                lambda index: run_sync_enrichment(url, index, request_timeout),
+                range(concurrency)
+            ))
+        wall_time = time.time() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    completed = len(latencies)
+    return {
+        "worker_class": worker_class,
+        "requests": concurrency,
+        "completed": completed,
+        "wall_time": wall_time,
+        "p50": latencies[completed // 2] if latencies else None,
+        "max": latencies[-1] if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrich Lead (Sync) capacity per worker class")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--enrichment-seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--worker-classes", default="sync,gevent")
+    parser.add_argument("--request-timeout", type=float, default=60.0,
+                        help="Client-side timeout for each sync enrichment")
+    args = parser.parse_args()
+
+    server, state = start_mock_server(enrichment_seconds=args.enrichment_seconds)
+    mock_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    rows = []
+    for worker_class in args.worker_classes.split(","):
+        state.reset()
+        row = measure(worker_class.strip(), args.concurrency, mock_url, args.workers, args.request_timeout)
+        row["peak_in_flight"] = state.stats["peak_in_flight"]
+        row["api_calls"] = state.stats["api_calls"]
+        rows.append(row)
+
+    server.shutdown()
+
+    print(f"\n{args.concurrency} concurrent sync enrichments, {args.workers} workers, "
+          f"{args.enrichment_seconds}s enrichment time\n")
+    print(f"{'worker class':<14}{'completed':>11}{'wall time':>12}{'p50':>9}{'max':>9}{'peak in-flight':>16}{'API calls':>11}")
+    for row in rows:
+        p50 = f"{row['p50']:.1f}s" if row["p50"] is not None else "-"
+        slowest = f"{row['max']:.1f}s" if row["max"] is not None else "-"
+        print(
+            f"{row['worker_class']:<14}{row['completed']:>5}/{row['requests']:<5}"
+            f"{row['wall_time']:>11.1f}s{p50:>9}{slowest:>9}{row['peak_in_flight']:>16}{row['api_calls']:>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
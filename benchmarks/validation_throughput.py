@@ -0,0 +1,61 @@
+"""
+Throughput of lead validation for the batch and streaming paths.
+
+Validates generated lead lists with leads.validate_leads, which checks
+the whole list against the lead schema in one pydantic call and then applies
+the Clay rules. Some leads are invalid on purpose. The report gives leads per
+millisecond for each list size. Run from the repo root:
+
+    python -m benchmarks.validation_throughput --sizes 100,1000,10000 --invalid-rate 0.05
+"""
+import argparse
+import random
+import time
+
+from src.core.leads import validate_leads
+
+
+def make_leads(count, invalid_rate, rng):
+    leads = []
+    for index in range(count):
+        lead = {
+            "first_name": f" First{index} ",
+            "last_name": "Last",
+            "company": "Example Corp",
+            "company_domain": f"https://www.Example{index % 200}.com/about",
+            "linkedin_url": f"linkedin.com/in/Profile{index}/",
+            "custom_fields": {"uuid": f"lead-{index}"}
+        }
+        if rng.random() < invalid_rate:
+            # Either a wrong type or a lead the Clay rules reject
+            if rng.random() < 0.5:
+                lead['first_name'] = ["not", "a", "name"]
+            else:
+                del lead['company'], lead['company_domain']
+        leads.append(lead)
+    return leads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated list sizes")
+    parser.add_argument("--invalid-rate", type=float, default=0.05, help="Share of invalid leads")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per size (the fastest is reported)")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'Leads':>8} {'Invalid':>8} {'Time':>10} {'Leads/ms':>10}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        leads = make_leads(size, args.invalid_rate, rng)
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            results = validate_leads(leads)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        invalid = sum(1 for _, error in results if error)
+        print(f"{size:>8} {invalid:>8} {best * 1000:>8.2f}ms {size / (best * 1000):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,7 @@
 # https://docs.gunicorn.org/en/stable/settings.html
-bind = "0.0.0.0:8080"
-# Enable prints to be shown immediately
-accesslog = "-"  # Print access log to stdout
-errorlog = "-"   # Print error log to stdout
-capture_output = True
-enable_stdio_inheritance = True
+# The settings live in the repo root's gunicorn_config.py; this file runs it so both paths stay in step.
+import os
 
-workers = 2
-threads = 1
-timeout = 360
+_root_config = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gunicorn_config.py")
+with open(_root_config) as _config_file:
+    exec(compile(_config_file.read(), _root_config, "exec"))
@@ -1,4 +1,6 @@
 # https://docs.gunicorn.org/en/stable/settings.html
+import os
+
 bind = "0.0.0.0:8080"
 # Enable prints to be shown immediately
 accesslog = "-"  # Print access log to stdout
@@ -6,6 +8,35 @@ errorlog = "-"   # Print error log to stdout
 capture_output = True
 enable_stdio_inheritance = True
 
-workers = 2
-threads = 1
-timeout = 360
+# Enrich Lead (Sync) spends almost all of its time waiting on BetterContact.
+# The gevent worker turns those waits (time.sleep and socket I/O) into
+# cooperative yields, so a worker can hold hundreds of in-flight requests
+# instead of one. GUNICORN_WORKER_CLASS=sync restores one request per worker.
+# How fast those requests finish is then set by the client-side rate limiter
+# (src/core/rate_limiter.py): by default 20 API calls per second and 20 calls
+# in flight per API key, host-wide. Calls are short, so the in-flight cap
+# rarely binds; the rate does. 200 concurrent sync enrichments on one key
+# complete in about 15 s (see the sync_capacity benchmark in the README).
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
+
+# Import the app once in the master before forking, so workers start with every
+# module already loaded (and share those pages) instead of each importing them.
+# gevent must patch the standard library before anything else is imported,
+# otherwise locks and thread locals created at import time stay unpatched.
+preload_app = os.environ.get("GUNICORN_PRELOAD_APP", "false").lower() in ("1", "true", "yes")
+if preload_app and worker_class == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+# Enrich Lead (Sync) caps its time budget just below this (src/core/deadline.py reads the same variable)
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 360))
+
+
+def post_worker_init(worker):
+    # Start the background poller with the worker so it resumes polling requests
+    # a stopped worker was watching without waiting for the first request
+    from src.core.poller import get_poller
+    get_poller()
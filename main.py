@@ -1,9 +1,65 @@
-from flask import Flask
+import logging
+import os
+from flask import Flask, Response, jsonify, request
 from workflows_cdk import Router
+from src.core import circuit_breaker, deadline, encoding, metrics
+
+# Background work (poller, callbacks, circuit breaker, result export) reports through `logging`.
+# Records go to stderr, which gunicorn passes on, unless logging was configured before this import.
+logging.basicConfig(
+    level=os.environ.get("BETTERCONTACT_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s [%(process)d] [%(levelname)s] %(name)s: %(message)s"
+)
+
+# Import each module's route.py on its first request instead of at startup (see src/core/lazy_routes.py)
+LAZY_ROUTES = os.environ.get("BETTERCONTACT_LAZY_ROUTES", "false").lower() in ("1", "true", "yes")
 
 # Create Flask app
 app = Flask(__name__)
-router = Router(app)
+# Serialize responses with orjson when it is installed (see src/core/encoding.py)
+app.json = encoding.JSONProvider(app)
+if LAZY_ROUTES:
+    from src.core.lazy_routes import LazyRouter
+    router = LazyRouter(app)
+else:
+    router = Router(app)
+
+# Time every module request by stage and outcome (see src/core/metrics.py)
+@app.before_request
+def start_request_metrics():
+    metrics.start_request(request.path)
+
+@app.after_request
+def finish_request_metrics(response):
+    return metrics.finish_request(response)
+
+# A request's time budget ends with it; the worker thread may serve the next request (see src/core/deadline.py)
+@app.teardown_request
+def clear_deadline(exception):
+    deadline.clear()
+
+# Compress responses the client accepts compressed (runs before the metrics hook above)
+@app.after_request
+def compress_response(response):
+    return encoding.compress_response(response, request.accept_encodings)
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Load balancer health check: 503 while a circuit breaker around the BetterContact API is open.
+# Half-open circuits are healthy: only real traffic can probe and close them.
+@app.route("/health", methods=["GET"])
+def health():
+    circuits = circuit_breaker.state()
+    tripped = [circuit for circuit in circuits.values() if circuit['state'] == "open"]
+    recovering = any(circuit['state'] == "half_open" for circuit in circuits.values())
+    status = "degraded" if tripped else "recovering" if recovering else "ok"
+    response = jsonify({"status": status, "circuits": circuits})
+    if tripped:
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, int(max(c['retry_after_seconds'] for c in tripped) + 0.999)))
+    return response
 
 if __name__ == "__main__":
-    router.run_app(app)
\ No newline at end of file
+    router.run_app(app)
@@ -0,0 +1,286 @@
+"""
+Circuit breaker around the BetterContact API, per endpoint (submit, poll).
+
+Every worker keeps the outcomes of its recent calls to each endpoint. When
+at least MIN_CALLS calls were made in the last WINDOW_SECONDS and
+FAILURE_RATE of them failed (connection errors, timeouts and 5xx answers;
+429s are the rate limiter's business), the endpoint's circuit opens: calls
+fail at once with CircuitOpenError instead of tying up a worker for a full
+timeout. The opening is written to the shared SQLite database, so every
+worker on the host fails fast from then on, not only the one that noticed.
+
+Once OPEN_SECONDS have passed the circuit is half-open: each worker lets one
+call through as a probe while the others keep failing fast. A probe that
+succeeds closes the circuit for every worker; one that fails opens it again.
+
+state() reports every circuit for the /health endpoint, which answers 503
+only while a circuit is open. A half-open circuit is reported healthy: its
+probe is a real call, so a load balancer has to keep sending traffic for the
+circuit to close again. Storage errors never
+block a call: the worker then goes by what it saw itself.
+"""
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+from src.core import metrics, storage
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ENABLED = os.environ.get("BETTERCONTACT_BREAKER_ENABLED", "true").lower() not in ("0", "false", "no")
+# Outcomes older than this are forgotten (seconds)
+WINDOW_SECONDS = float(os.environ.get("BETTERCONTACT_BREAKER_WINDOW", 30))
+# Calls needed in the window before the circuit can open
+MIN_CALLS = int(os.environ.get("BETTERCONTACT_BREAKER_MIN_CALLS", 10))
+# Share of failed calls in the window that opens the circuit
+FAILURE_RATE = float(os.environ.get("BETTERCONTACT_BREAKER_FAILURE_RATE", 0.5))
+# How long an open circuit fails calls before letting a probe through (seconds)
+OPEN_SECONDS = float(os.environ.get("BETTERCONTACT_BREAKER_OPEN_SECONDS", 30))
+
+# Circuits guarded, by http_client stage
+ENDPOINTS = ("submit", "poll")
+# How long a worker trusts its last read of the shared state (seconds)
+CHECK_INTERVAL = 1.0
+# Callers are asked to come back no sooner than this while a probe is running (seconds)
+PROBE_RETRY_AFTER = 1.0
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS circuit_breakers (
+    endpoint TEXT PRIMARY KEY,
+    opened_at REAL NOT NULL,
+    open_until REAL NOT NULL
+);
+""")
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of calling an endpoint whose circuit is open. Being a
+    requests exception, callers that don't handle it specially report it like
+    any other failed call; `retry_after` says when to try again (seconds).
+    """
+
+    def __init__(self, endpoint, retry_after):
+        self.endpoint = endpoint
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(
+            f"BetterContact API is failing ({endpoint} calls paused). Retry in {self.retry_after} seconds"
+        )
+
+
+class _Circuit:
+    """
+    One endpoint's circuit as seen by this worker.
+    """
+
+    def __init__(self):
+        # (time, failed) of recent calls
+        self.outcomes = collections.deque()
+        self.failures = 0
+        self.open_until = 0.0
+        self.opened_at = 0.0
+        # A probe is in flight until this time
+        self.probe_until = 0.0
+        # (checked_at, opened_at, open_until) of the last read of the shared state
+        self.shared = (0.0, 0.0, 0.0)
+
+
+_circuits = {}
+_circuits_lock = threading.Lock()
+_circuits_pid = None
+
+
+def _circuit(endpoint):
+    global _circuits, _circuits_pid
+
+    pid = os.getpid()
+    if _circuits_pid != pid:
+        # A forked worker starts from a clean slate
+        with _circuits_lock:
+            if _circuits_pid != pid:
+                _circuits = {name: _Circuit() for name in ENDPOINTS}
+                _circuits_pid = pid
+    return _circuits.get(endpoint)
+
+
+def _read_shared(endpoint, circuit, now):
+    """
+    Bring the worker's view of the circuit up to date with the shared state.
+    """
+    if now - circuit.shared[0] <= CHECK_INTERVAL:
+        return
+    try:
+        row = storage.run_blocking(_fetch_shared, endpoint)
+    except (sqlite3.Error, OSError):
+        return
+    opened_at, open_until = (row['opened_at'], row['open_until']) if row else (0.0, 0.0)
+    with _circuits_lock:
+        if opened_at > circuit.opened_at:
+            # Another worker opened (or reopened) the circuit
+            circuit.opened_at = opened_at
+            circuit.open_until = open_until
+            circuit.probe_until = 0.0
+        elif not row and circuit.open_until and circuit.shared[2]:
+            # Another worker's probe succeeded and closed it
+            _reset(circuit)
+        circuit.shared = (now, opened_at, open_until)
+
+
+def _fetch_shared(endpoint):
+    return storage.get_connection().execute(
+        "SELECT opened_at, open_until FROM circuit_breakers WHERE endpoint = ?",
+        (endpoint,)
+    ).fetchone()
+
+
+def before_call(endpoint):
+    """
+    Let a call to `endpoint` through, or raise CircuitOpenError. Returns
+    True when the call is the half-open circuit's probe.
+    """
+    circuit = _circuit(endpoint)
+    if not BREAKER_ENABLED or circuit is None:
+        return False
+
+    now = time.time()
+    _read_shared(endpoint, circuit, now)
+    with _circuits_lock:
+        if not circuit.open_until:
+            return False
+        if now < circuit.open_until:
+            retry_after = circuit.open_until - now
+        elif now < circuit.probe_until:
+            retry_after = PROBE_RETRY_AFTER
+        else:
+            # Half-open: this call finds out whether the API is back
+            circuit.probe_until = now + OPEN_SECONDS
+            return True
+
+    metrics.increment("bettercontact_circuit_open_calls_total", endpoint=endpoint)
+    raise CircuitOpenError(endpoint, retry_after)
+
+
+def record(endpoint, failed, probe=False):
+    """
+    Count the outcome of a call to `endpoint`. A failed probe reopens the
+    circuit, a successful one closes it. `failed` is None when the call says
+    nothing about the API (cut short by the caller's own deadline).
+    """
+    circuit = _circuit(endpoint)
+    if not BREAKER_ENABLED or circuit is None:
+        return
+
+    now = time.time()
+    with _circuits_lock:
+        if failed is None:
+            if probe:
+                # Let the next call probe instead
+                circuit.probe_until = 0.0
+            return
+        if probe:
+            change = _open(circuit, now) if failed else _close(circuit, now)
+        else:
+            circuit.outcomes.append((now, failed))
+            circuit.failures += failed
+            while circuit.outcomes and circuit.outcomes[0][0] < now - WINDOW_SECONDS:
+                circuit.failures -= circuit.outcomes.popleft()[1]
+
+            calls = len(circuit.outcomes)
+            if circuit.open_until or calls < MIN_CALLS or circuit.failures < FAILURE_RATE * calls:
+                return
+            change = _open(circuit, now)
+
+    # Shared state is written after the lock is released, so no caller waits on the database for it
+    _publish(endpoint, change)
+
+
+def _reset(circuit):
+    # Caller holds _circuits_lock
+    circuit.outcomes.clear()
+    circuit.failures = 0
+    circuit.open_until = 0.0
+    circuit.opened_at = 0.0
+    circuit.probe_until = 0.0
+
+
+def _open(circuit, now):
+    # Caller holds _circuits_lock; returns the change for _publish
+    reopened = bool(circuit.open_until)
+    _reset(circuit)
+    circuit.opened_at = now
+    circuit.open_until = now + OPEN_SECONDS
+    circuit.shared = (now, now, circuit.open_until)
+    return ("reopened" if reopened else "opened", now, circuit.open_until)
+
+
+def _close(circuit, now):
+    # Caller holds _circuits_lock; returns the change for _publish
+    _reset(circuit)
+    circuit.shared = (now, 0.0, 0.0)
+    return ("closed", 0.0, 0.0)
+
+
+def _publish(endpoint, change):
+    """
+    Report a circuit's new state and write it to the shared state for the
+    other workers.
+    """
+    event, opened_at, open_until = change
+    try:
+        if event == "closed":
+            logger.info("Circuit for BetterContact %s calls closed", endpoint)
+            storage.run_blocking(_delete_shared, endpoint)
+            return
+        metrics.increment("bettercontact_circuit_opens_total", endpoint=endpoint)
+        logger.warning("Circuit for BetterContact %s calls %s for %g seconds", endpoint, event, OPEN_SECONDS)
+        storage.run_blocking(_write_shared, endpoint, opened_at, open_until)
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def _delete_shared(endpoint):
+    storage.get_connection().execute("DELETE FROM circuit_breakers WHERE endpoint = ?", (endpoint,))
+
+
+def _write_shared(endpoint, opened_at, open_until):
+    storage.get_connection().execute(
+        """
+        INSERT INTO circuit_breakers (endpoint, opened_at, open_until) VALUES (?, ?, ?)
+        ON CONFLICT (endpoint) DO UPDATE SET opened_at = excluded.opened_at, open_until = excluded.open_until
+        """,
+        (endpoint, opened_at, open_until)
+    )
+
+
+def state():
+    """
+    Every circuit's state ("closed", "open" or "half_open") as this worker
+    sees it, with the seconds until a probe is let through and the calls and
+    failures in the current window.
+    """
+    now = time.time()
+    circuits = {}
+    for endpoint in ENDPOINTS:
+        circuit = _circuit(endpoint)
+        _read_shared(endpoint, circuit, now)
+        with _circuits_lock:
+            if not BREAKER_ENABLED or not circuit.open_until:
+                status = "closed"
+            elif now < circuit.open_until:
+                status = "open"
+            else:
+                status = "half_open"
+            calls = sum(1 for at, _ in circuit.outcomes if at >= now - WINDOW_SECONDS)
+            failures = sum(failed for at, failed in circuit.outcomes if at >= now - WINDOW_SECONDS)
+            circuits[endpoint] = {
+                "state": status,
+                "retry_after_seconds": round(max(circuit.open_until - now, 0), 1) if status != "closed" else 0,
+                "window_calls": calls,
+                "window_failures": failures
+            }
+    return circuits
@@ -0,0 +1,405 @@
+"""
+Completion delivery for submitted enrichment requests.
+
+Callers that do not want to poll subscribe a request ID with a callback URL
+and/or ask for the result to be queued for pickup. Completion is detected in
+one of two ways:
+
+- BetterContact calls our webhook endpoint (enrichment_callbacks/v1/webhook)
+  when BETTERCONTACT_WEBHOOK_URL is configured and passed on submission;
+- otherwise the local background poller stands in for the webhook.
+
+Either way complete() delivers the result exactly once per subscription:
+POSTed to the callback URL and/or stored in the pickup queue. Subscriptions
+and the queue live in the shared SQLite database, so a webhook landing on any
+worker reaches subscriptions made on another.
+
+Webhook payloads are written into the dedup store, result export, email
+pattern index and pickup queue, so the webhook is only used with a secret:
+without BETTERCONTACT_WEBHOOK_SECRET the local poller is used and the
+endpoint refuses every push. A push must carry the HMAC-SHA256 of its body,
+keyed with the secret, in the WEBHOOK_SIGNATURE_HEADER header. The secret
+itself never travels in the webhook URL, where access logs would record it.
+
+Callback URLs are POSTed to from the server, so they must not reach the
+host's own network: a URL whose host resolves to a private, loopback,
+link-local or otherwise non-public address is refused, when the caller
+passes it and again before every delivery, and redirects are not followed.
+Each delivery connects to the exact address it checked (the URL's host is
+still sent as the Host header and TLS server name), so a host that resolves
+differently the second time cannot redirect the POST to an internal address.
+BETTERCONTACT_CALLBACK_ALLOWED_HOSTS restricts callbacks to the listed hosts
+(and their subdomains) instead, whatever they resolve to.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.core import dedup_store, email_patterns, export_sink, http_client, job_store, storage
+from src.core.poller import get_poller
+from src.core.result_cache import api_key_hash, get_result_cache
+
+logger = logging.getLogger(__name__)
+
+# Public URL of the enrichment_callbacks/v1/webhook endpoint; empty means "use the local poller"
+WEBHOOK_URL = os.environ.get("BETTERCONTACT_WEBHOOK_URL", "")
+# Key of the HMAC that signs webhook pushes; the webhook is off without it
+WEBHOOK_SECRET = os.environ.get("BETTERCONTACT_WEBHOOK_SECRET", "")
+# Header carrying the hex HMAC-SHA256 of a push's body (optionally prefixed "sha256=")
+WEBHOOK_SIGNATURE_HEADER = os.environ.get("BETTERCONTACT_WEBHOOK_SIGNATURE_HEADER", "X-BetterContact-Signature")
+# Hosts callbacks may be sent to (comma-separated, subdomains included); empty allows any public host
+CALLBACK_ALLOWED_HOSTS = [
+    host.strip().lower().lstrip(".")
+    for host in os.environ.get("BETTERCONTACT_CALLBACK_ALLOWED_HOSTS", "").split(",")
+    if host.strip()
+]
+# How long the local poller keeps watching a request for its subscribers (seconds)
+WATCH_MAX_WAIT = float(os.environ.get("BETTERCONTACT_CALLBACK_MAX_WAIT", 1800))
+
+CALLBACK_TIMEOUT = 10
+CALLBACK_RETRIES = 3
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS completion_subscriptions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id TEXT NOT NULL,
+    api_key_hash TEXT NOT NULL,
+    callback_url TEXT,
+    queue_result INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    delivered_at REAL
+);
+CREATE INDEX IF NOT EXISTS completion_subscriptions_request_id ON completion_subscriptions (request_id);
+CREATE TABLE IF NOT EXISTS completion_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    request_id TEXT NOT NULL,
+    api_key_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload_json TEXT,
+    error TEXT,
+    completed_at REAL NOT NULL,
+    picked_up_at REAL
+);
+CREATE INDEX IF NOT EXISTS completion_queue_pending ON completion_queue (api_key_hash, picked_up_at);
+""")
+
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    logger.warning("BETTERCONTACT_WEBHOOK_URL is set without BETTERCONTACT_WEBHOOK_SECRET; using the local poller instead")
+
+_callback_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bettercontact-callback")
+
+
+def webhook_url():
+    """
+    URL to pass to BetterContact as the webhook, or None when webhooks are not
+    configured (or have no secret).
+    """
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        return None
+    return WEBHOOK_URL
+
+
+def webhook_signature(body):
+    """
+    Hex HMAC-SHA256 of a push's raw body, keyed with the webhook secret.
+    """
+    return hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def webhook_signature_valid(body, signature):
+    """
+    Whether `signature` (a header value) signs `body` with the webhook secret.
+    """
+    if not WEBHOOK_SECRET or not signature:
+        return False
+    if signature.lower().startswith("sha256="):
+        signature = signature[len("sha256="):]
+    return hmac.compare_digest(signature.strip().lower(), webhook_signature(body))
+
+
+def callback_url_error(callback_url):
+    """
+    Why a callback URL may not be used, or None when it may.
+    """
+    return _check_callback_url(callback_url)[0]
+
+
+def _check_callback_url(callback_url):
+    """
+    (error, address): why a callback URL may not be used, or None and the
+    checked address to connect to (None for BETTERCONTACT_CALLBACK_ALLOWED_HOSTS
+    hosts, which are used as they resolve).
+    """
+    try:
+        parsed = urlparse(callback_url)
+        host = (parsed.hostname or "").lower()
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return "Callback URL is not a valid URL", None
+    if parsed.scheme not in ("http", "https") or not host:
+        return "Callback URL must be an http(s) URL", None
+
+    if CALLBACK_ALLOWED_HOSTS:
+        if any(host == allowed or host.endswith(f".{allowed}") for allowed in CALLBACK_ALLOWED_HOSTS):
+            return None, None
+        return f"Callback host '{host}' is not in BETTERCONTACT_CALLBACK_ALLOWED_HOSTS", None
+
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)]
+    except (socket.gaierror, UnicodeError):
+        return f"Callback host '{host}' could not be resolved", None
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global:
+            return "Callback URL must not point to a private, loopback or link-local address", None
+    return None, addresses[0]
+
+
+@storage.off_hub
+def subscribe(api_key, request_id, callback_url=None, queue_result=True):
+    storage.get_connection().execute(
+        """
+        INSERT INTO completion_subscriptions (request_id, api_key_hash, callback_url, queue_result, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (request_id, api_key_hash(api_key), callback_url or None, 1 if queue_result else 0, time.time())
+    )
+
+
+def track(api_key, request_id, callback_url=None, queue_result=True, webhook_registered=False):
+    """
+    Subscribe to a request's completion. Unless BetterContact was given our
+    webhook for this request, the local poller watches it instead.
+    """
+    subscribe(api_key, request_id, callback_url, queue_result)
+    if not webhook_registered:
+        watch_with_poller(api_key, request_id)
+
+
+def watch_with_poller(api_key, request_id):
+    """
+    Stand in for the webhook: poll the request in the background and complete it when done.
+    """
+    future = get_poller().register(api_key, request_id, max_wait=WATCH_MAX_WAIT)
+    future.add_done_callback(lambda done: complete_from_outcome(request_id, done.result()))
+
+
+def complete(request_id, status, data=None, error=None):
+    """
+    Deliver a final result to every pending subscription of a request ID.
+    Returns the number of subscriptions delivered.
+    """
+    delivered, callback_urls = _claim_subscriptions(request_id, status, data, error)
+    for callback_url in callback_urls:
+        _callback_executor.submit(_post_callback, callback_url, {
+            "request_id": request_id,
+            "status": status,
+            "data": data,
+            "error": error
+        })
+    return delivered
+
+
+@storage.off_hub
+def _claim_subscriptions(request_id, status, data, error):
+    """
+    Mark a request's pending subscriptions delivered and queue the result for
+    those that asked. Returns (count, callback URLs to POST to).
+    """
+    connection = storage.get_connection()
+    rows = connection.execute(
+        "SELECT id, api_key_hash, callback_url, queue_result FROM completion_subscriptions "
+        "WHERE request_id = ? AND delivered_at IS NULL",
+        (request_id,)
+    ).fetchall()
+
+    delivered = 0
+    callback_urls = []
+    now = time.time()
+    for row in rows:
+        # Claim the subscription so a concurrent webhook/poller completion cannot deliver it twice
+        claimed = connection.execute(
+            "UPDATE completion_subscriptions SET delivered_at = ? WHERE id = ? AND delivered_at IS NULL",
+            (now, row['id'])
+        ).rowcount
+        if not claimed:
+            continue
+        delivered += 1
+
+        if row['queue_result']:
+            connection.execute(
+                """
+                INSERT INTO completion_queue (request_id, api_key_hash, status, payload_json, error, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (request_id, row['api_key_hash'], status,
+                 json.dumps(data) if data is not None else None, error, now)
+            )
+        if row['callback_url']:
+            callback_urls.append(row['callback_url'])
+
+    return delivered, callback_urls
+
+
+def receive_webhook(payload):
+    """
+    Handle a completion payload pushed by BetterContact.
+    Returns the request ID, or None when the payload does not carry one.
+    """
+    request_id = payload.get('id') or payload.get('request_id')
+    if not request_id:
+        return None
+
+    status = (payload.get('status') or '').lower()
+    if status in ('failed', 'error'):
+        complete(request_id, "failed", error=payload.get('message', 'Enrichment failed'))
+        dedup_store.forget_request(request_id)
+        job_store.finish(request_id, "failed")
+    else:
+        # The webhook does not say which API key submitted the request; its subscriptions do
+        key_hashes = _subscribed_key_hashes(request_id)
+        complete(request_id, "completed", data=payload)
+        dedup_store.record_result(request_id, payload)
+        export_sink.export(None, request_id, payload)
+        for key_hash in key_hashes:
+            email_patterns.learn_for_key_hash(key_hash, payload)
+        job_store.finish(request_id, "completed")
+    return request_id
+
+
+@storage.off_hub
+def _subscribed_key_hashes(request_id):
+    return [
+        row['api_key_hash'] for row in storage.get_connection().execute(
+            "SELECT DISTINCT api_key_hash FROM completion_subscriptions WHERE request_id = ?", (request_id,)
+        )
+    ]
+
+
+@storage.off_hub
+def pickup(api_key, request_ids=None, limit=100):
+    """
+    Return queued results for an API key and mark them as picked up.
+    """
+    connection = storage.get_connection()
+    query = (
+        "SELECT id, request_id, status, payload_json, error, completed_at FROM completion_queue "
+        "WHERE api_key_hash = ? AND picked_up_at IS NULL"
+    )
+    params = [api_key_hash(api_key)]
+    if request_ids:
+        query += f" AND request_id IN ({','.join('?' for _ in request_ids)})"
+        params.extend(request_ids)
+    query += " ORDER BY id LIMIT ?"
+    params.append(limit)
+
+    results = []
+    now = time.time()
+    for row in connection.execute(query, params).fetchall():
+        claimed = connection.execute(
+            "UPDATE completion_queue SET picked_up_at = ? WHERE id = ? AND picked_up_at IS NULL",
+            (now, row['id'])
+        ).rowcount
+        if not claimed:
+            continue
+        results.append({
+            "request_id": row['request_id'],
+            "status": row['status'],
+            "data": json.loads(row['payload_json']) if row['payload_json'] else None,
+            "error": row['error'],
+            "completed_at": row['completed_at']
+        })
+    return results
+
+
+def deliver_existing(api_key, request_id, result, callback_url=None, queue_result=True):
+    """
+    Subscribe and immediately deliver a result that is already known (e.g. a deduplicated lead).
+    """
+    subscribe(api_key, request_id, callback_url, queue_result)
+    get_result_cache().put_completed(api_key, request_id, result)
+    return complete(request_id, "completed", data=result)
+
+
+def complete_from_outcome(request_id, outcome):
+    """
+    Deliver a poller outcome to the request's subscriptions, if it has any.
+    """
+    try:
+        if outcome['status'] == 'completed':
+            complete(request_id, "completed", data=outcome['data'])
+        else:
+            complete(request_id, outcome['status'], error=outcome.get('error'))
+    except sqlite3.Error as e:
+        logger.warning("Could not deliver completion for request %s: %s", request_id, e)
+
+
+def _post_callback(callback_url, body):
+    for attempt in range(CALLBACK_RETRIES + 1):
+        # Checked again at every attempt: the host may resolve elsewhere by now
+        error, address = _check_callback_url(callback_url)
+        if error:
+            logger.warning("Callback for request %s not sent to %s: %s", body['request_id'], callback_url, error)
+            return
+        try:
+            response = _send_pinned(callback_url, address, body)
+            if response.status_code < 500 and response.status_code != 429:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        if attempt < CALLBACK_RETRIES:
+            time.sleep(http_client.backoff_delay(attempt))
+    logger.warning("Callback delivery failed for request %s to %s", body['request_id'], callback_url)
+
+
+class _PinnedHostAdapter(HTTPAdapter):
+    """
+    HTTPS to a URL whose host was replaced by its checked address: the
+    original host name is still used for SNI and certificate verification.
+    """
+
+    def __init__(self, hostname):
+        self.hostname = hostname
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['server_hostname'] = self.hostname
+        kwargs['assert_hostname'] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _send_pinned(callback_url, address, body):
+    """
+    POST `body` to the callback URL, connected to `address` rather than to
+    whatever its host resolves to now. With no address, the URL is used as is.
+    """
+    with requests.Session() as session:
+        if address is None:
+            return session.post(callback_url, json=body, timeout=CALLBACK_TIMEOUT, allow_redirects=False)
+
+        parsed = urlparse(callback_url)
+        host = parsed.hostname
+        netloc = f"[{address}]" if ":" in address else address
+        if parsed.port:
+            netloc = f"{netloc}:{parsed.port}"
+        pinned_url = parsed._replace(netloc=netloc).geturl()
+        # The Host header keeps the name (and any explicit port) the caller gave
+        host_header = parsed.netloc.rsplit("@", 1)[-1]
+        if parsed.scheme == "https":
+            session.mount(f"https://{netloc}/", _PinnedHostAdapter(host))
+        return session.post(
+            pinned_url, json=body, headers={"Host": host_header}, timeout=CALLBACK_TIMEOUT, allow_redirects=False
+        )
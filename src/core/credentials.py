@@ -0,0 +1,155 @@
+"""
+API key resolution and the rejected-key cooldown.
+
+resolve() finds the API key in a module's connection input, whichever of the
+shapes the workflow platform sends it in. With no connection at all it falls
+back to the test key, unless BETTERCONTACT_STRICT_CREDENTIALS is set.
+
+A key BetterContact answered 401 for is remembered as rejected for
+REJECTION_COOLDOWN seconds in the shared SQLite database, so every worker
+on the host knows it. Requests with a rejected key are turned away by
+resolve() before any work is done, and http_client answers calls made with
+it with a local 401 instead of a round trip. A misconfigured workflow
+retrying a bad key then costs one API call per cooldown instead of one per
+request, and leaves the outbound rate limit to working keys. Lookups are
+cached in each worker for CHECK_INTERVAL seconds.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from src.core import metrics, storage
+from src.core.result_cache import api_key_hash
+
+# Without strict mode, requests without a connection use this key (local testing)
+TEST_API_KEY = "2d7316008303a1c3400d"
+STRICT = os.environ.get("BETTERCONTACT_STRICT_CREDENTIALS", "false").lower() in ("1", "true", "yes")
+# How long a key BetterContact rejected is refused locally (seconds); 0 turns the cooldown off
+REJECTION_COOLDOWN = float(os.environ.get("BETTERCONTACT_REJECTED_KEY_COOLDOWN", 300))
+# How long a worker trusts its last lookup of a key (seconds)
+CHECK_INTERVAL = 1.0
+# Keys whose last lookup a worker remembers
+MAX_CACHED_KEYS = 10000
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS rejected_api_keys (
+    api_key_hash TEXT PRIMARY KEY,
+    rejected_until REAL NOT NULL
+);
+""")
+
+# key hash -> (checked_at, rejected_until)
+_checked = {}
+_checked_lock = threading.Lock()
+
+
+def api_key_from_connection(connection):
+    """
+    The API key in a connection dict, or None when there is none.
+    """
+    if not isinstance(connection, dict):
+        return None
+    # Directly in the connection
+    if 'api_key_bearer' in connection:
+        return connection['api_key_bearer']
+    # In connection_data.value, or connection_data itself
+    if 'connection_data' in connection:
+        connection_data = connection.get('connection_data') or {}
+        if 'value' in connection_data:
+            return (connection_data['value'] or {}).get('api_key_bearer')
+        return connection_data.get('api_key_bearer')
+    # In value directly
+    if 'value' in connection:
+        return (connection['value'] or {}).get('api_key_bearer')
+    return None
+
+
+def resolve(connection):
+    """
+    The API key for a module request. Returns (api_key, None), or
+    (None, error message) when there is no usable key.
+    """
+    if not connection and not STRICT:
+        api_key = TEST_API_KEY
+    else:
+        api_key = api_key_from_connection(connection)
+
+    if not api_key:
+        return None, "API key not found in connection"
+    return check(api_key)
+
+
+def check(api_key):
+    """
+    (api_key, None) unless the key is in its rejection cooldown.
+    """
+    if is_rejected(api_key):
+        metrics.set_outcome("rejected_key")
+        return None, "Invalid API key or unauthorized access"
+    return api_key, None
+
+
+def is_rejected(api_key):
+    """
+    Whether BetterContact rejected this key within the cooldown.
+    """
+    if REJECTION_COOLDOWN <= 0:
+        return False
+
+    key_hash = api_key_hash(api_key)
+    now = time.time()
+    cached = _checked.get(key_hash)
+    if cached is None or now - cached[0] > CHECK_INTERVAL:
+        cached = (now, _read_rejection(key_hash))
+        _remember(key_hash, cached)
+    return cached[1] > now
+
+
+def reject(api_key):
+    """
+    BetterContact answered 401 for this key: refuse it locally for the cooldown.
+    """
+    if REJECTION_COOLDOWN <= 0:
+        return
+
+    key_hash = api_key_hash(api_key)
+    now = time.time()
+    rejected_until = now + REJECTION_COOLDOWN
+    _remember(key_hash, (now, rejected_until))
+    _store_rejection(key_hash, rejected_until, now)
+
+
+@storage.off_hub
+def _read_rejection(key_hash):
+    try:
+        row = storage.get_connection().execute(
+            "SELECT rejected_until FROM rejected_api_keys WHERE api_key_hash = ?",
+            (key_hash,)
+        ).fetchone()
+    except (sqlite3.Error, OSError):
+        return 0.0
+    return row['rejected_until'] if row else 0.0
+
+
+@storage.off_hub
+def _store_rejection(key_hash, rejected_until, now):
+    try:
+        connection = storage.get_connection()
+        connection.execute(
+            """
+            INSERT INTO rejected_api_keys (api_key_hash, rejected_until) VALUES (?, ?)
+            ON CONFLICT (api_key_hash) DO UPDATE SET rejected_until = excluded.rejected_until
+            """,
+            (key_hash, rejected_until)
+        )
+        connection.execute("DELETE FROM rejected_api_keys WHERE rejected_until < ?", (now,))
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def _remember(key_hash, entry):
+    with _checked_lock:
+        if len(_checked) >= MAX_CACHED_KEYS and key_hash not in _checked:
+            _checked.clear()
+        _checked[key_hash] = entry
@@ -0,0 +1,115 @@
+"""
+End-to-end time budgets for requests that wait on BetterContact.
+
+A route starts a deadline for its context; every call http_client makes
+under it has its connect and read timeouts, rate-limit wait and retry
+backoff cut to the time remaining, and fails with DeadlineExceeded once
+none is left. Poller threads run each poll under its job's expiry the same
+way, so no single call can outlive the wait it belongs to.
+
+A deadline lasts until clear() is called: main.py clears it when each
+request ends, so a thread that serves requests one after another (sync and
+gthread workers) never carries an expired budget into the next one.
+
+Budgets are capped below the gunicorn worker timeout (GUNICORN_TIMEOUT, the
+same setting gunicorn_config.py reads) so a request answers before the
+server would kill it.
+"""
+import contextvars
+import os
+import time
+
+import requests
+
+# gunicorn's worker timeout; gunicorn_config.py reads the same variable
+SERVER_TIMEOUT = float(os.environ.get("GUNICORN_TIMEOUT", 360))
+# Time kept back from every budget to build and send the response (seconds)
+RESPONSE_MARGIN = float(os.environ.get("BETTERCONTACT_DEADLINE_MARGIN", 0.25))
+# Longest budget a caller may ask for
+MAX_BUDGET = max(SERVER_TIMEOUT - 2 * RESPONSE_MARGIN, 1)
+# Shortest budget that leaves room for a submit and a poll
+MIN_BUDGET = 1
+
+_deadline = contextvars.ContextVar("bettercontact_deadline", default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised when a call is attempted with no time left in the budget.
+    Being a requests Timeout, routes report it like any other API timeout.
+    """
+
+
+def budget(requested, default):
+    """
+    Seconds a request may take: the caller's `requested` value (or `default`
+    when empty), within MIN_BUDGET and MAX_BUDGET. Raises ValueError when the
+    value is not a number.
+    """
+    if requested is None or requested == "":
+        requested = default
+    return min(max(float(requested), MIN_BUDGET), MAX_BUDGET)
+
+
+def start(seconds, started_at=None):
+    """
+    Give the current context (request, greenlet or thread) a deadline
+    `seconds` after `started_at` (default now), less the response margin.
+    Returns the deadline as a Unix timestamp.
+    """
+    at = (started_at or time.time()) + seconds - RESPONSE_MARGIN
+    _deadline.set(at)
+    return at
+
+
+def until(at):
+    """
+    Run the current context's calls under an absolute deadline (None for no limit).
+    """
+    _deadline.set(at)
+
+
+def clear():
+    """
+    Remove the current context's deadline.
+    """
+    _deadline.set(None)
+
+
+def remaining():
+    """
+    Seconds left before the current context's deadline, or None without one.
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    return max(at - time.time(), 0.0)
+
+
+def bound(seconds):
+    """
+    `seconds` cut to the time remaining. Raises DeadlineExceeded when none is left.
+    """
+    left = remaining()
+    if left is None:
+        return seconds
+    if left <= 0:
+        raise DeadlineExceeded("Deadline reached before the call could be made")
+    return min(seconds, left)
+
+
+def check():
+    """
+    Raise DeadlineExceeded when the current context's deadline has passed.
+    Used to tell a timeout the budget caused from one the API caused.
+    """
+    if remaining() == 0:
+        raise DeadlineExceeded("Deadline reached while waiting for BetterContact")
+
+
+def allows(seconds):
+    """
+    Whether waiting `seconds` still leaves time for another call.
+    """
+    left = remaining()
+    return left is None or seconds < left
@@ -0,0 +1,244 @@
+"""
+Content-addressed deduplication of lead submissions.
+
+Every submitted lead is fingerprinted from its normalized identity (name,
+company domain or name, LinkedIn slug) and the enrichment options. The
+fingerprint maps to the request ID it was submitted under and, once that
+request completes, to its results. A repeat of the same lead within the
+retention window reuses the existing request ID or results instead of being
+submitted (and billed) again.
+
+State lives in the shared SQLite database, so all worker processes see the
+same submissions.
+
+A lead submitted together with others shares their request ID, and the
+request's results hold every one of them. Callers enriching a single lead
+only reuse a request that held that lead alone, or the lead's own entry of a
+completed request's results (see lead_result); they never hand out a request
+ID that would give access to other leads.
+
+Storage errors never fail an enrichment: a lookup that
+cannot be answered is treated as a miss and a record that cannot be written is
+skipped.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import time
+
+from src.core import storage
+from src.core.result_cache import api_key_hash
+
+DEDUP_ENABLED = os.environ.get("BETTERCONTACT_DEDUP_ENABLED", "true").lower() not in ("0", "false", "no")
+# Seconds a submission can be reused (default 7 days)
+DEDUP_RETENTION = float(os.environ.get("BETTERCONTACT_DEDUP_RETENTION", 7 * 24 * 3600))
+# Share of new submissions that also purge expired rows
+PURGE_PROBABILITY = 0.01
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS lead_submissions (
+    fingerprint TEXT PRIMARY KEY,
+    api_key_hash TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    lead_uuid TEXT,
+    submitted_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lead_submissions_request_id ON lead_submissions (request_id);
+CREATE TABLE IF NOT EXISTS submitted_requests (
+    request_id TEXT PRIMARY KEY,
+    lead_count INTEGER NOT NULL,
+    submitted_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS request_results (
+    request_id TEXT PRIMARY KEY,
+    result_json TEXT NOT NULL,
+    completed_at REAL NOT NULL
+);
+""")
+
+_LINKEDIN_SLUG = re.compile(r"linkedin\.com/(?:in|pub)/([^/?#]+)", re.IGNORECASE)
+
+
+def normalize_domain(value):
+    """
+    Reduce a domain or URL to its lowercased host without "www.".
+    """
+    value = (value or "").strip().lower()
+    value = re.sub(r"^[a-z]+://", "", value)
+    value = value.split("/")[0].split("?")[0]
+    if value.startswith("www."):
+        value = value[4:]
+    return value
+
+
+def linkedin_slug(url):
+    """
+    Extract the profile slug from a LinkedIn URL, or the lowercased input when it is not one.
+    """
+    url = (url or "").strip()
+    match = _LINKEDIN_SLUG.search(url)
+    if match:
+        return match.group(1).lower()
+    return url.lower().rstrip("/")
+
+
+def lead_fingerprint(api_key, lead, enrich_email, enrich_phone):
+    """
+    Fingerprint of a lead for a given API key and set of enrichment options.
+    """
+    identity = {
+        "key": api_key_hash(api_key),
+        "first_name": (lead.get('first_name') or "").strip().lower(),
+        "last_name": (lead.get('last_name') or "").strip().lower(),
+        "company_domain": normalize_domain(lead.get('company_domain')),
+        "company": "" if lead.get('company_domain') else (lead.get('company') or "").strip().lower(),
+        "linkedin": linkedin_slug(lead.get('linkedin_url')),
+        "email": bool(enrich_email),
+        "phone": bool(enrich_phone)
+    }
+    encoded = json.dumps(identity, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+@storage.off_hub
+def lookup(fingerprint):
+    """
+    Return the live submission for a fingerprint as a dict with "request_id",
+    "lead_uuid", "submitted_at", "result" (None until completed) and
+    "lead_count" (leads submitted under the request ID, None when unknown), or None.
+    """
+    if not DEDUP_ENABLED:
+        return None
+
+    try:
+        row = storage.get_connection().execute(
+            """
+            SELECT s.request_id, s.lead_uuid, s.submitted_at, r.result_json, q.lead_count
+            FROM lead_submissions s
+            LEFT JOIN request_results r ON r.request_id = s.request_id
+            LEFT JOIN submitted_requests q ON q.request_id = s.request_id
+            WHERE s.fingerprint = ? AND s.submitted_at > ?
+            """,
+            (fingerprint, time.time() - DEDUP_RETENTION)
+        ).fetchone()
+    except (sqlite3.Error, OSError):
+        return None
+
+    if row is None:
+        return None
+
+    result = json.loads(row['result_json']) if row['result_json'] else None
+    lead_count = row['lead_count']
+    if lead_count is None and isinstance(result, dict):
+        # Submitted before request sizes were recorded: its results tell
+        lead_count = len(result.get('data') or [])
+    return {
+        "request_id": row['request_id'],
+        "lead_uuid": row['lead_uuid'],
+        "submitted_at": row['submitted_at'],
+        "result": result,
+        "lead_count": lead_count
+    }
+
+
+def lead_result(existing):
+    """
+    The results of a looked-up submission narrowed to its own lead, or None
+    while the request is running or when the lead is missing from its results.
+    The request's ID and credit counts are left out: they are the shared
+    request's, not the lead's.
+    """
+    result = existing['result']
+    if not isinstance(result, dict) or not existing['lead_uuid']:
+        return None
+    leads = [
+        lead for lead in result.get('data') or []
+        if isinstance(lead, dict) and (lead.get('custom_fields') or {}).get('uuid') == existing['lead_uuid']
+    ]
+    if not leads:
+        return None
+    narrowed = {key: value for key, value in result.items() if key not in ("id", "credits_consumed", "credits_left")}
+    return dict(narrowed, id=None, data=leads[:1])
+
+
+@storage.off_hub
+def record_submission(api_key, fingerprint, request_id, lead_uuid=None, lead_count=1):
+    """
+    Record that a lead was submitted under `request_id`, together with
+    `lead_count` - 1 other leads.
+    """
+    if not DEDUP_ENABLED:
+        return
+    try:
+        now = time.time()
+        connection = storage.get_connection()
+        connection.execute(
+            """
+            INSERT OR REPLACE INTO lead_submissions (fingerprint, api_key_hash, request_id, lead_uuid, submitted_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (fingerprint, api_key_hash(api_key), request_id, lead_uuid, now)
+        )
+        connection.execute(
+            "INSERT OR IGNORE INTO submitted_requests (request_id, lead_count, submitted_at) VALUES (?, ?, ?)",
+            (request_id, lead_count, now)
+        )
+        if random.random() < PURGE_PROBABILITY:
+            purge_expired()
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def record_result(request_id, data):
+    """
+    Store the completed results for a request ID submitted through this store.
+    """
+    if not DEDUP_ENABLED:
+        return
+    try:
+        connection = storage.get_connection()
+        known = connection.execute(
+            "SELECT 1 FROM lead_submissions WHERE request_id = ? LIMIT 1", (request_id,)
+        ).fetchone()
+        if known is None:
+            return
+        connection.execute(
+            "INSERT OR REPLACE INTO request_results (request_id, result_json, completed_at) VALUES (?, ?, ?)",
+            (request_id, json.dumps(data), time.time())
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def forget_request(request_id):
+    """
+    Drop a request ID that failed or expired so its leads are submitted again next time.
+    """
+    if not DEDUP_ENABLED:
+        return
+    try:
+        connection = storage.get_connection()
+        connection.execute("DELETE FROM lead_submissions WHERE request_id = ?", (request_id,))
+        connection.execute("DELETE FROM request_results WHERE request_id = ?", (request_id,))
+        connection.execute("DELETE FROM submitted_requests WHERE request_id = ?", (request_id,))
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def purge_expired():
+    """
+    Delete submissions (and their results) older than the retention window.
+    """
+    cutoff = time.time() - DEDUP_RETENTION
+    connection = storage.get_connection()
+    connection.execute("DELETE FROM lead_submissions WHERE submitted_at <= ?", (cutoff,))
+    connection.execute(
+        "DELETE FROM request_results WHERE request_id NOT IN (SELECT request_id FROM lead_submissions)"
+    )
+    connection.execute("DELETE FROM submitted_requests WHERE submitted_at <= ?", (cutoff,))
@@ -0,0 +1,271 @@
+"""
+Per-domain email pattern index learned from completed enrichments.
+
+Every enriched lead with an email address is matched against the common
+ways companies build addresses from a person's name (first.last, flast,
+first, ...; see PATTERNS). The observation is stored per API key and email
+domain in the shared SQLite database, with whether BetterContact found the
+address deliverable. An address is stored once however often its results
+are fetched, so repeat fetches do not skew the counts.
+
+A domain's pattern is trusted once at least MIN_SAMPLES addresses were seen
+there and MIN_CONFIDENCE of them are deliverable addresses following the
+same pattern. Modules run in local-first mode then answer leads at that
+domain with the predicted address (status "predicted") instead of
+submitting them, which saves both the wait and the credits. Only email
+enrichment can be predicted: calls that ask for phone numbers are always
+submitted, as are leads without a first name, last name and company
+domain.
+
+Storage errors never fail an enrichment: nothing is learned and nothing is
+predicted.
+"""
+import os
+import random
+import re
+import sqlite3
+import time
+import unicodedata
+
+from src.core import metrics, storage
+from src.core.dedup_store import normalize_domain
+from src.core.result_cache import api_key_hash
+
+PATTERN_INDEX_ENABLED = os.environ.get("BETTERCONTACT_PATTERN_INDEX", "true").lower() not in ("0", "false", "no")
+# Addresses seen at a domain before its pattern is used
+MIN_SAMPLES = int(os.environ.get("BETTERCONTACT_PATTERN_MIN_SAMPLES", 5))
+# Share of a domain's addresses that must be deliverable and follow its pattern
+MIN_CONFIDENCE = float(os.environ.get("BETTERCONTACT_PATTERN_MIN_CONFIDENCE", 0.9))
+# Observations older than this are ignored and eventually deleted (seconds, default 180 days)
+RETENTION = float(os.environ.get("BETTERCONTACT_PATTERN_RETENTION", 180 * 24 * 3600))
+# Share of learned results that also purge expired observations
+PURGE_PROBABILITY = 0.01
+
+# Email statuses counted as deliverable
+DELIVERABLE_STATUSES = ("deliverable", "valid")
+# Pattern recorded for addresses that follow none of PATTERNS
+OTHER = "other"
+# email_provider of predicted leads
+PROVIDER = "pattern_index"
+
+# Local parts built from the normalized first (f) and last (l) name. When an
+# address matches several (short names), the first one listed is recorded.
+PATTERNS = (
+    ("first.last", lambda f, l: f"{f}.{l}"),
+    ("firstlast", lambda f, l: f"{f}{l}"),
+    ("flast", lambda f, l: f"{f[0]}{l}"),
+    ("f.last", lambda f, l: f"{f[0]}.{l}"),
+    ("first_last", lambda f, l: f"{f}_{l}"),
+    ("first-last", lambda f, l: f"{f}-{l}"),
+    ("first", lambda f, l: f),
+    ("firstl", lambda f, l: f"{f}{l[0]}"),
+    ("first.l", lambda f, l: f"{f}.{l[0]}"),
+    ("last.first", lambda f, l: f"{l}.{f}"),
+    ("lastfirst", lambda f, l: f"{l}{f}"),
+    ("lastf", lambda f, l: f"{l}{f[0]}"),
+    ("last", lambda f, l: l),
+    ("fl", lambda f, l: f"{f[0]}{l[0]}"),
+)
+_PATTERNS = dict(PATTERNS)
+
+_NOT_ALPHANUMERIC = re.compile(r"[^a-z0-9]")
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS email_pattern_observations (
+    api_key_hash TEXT NOT NULL,
+    email TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    deliverable INTEGER NOT NULL,
+    observed_at REAL NOT NULL,
+    PRIMARY KEY (api_key_hash, email)
+);
+CREATE INDEX IF NOT EXISTS email_pattern_observations_domain ON email_pattern_observations (api_key_hash, domain);
+""")
+
+
+def name_part(value):
+    """
+    A name as it appears in email addresses: lowercased, accents removed,
+    spaces, hyphens and apostrophes dropped ("Anne-Marie" -> "annemarie").
+    """
+    value = unicodedata.normalize("NFKD", value or "").encode("ascii", "ignore").decode("ascii")
+    return _NOT_ALPHANUMERIC.sub("", value.lower())
+
+
+def match_pattern(local_part, first_name, last_name):
+    """
+    The pattern an address's local part follows for this person, OTHER when
+    none, or None when the name is too incomplete to tell.
+    """
+    first, last = name_part(first_name), name_part(last_name)
+    if not first or not last:
+        return None
+    local_part = unicodedata.normalize("NFKD", local_part.lower().split("+")[0]).encode("ascii", "ignore").decode("ascii")
+    for pattern, build in PATTERNS:
+        if build(first, last) == local_part:
+            return pattern
+    return OTHER
+
+
+def learn(api_key, data):
+    """
+    Record the email patterns of a completed request's enriched leads.
+    """
+    if api_key:
+        learn_for_key_hash(api_key_hash(api_key), data)
+
+
+def learn_for_key_hash(key_hash, data):
+    """
+    learn() for callers that only know the API key's hash (the webhook).
+    """
+    if not PATTERN_INDEX_ENABLED or not isinstance(data, dict):
+        return
+    now = time.time()
+    rows = []
+    for lead in data.get('data') or []:
+        if not isinstance(lead, dict) or lead.get('email_provider') == PROVIDER:
+            continue
+        email = (lead.get('contact_email_address') or '').strip().lower()
+        local_part, _, domain = email.rpartition("@")
+        if not local_part or not domain:
+            continue
+        pattern = match_pattern(local_part, lead.get('contact_first_name'), lead.get('contact_last_name'))
+        if pattern is None:
+            continue
+        status = (lead.get('contact_email_address_status') or '').lower()
+        rows.append((key_hash, email, normalize_domain(domain), pattern, int(status in DELIVERABLE_STATUSES), now))
+    if not rows:
+        return
+    _store_observations(rows, now)
+
+
+@storage.off_hub
+def _store_observations(rows, now):
+    try:
+        connection = storage.get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                """
+                INSERT INTO email_pattern_observations (api_key_hash, email, domain, pattern, deliverable, observed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (api_key_hash, email) DO UPDATE SET
+                    pattern = excluded.pattern, deliverable = excluded.deliverable, observed_at = excluded.observed_at
+                """,
+                rows
+            )
+            if random.random() < PURGE_PROBABILITY:
+                connection.execute("DELETE FROM email_pattern_observations WHERE observed_at < ?", (now - RETENTION,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def domain_pattern(key_hash, domain):
+    """
+    What the index knows about a domain for one API key: its most common
+    deliverable pattern, the share of the domain's addresses that are
+    deliverable and follow it (confidence), and the address counts. None when
+    nothing was seen there.
+    """
+    try:
+        rows = storage.get_connection().execute(
+            """
+            SELECT pattern, COUNT(*) AS samples, SUM(deliverable) AS deliverable
+            FROM email_pattern_observations
+            WHERE api_key_hash = ? AND domain = ? AND observed_at >= ?
+            GROUP BY pattern
+            """,
+            (key_hash, domain, time.time() - RETENTION)
+        ).fetchall()
+    except (sqlite3.Error, OSError):
+        return None
+
+    samples = sum(row['samples'] for row in rows)
+    candidates = [row for row in rows if row['pattern'] != OTHER]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda row: (row['deliverable'], row['samples']))
+    return {
+        "domain": domain,
+        "pattern": best['pattern'],
+        "confidence": round(best['deliverable'] / samples, 3),
+        "samples": samples,
+        "pattern_samples": best['samples'],
+        "deliverable": best['deliverable']
+    }
+
+
+def can_predict(enrich_email, enrich_phone):
+    """
+    Whether a call with these enrichment options can be answered locally.
+    """
+    return PATTERN_INDEX_ENABLED and enrich_email and not enrich_phone
+
+
+class Predictor:
+    """
+    Local-first answers for the leads of one module call. Each domain is
+    looked up once per call.
+    """
+
+    def __init__(self, api_key):
+        self.key_hash = api_key_hash(api_key)
+        self._domains = {}
+
+    def predict(self, lead):
+        """
+        The predicted enriched lead for a lead object (as built for
+        BetterContact), or None when it has to be submitted.
+        """
+        domain = normalize_domain(lead.get('company_domain'))
+        first, last = name_part(lead.get('first_name')), name_part(lead.get('last_name'))
+        if not domain or not first or not last:
+            return None
+
+        if domain not in self._domains:
+            self._domains[domain] = domain_pattern(self.key_hash, domain)
+        known = self._domains[domain]
+        if known is None or known['samples'] < MIN_SAMPLES or known['confidence'] < MIN_CONFIDENCE:
+            return None
+
+        metrics.increment("bettercontact_predicted_leads_total")
+        first_name = lead.get('first_name', '')
+        last_name = lead.get('last_name', '')
+        return {
+            "enriched": True,
+            "email_provider": PROVIDER,
+            "contact_first_name": first_name,
+            "contact_last_name": last_name,
+            "contact_full_name": f"{first_name} {last_name}".strip(),
+            "contact_email_address": f"{_PATTERNS[known['pattern']](first, last)}@{domain}",
+            "contact_email_address_status": "predicted",
+            "company_name": lead.get('company', ''),
+            "company_domain": domain,
+            "contact_linkedin_profile_url": lead.get('linkedin_url', ''),
+            "email_pattern": {
+                "pattern": known['pattern'],
+                "confidence": known['confidence'],
+                "samples": known['samples']
+            },
+            "custom_fields": lead.get('custom_fields', {})
+        }
+
+
+def predict_result(prediction):
+    """
+    A BetterContact-shaped results payload holding one predicted lead, for
+    modules that return the API's payload as it is.
+    """
+    return {
+        "id": None,
+        "status": "predicted",
+        "credits_consumed": 0,
+        "data": [prediction]
+    }
@@ -0,0 +1,153 @@
+"""
+Response encoding: fast JSON serialization and negotiated compression.
+
+JSON responses are serialized with orjson when it is installed, several
+times faster than the standard library on large result sets, and fall back
+to the json module otherwise. Keys keep their insertion order, so results
+listed in input order stay in that order.
+
+Responses of at least MIN_BYTES are compressed when the client accepts it:
+brotli ("br") when the brotli package is installed, otherwise gzip.
+Streamed NDJSON responses are gzip-compressed as they go, flushing after
+every chunk so each result line still reaches the client as soon as it is
+ready. Compression time is recorded as the "compress" stage of the request
+metrics.
+"""
+import gzip
+import json
+import os
+import time
+import zlib
+
+from flask.json.provider import DefaultJSONProvider
+
+from src.core import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.environ.get("BETTERCONTACT_COMPRESSION", "true").lower() not in ("0", "false", "no")
+# Smaller bodies are sent as they are; compressing them saves next to nothing
+MIN_BYTES = int(os.environ.get("BETTERCONTACT_COMPRESS_MIN_BYTES", 1024))
+# Fast settings: most of the size reduction of the highest levels at a fraction of the CPU time
+GZIP_LEVEL = int(os.environ.get("BETTERCONTACT_GZIP_LEVEL", 5))
+BROTLI_QUALITY = int(os.environ.get("BETTERCONTACT_BROTLI_QUALITY", 4))
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/plain", "text/csv")
+
+
+def dumps(value):
+    """
+    Serialize `value` to a compact JSON string.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(value, default=_default, separators=(",", ":"))
+
+
+def _default(value):
+    # Types neither serializer handles natively, the way Flask's provider does
+    return DefaultJSONProvider.default(value)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider serializing with orjson when available. Replaces the
+    default provider on the app, so jsonify() and every module response use it.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            kwargs.setdefault("default", _default)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS) + b"\n",
+            mimetype=self.mimetype
+        )
+
+
+def choose_encoding(accept_encodings, streamed=False):
+    """
+    The Content-Encoding to answer with for a request's Accept-Encoding
+    header (werkzeug's parsed accept_encodings), or None.
+    """
+    offered = ["gzip"] if streamed or brotli is None else ["br", "gzip"]
+    return accept_encodings.best_match(offered)
+
+
+def compress_response(response, accept_encodings):
+    """
+    Flask after_request hook: compress the response body when the client
+    accepts it and the body is worth it.
+    """
+    if (
+        not COMPRESSION_ENABLED
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    if response.is_streamed:
+        if choose_encoding(accept_encodings, streamed=True) != "gzip":
+            return response
+        response.response = _gzip_stream(response.response, response.iter_encoded())
+        response.headers['Content-Encoding'] = "gzip"
+        response.headers.pop('Content-Length', None)
+        return response
+
+    body = response.get_data()
+    if len(body) < MIN_BYTES:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    started = time.perf_counter()
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    metrics.record("compress", time.perf_counter() - started)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _gzip_stream(original, chunks):
+    """
+    Gzip a streamed body chunk by chunk. Closing the stream closes the
+    original body too, so its cleanup (and the request metrics) still run.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            started = time.perf_counter()
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            metrics.record("compress", time.perf_counter() - started)
+            yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(original, 'close'):
+            original.close()
@@ -0,0 +1,436 @@
+"""
+Export of completed enrichment results to local files for analytics.
+
+When BETTERCONTACT_EXPORT_DIR is set, every completed request's results are
+appended to rolling files in that directory, one row per enriched lead with
+fixed columns (see COLUMNS). Fields outside those columns are kept as a JSON
+object in the `extra` column, so nothing BetterContact returns is lost.
+
+Results are exported where the connector first receives them: the background
+poller (Enrich Lead (Sync), Enrich Leads (Sync), Batch and Stream waits,
+completion subscriptions and job recovery), Get Enrichment Results fetches
+from the API and the BetterContact webhook. A request ID is exported once
+across all workers: the first worker to write it claims it in the shared
+SQLite database and the others skip it. Results served from the result cache
+or the dedup store were exported when they were first received.
+
+Callers only queue the results. A per-process writer thread flattens them
+and writes them in batches every FLUSH_SECONDS. When the queue is full
+(the disk cannot keep up) results are dropped rather than slowing the
+request down; the bettercontact_export_rows_total metric counts rows written
+and dropped.
+
+Formats:
+- jsonl: one JSON object per line, readable while the file is being written
+- parquet: needs pyarrow (requirements-parquet.txt), imported only when the
+  first Parquet file is opened. The file is written as `<name>.parquet.inprogress`
+  and renamed to `<name>.parquet` once complete, so readers globbing
+  *.parquet never see a half-written file. Without pyarrow the jsonl format
+  is used.
+
+Each worker writes its own files, named after the time they were opened and
+the worker's pid. A file is closed and a new one started once it reaches
+MAX_FILE_BYTES or ROTATE_SECONDS, and when the worker exits. Results still
+queued when a worker is killed are lost (at most FLUSH_SECONDS of them).
+"""
+import atexit
+import datetime
+import importlib.util
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from src.core import encoding, metrics, storage
+from src.core.result_cache import api_key_hash
+
+logger = logging.getLogger(__name__)
+
+# Directory the files are written to; empty disables the export
+EXPORT_DIR = os.environ.get("BETTERCONTACT_EXPORT_DIR", "")
+# "jsonl" or "parquet"
+EXPORT_FORMAT = os.environ.get("BETTERCONTACT_EXPORT_FORMAT", "jsonl").lower()
+# A file is rotated once it reaches this size (bytes) or age (seconds)
+MAX_FILE_BYTES = int(os.environ.get("BETTERCONTACT_EXPORT_MAX_BYTES", 64 * 1024 * 1024))
+ROTATE_SECONDS = float(os.environ.get("BETTERCONTACT_EXPORT_ROTATE_SECONDS", 3600))
+# How often queued results are written (seconds)
+FLUSH_SECONDS = float(os.environ.get("BETTERCONTACT_EXPORT_FLUSH_SECONDS", 5))
+# Completed requests a worker queues before dropping new ones
+MAX_QUEUED_RESULTS = int(os.environ.get("BETTERCONTACT_EXPORT_MAX_QUEUED", 1000))
+
+# Seconds a request ID stays claimed, so later fetches of the same results are not exported again
+CLAIM_RETENTION = 7 * 24 * 3600
+# Request IDs a worker remembers having queued, to skip repeats without a database round trip
+RECENT_REQUESTS = 10000
+
+# Fixed columns of every exported row, with their Arrow type names
+COLUMNS = (
+    ("request_id", "string"),
+    ("api_key_hash", "string"),
+    ("completed_at", "timestamp"),
+    ("lead_uuid", "string"),
+    ("list_name", "string"),
+    ("enriched", "bool"),
+    ("email_provider", "string"),
+    ("contact_first_name", "string"),
+    ("contact_last_name", "string"),
+    ("contact_full_name", "string"),
+    ("contact_email_address", "string"),
+    ("contact_email_address_status", "string"),
+    ("contact_phone_number", "string"),
+    ("contact_linkedin_profile_url", "string"),
+    ("company_name", "string"),
+    ("company_domain", "string"),
+    ("extra", "string"),
+)
+
+# Columns copied as they are from the enriched lead
+LEAD_COLUMNS = tuple(name for name, _ in COLUMNS[5:-1])
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS exported_requests (
+    request_id TEXT PRIMARY KEY,
+    exported_at REAL NOT NULL
+);
+""")
+
+
+def flatten(request_id, api_key, data, completed_at):
+    """
+    The rows of one completed request: one per enriched lead in its `data`
+    list, with the fixed columns filled in and every other field in `extra`.
+    """
+    key_hash = api_key_hash(api_key) if api_key else None
+    rows = []
+    for lead in (data or {}).get('data') or []:
+        if not isinstance(lead, dict):
+            continue
+        custom_fields = dict(lead.get('custom_fields') or {})
+        row = {
+            "request_id": request_id,
+            "api_key_hash": key_hash,
+            "completed_at": completed_at,
+            "lead_uuid": _text(custom_fields.pop('uuid', None)),
+            "list_name": _text(custom_fields.pop('list_name', None)),
+        }
+        for name in LEAD_COLUMNS:
+            row[name] = _text(lead.get(name))
+        enriched = lead.get('enriched')
+        row['enriched'] = enriched if enriched is None or isinstance(enriched, bool) else str(enriched).lower() == "true"
+        extra = {name: value for name, value in lead.items() if name not in LEAD_COLUMNS and name != 'custom_fields'}
+        if custom_fields:
+            extra['custom_fields'] = custom_fields
+        row['extra'] = encoding.dumps(extra) if extra else None
+        rows.append(row)
+    return rows
+
+
+def _text(value):
+    # Column values are strings; nested values are kept as JSON
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return encoding.dumps(value)
+    return str(value)
+
+
+class _JsonlFile:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, rows):
+        lines = []
+        for row in rows:
+            row = dict(row, completed_at=_isoformat(row['completed_at']))
+            lines.append(encoding.dumps(row) + "\n")
+        self.file.write("".join(lines))
+        self.file.flush()
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetFile:
+    def __init__(self, path):
+        # Imported here so workers exporting jsonl never load pyarrow
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.partial_path = path + ".inprogress"
+        self.writer = pyarrow.parquet.ParquetWriter(self.partial_path, _arrow_schema(pyarrow))
+
+    def write(self, rows):
+        columns = {name: [row[name] for row in rows] for name, _ in COLUMNS}
+        columns['completed_at'] = [
+            datetime.datetime.fromtimestamp(at, datetime.timezone.utc) for at in columns['completed_at']
+        ]
+        self.writer.write_table(self.pyarrow.table(columns, schema=self.writer.schema))
+
+    def size(self):
+        return os.path.getsize(self.partial_path)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.partial_path, self.path)
+
+
+def _arrow_schema(pyarrow):
+    types = {
+        "string": pyarrow.string(),
+        "bool": pyarrow.bool_(),
+        "timestamp": pyarrow.timestamp("ms", tz="UTC"),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def _isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+def _pyarrow_installed():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def file_format():
+    """
+    The format files are written in, after falling back to jsonl when
+    parquet was asked for without pyarrow installed.
+    """
+    if EXPORT_FORMAT == "parquet" and _pyarrow_installed():
+        return "parquet"
+    return "jsonl"
+
+
+class ExportSink:
+    """
+    Queue of completed results and the thread writing them to this
+    process's export files.
+    """
+
+    def __init__(self, directory, file_format):
+        self.directory = directory
+        self.format = file_format
+        self._queue = queue.Queue(maxsize=MAX_QUEUED_RESULTS)
+        self._recent = {}
+        self._recent_lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self._file = None
+        self._opened_at = 0.0
+        self._stopping = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="bettercontact-export", daemon=True)
+        self._thread.start()
+
+    def add(self, api_key, request_id, data):
+        """
+        Queue a completed request's results. Returns False when they are
+        skipped (already queued by this worker) or dropped (queue full).
+        """
+        with self._recent_lock:
+            if request_id in self._recent:
+                return False
+            self._recent[request_id] = True
+            if len(self._recent) > RECENT_REQUESTS:
+                # Forget the oldest half; the shared claim still catches their repeats
+                for old in list(self._recent)[:RECENT_REQUESTS // 2]:
+                    del self._recent[old]
+
+        try:
+            self._queue.put_nowait((request_id, api_key, data, time.time()))
+        except queue.Full:
+            with self._recent_lock:
+                self._recent.pop(request_id, None)
+            metrics.increment("bettercontact_export_rows_total", len((data or {}).get('data') or []), status="dropped")
+            return False
+        return True
+
+    def close(self, timeout=10):
+        """
+        Write what is queued and close the current file.
+        """
+        self._stopping.set()
+        try:
+            # Wake the writer now instead of at the end of its flush interval
+            self._queue.put_nowait((None, None, None, None))
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            stopping = self._stopping.is_set()
+            try:
+                if batch:
+                    self._write(batch)
+                if self._file is not None and (stopping or self._rotation_due()):
+                    self._close_file()
+            except Exception:
+                # Start a new file with the next batch rather than appending to a damaged one
+                logger.exception("Result export failed")
+                self._discard_file()
+            if stopping:
+                return
+
+    def _take_batch(self):
+        # Everything queued within one flush interval, or until close() is called
+        batch = []
+        flush_at = time.time() + FLUSH_SECONDS
+        while True:
+            try:
+                item = self._queue.get(timeout=max(flush_at - time.time(), 0))
+            except queue.Empty:
+                return batch
+            if item[0] is None:
+                return batch
+            batch.append(item)
+
+    def _write(self, batch):
+        rows = []
+        claimed = []
+        for request_id, api_key, data, completed_at in batch:
+            if not _claim(request_id):
+                continue
+            claimed.append(request_id)
+            rows.extend(flatten(request_id, api_key, data, completed_at))
+        if not rows:
+            return
+
+        try:
+            if self._file is not None and self._rotation_due():
+                self._close_file()
+            if self._file is None:
+                self._open_file()
+            self._file.write(rows)
+        except Exception:
+            # Let a later completion of the same requests export them
+            _release(claimed)
+            metrics.increment("bettercontact_export_rows_total", len(rows), status="dropped")
+            raise
+        metrics.increment("bettercontact_export_rows_total", len(rows), status="written")
+
+    def _rotation_due(self):
+        return self._file.size() >= MAX_FILE_BYTES or time.time() - self._opened_at >= ROTATE_SECONDS
+
+    def _open_file(self):
+        now = time.time()
+        stamp = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        name = f"enrichments-{stamp}-{os.getpid()}-{next(self._sequence)}.{self.format}"
+        path = os.path.join(self.directory, name)
+        self._file = _ParquetFile(path) if self.format == "parquet" else _JsonlFile(path)
+        self._opened_at = now
+
+    def _discard_file(self):
+        current, self._file = self._file, None
+        if current is not None:
+            try:
+                current.close()
+            except Exception:
+                pass
+
+    def _close_file(self):
+        current, self._file = self._file, None
+        current.close()
+        _purge_claims()
+
+
+@storage.off_hub
+def _claim(request_id):
+    """
+    Claim a request ID for export. False when another worker (or an earlier
+    completion) already exported it. Storage errors never block the export.
+    """
+    try:
+        return storage.get_connection().execute(
+            "INSERT OR IGNORE INTO exported_requests (request_id, exported_at) VALUES (?, ?)",
+            (request_id, time.time())
+        ).rowcount == 1
+    except (sqlite3.Error, OSError):
+        return True
+
+
+@storage.off_hub
+def _release(request_ids):
+    try:
+        connection = storage.get_connection()
+        for request_id in request_ids:
+            connection.execute("DELETE FROM exported_requests WHERE request_id = ?", (request_id,))
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def _purge_claims():
+    try:
+        storage.get_connection().execute(
+            "DELETE FROM exported_requests WHERE exported_at < ?", (time.time() - CLAIM_RETENTION,)
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+_sink = None
+_sink_pid = None
+_sink_lock = threading.Lock()
+
+
+def get_export_sink():
+    """
+    Return the export sink for the current process, starting its writer on
+    first use, or None when the export is disabled. A forked worker gets its
+    own writer and files.
+    """
+    global _sink, _sink_pid
+
+    if not EXPORT_DIR:
+        return None
+
+    pid = os.getpid()
+    if _sink is not None and _sink_pid == pid:
+        return _sink
+
+    with _sink_lock:
+        if _sink is None or _sink_pid != pid:
+            if EXPORT_FORMAT == "parquet" and not _pyarrow_installed():
+                logger.warning("BETTERCONTACT_EXPORT_FORMAT=parquet needs pyarrow; exporting results as jsonl")
+            _sink = ExportSink(EXPORT_DIR, file_format())
+            _sink_pid = pid
+
+    return _sink
+
+
+def export(api_key, request_id, data):
+    """
+    Queue the results of a completed request for export. Does nothing when
+    the export is disabled. `api_key` may be None when it is not known (the
+    webhook); the api_key_hash column is then empty.
+    """
+    sink = get_export_sink()
+    if sink is None or not request_id or not isinstance(data, dict):
+        return
+    try:
+        sink.add(api_key, request_id, data)
+    except Exception:
+        # The export never fails an enrichment
+        logger.exception("Result export failed")
+
+
+def close():
+    """
+    Flush and close this process's export file, when it has one. Runs when
+    the worker exits.
+    """
+    if _sink is not None and _sink_pid == os.getpid():
+        _sink.close()
+
+
+atexit.register(close)
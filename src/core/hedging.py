@@ -0,0 +1,186 @@
+"""
+Hedged BetterContact API calls, to cut the tail latency of results polls.
+
+A hedged call that has not answered once the endpoint's QUANTILE latency
+(observed by this worker) has passed sends the same request again; the
+connection pool gives it a connection of its own. The first answer wins and
+the other send is closed when it arrives. A send that fails does not win
+while the other may still answer.
+
+Only results polls, which are idempotent GETs, are hedged. Every submit
+creates (and bills) a BetterContact request and the API takes no idempotency
+key, so a second send of a submit cannot be made harmless: submits are never
+hedged.
+
+Hedging is bounded so a slow API does not get twice the load:
+- nothing is hedged until MIN_SAMPLES round trips to the endpoint were seen;
+- at most MAX_RATIO of an endpoint's calls are hedged;
+- a hedge takes a rate-limit slot like any call and is skipped when none is
+  free right away;
+- circuit breaker probes are never hedged.
+
+bettercontact_hedged_calls_total counts hedges by the send that answered
+first. bettercontact_hedge_saved_seconds observes how much sooner a winning
+hedge answered than the first send did (or failed).
+"""
+import collections
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+import requests
+
+from src.core import deadline, metrics, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+HEDGING_ENABLED = os.environ.get("BETTERCONTACT_HEDGING", "false").lower() in ("1", "true", "yes")
+# Latency quantile after which a call is hedged
+QUANTILE = float(os.environ.get("BETTERCONTACT_HEDGE_QUANTILE", 0.95))
+# Calls are never hedged sooner than this (seconds)
+MIN_DELAY = float(os.environ.get("BETTERCONTACT_HEDGE_MIN_DELAY", 0.1))
+# Round trips to an endpoint seen before its calls are hedged
+MIN_SAMPLES = int(os.environ.get("BETTERCONTACT_HEDGE_MIN_SAMPLES", 20))
+# Largest share of an endpoint's calls that are hedged
+MAX_RATIO = float(os.environ.get("BETTERCONTACT_HEDGE_MAX_RATIO", 0.1))
+# Threads running the sends of hedged calls
+WORKERS = int(os.environ.get("BETTERCONTACT_HEDGE_WORKERS", 64))
+
+# Most recent round trips kept per endpoint
+WINDOW = 500
+# Hedges an endpoint can save up while its calls are fast
+MAX_BURST = 10
+
+
+class _Endpoint:
+    """
+    Recent round trips to one endpoint and the hedges it may send.
+    """
+
+    def __init__(self):
+        self.latencies = collections.deque(maxlen=WINDOW)
+        self.budget = 0.0
+
+
+_endpoints = {}
+_executor = None
+_state_lock = threading.Lock()
+_state_pid = None
+
+
+def _endpoint(name):
+    global _endpoints, _executor, _state_pid
+
+    pid = os.getpid()
+    with _state_lock:
+        if _state_pid != pid:
+            # A forked worker measures its own latencies and starts its own threads
+            _endpoints = {}
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="bettercontact-hedge")
+            _state_pid = pid
+        return _endpoints.setdefault(name, _Endpoint())
+
+
+def hedge_delay(endpoint):
+    """
+    How long a call to `endpoint` runs before it is hedged: the QUANTILE of
+    its recent round trips, or None while too few were seen.
+    """
+    state = _endpoint(endpoint)
+    with _state_lock:
+        if len(state.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(state.latencies)
+    return max(ordered[min(int(QUANTILE * len(ordered)), len(ordered) - 1)], MIN_DELAY)
+
+
+def _timed(endpoint, call):
+    # Every send is a latency sample, failed and losing ones included, so slow tails stay visible
+    started = time.perf_counter()
+    try:
+        return call()
+    finally:
+        state = _endpoint(endpoint)
+        with _state_lock:
+            state.latencies.append(time.perf_counter() - started)
+
+
+def send(endpoint, api_key, lease_seconds, call):
+    """
+    Run `call` (one send of the request: returns a response or raises a
+    requests exception) and send it a second time when it is slow. Returns
+    or raises what the winning send did.
+    """
+    state = _endpoint(endpoint)
+    with _state_lock:
+        state.budget = min(state.budget + MAX_RATIO, MAX_BURST)
+
+    delay = hedge_delay(endpoint)
+    if delay is None or not deadline.allows(delay):
+        return _timed(endpoint, call)
+
+    # Sends run in copies of the caller's context, so they keep its deadline
+    first = _executor.submit(contextvars.copy_context().run, _timed, endpoint, call)
+    try:
+        return first.result(timeout=delay)
+    except FuturesTimeoutError:
+        pass
+
+    with _state_lock:
+        hedge_allowed = state.budget >= 1
+        if hedge_allowed:
+            state.budget -= 1
+    if not hedge_allowed or not deadline.allows(0):
+        return first.result()
+    try:
+        slot = rate_limiter.acquire(api_key, lease_seconds, max_wait=0)
+    except rate_limiter.RateLimitTimeout:
+        logger.debug("Not hedging a slow %s call: the API key is at its rate limit", endpoint)
+        return first.result()
+    logger.debug("Hedging a %s call still unanswered after %.3fs", endpoint, delay)
+
+    second = _executor.submit(contextvars.copy_context().run, _timed, endpoint, call)
+    second.add_done_callback(lambda _: rate_limiter.release(slot))
+
+    done, _ = wait([first, second], return_when=FIRST_COMPLETED)
+    winner = first if first in done else second
+    if winner.exception() is not None:
+        # A failed send only wins when the other one fails too
+        other = second if winner is first else first
+        wait([other])
+        winner = other if other.exception() is None else first
+    loser = second if winner is first else first
+    answered_at = time.perf_counter()
+
+    metrics.increment("bettercontact_hedged_calls_total", endpoint=endpoint,
+                      winner="hedge" if winner is second else "first")
+    loser.add_done_callback(lambda done: _discard(endpoint, done, answered_at if winner is second else None))
+    return winner.result()
+
+
+def _discard(endpoint, future, hedge_answered_at):
+    """
+    Close the losing send's response once it arrives and count it. When the
+    hedge won, observe how much sooner it answered.
+    """
+    if hedge_answered_at is not None:
+        metrics.observe("bettercontact_hedge_saved_seconds", time.perf_counter() - hedge_answered_at, endpoint=endpoint)
+
+    error = future.exception()
+    if isinstance(error, deadline.DeadlineExceeded):
+        # Never sent: the deadline ran out before the hedge could go
+        return
+    if error is None:
+        response = future.result()
+        metrics.increment("bettercontact_api_calls_total", endpoint=endpoint, status=str(response.status_code))
+        response.close()
+    elif isinstance(error, requests.exceptions.ConnectTimeout):
+        metrics.increment("bettercontact_api_calls_total", endpoint=endpoint, status="connect_timeout")
+    elif isinstance(error, requests.exceptions.ReadTimeout):
+        metrics.increment("bettercontact_api_calls_total", endpoint=endpoint, status="read_timeout")
+    else:
+        metrics.increment("bettercontact_api_calls_total", endpoint=endpoint, status="connection_error")
@@ -0,0 +1,266 @@
+"""
+Shared HTTP client for the BetterContact API.
+
+Every worker process keeps a single keep-alive requests.Session with a sized
+connection pool, so submits and polls reuse TCP/TLS connections instead of
+paying a new handshake per call. All calls get consistent (connect, read)
+timeouts and are retried with jittered exponential backoff on throttling and
+transient server errors. Round trips, rate-limit waits and backoff sleeps are
+recorded as stages of the current request's metrics, and all of them are cut
+to the current context's deadline when it has one (see deadline). Calls with
+a key the API recently rejected get a local 401 instead (see credentials),
+and calls to an endpoint that keeps failing fail at once with
+CircuitOpenError (see circuit_breaker). With hedging on, a call slower than
+usual is sent a second time and the first answer wins (see hedging).
+
+The API base URL can be pointed at a local stub server with the
+BETTERCONTACT_BASE_URL environment variable.
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.core import circuit_breaker, credentials, deadline, hedging, metrics, rate_limiter
+
+BASE_URL = os.environ.get("BETTERCONTACT_BASE_URL", "https://app.bettercontact.rocks").rstrip("/")
+
+# Timeouts in seconds: connecting is bounded separately from waiting for the response
+CONNECT_TIMEOUT = float(os.environ.get("BETTERCONTACT_CONNECT_TIMEOUT", 5))
+SUBMIT_TIMEOUT = float(os.environ.get("BETTERCONTACT_SUBMIT_TIMEOUT", 30))
+RESULTS_TIMEOUT = float(os.environ.get("BETTERCONTACT_RESULTS_TIMEOUT", 10))
+
+# Connections kept alive per worker process
+POOL_SIZE = int(os.environ.get("BETTERCONTACT_POOL_SIZE", 20))
+
+# Retry policy
+MAX_RETRIES = int(os.environ.get("BETTERCONTACT_MAX_RETRIES", 2))
+BACKOFF_BASE = float(os.environ.get("BETTERCONTACT_BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.environ.get("BETTERCONTACT_BACKOFF_MAX", 8))
+
+# Reads are safe to repeat on any transient failure. A submit that reached the
+# API may already be billed, so it is only repeated when the API explicitly
+# rejected it without processing (throttled or unavailable).
+READ_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+SUBMIT_RETRY_STATUSES = frozenset({429, 503})
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the keep-alive session for the current process.
+    A new session is created after a fork so workers never share sockets.
+    """
+    global _session, _session_pid
+
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=POOL_SIZE,
+                max_retries=0
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Accept": "application/json"
+            })
+            _session = session
+            _session_pid = pid
+
+    return _session
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Delay before retry number `attempt` (starting at 0), using full jitter.
+    A Retry-After header from the API is honoured, capped at BACKOFF_MAX.
+    """
+    if retry_after is not None:
+        try:
+            return min(max(float(retry_after), 0), BACKOFF_MAX)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def sleep_backoff(seconds):
+    time.sleep(seconds)
+    metrics.record("backoff", seconds)
+
+
+def rejected_response(url):
+    """
+    The 401 answered locally for a key in its rejection cooldown, shaped
+    like the API's so every caller handles it the same way.
+    """
+    response = requests.Response()
+    response.status_code = 401
+    response.url = url
+    response.reason = "Unauthorized"
+    response.headers['Content-Type'] = "application/json"
+    response._content = json.dumps({
+        "success": False,
+        "message": "API key was rejected recently; not retried until its cooldown ends"
+    }).encode("utf-8")
+    return response
+
+
+def request(method, path, api_key, timeout, retry_statuses=READ_RETRY_STATUSES,
+            retry_on_connection_error=True, max_retries=None, stage="api_call", hedge=False, **kwargs):
+    """
+    Send a request to the BetterContact API through the shared session.
+    Each attempt's round trip is recorded as `stage` in the request metrics.
+    With `hedge` (and hedging enabled), slow attempts are sent twice.
+
+    Retries on `retry_statuses` and, when allowed, on connection errors.
+    The last response is returned once retries are exhausted, or when the
+    backoff would not fit before the deadline; exceptions from requests are
+    re-raised so callers can keep their own error messages.
+    """
+    session = get_session()
+    url = f"{BASE_URL}{path}"
+    params = dict(kwargs.pop('params', None) or {})
+    params['api_key'] = api_key
+    retries = MAX_RETRIES if max_retries is None else max_retries
+
+    # Don't spend a call (or a rate-limit slot) on a key the API just rejected
+    if credentials.is_rejected(api_key):
+        metrics.increment("bettercontact_rejected_key_calls_total", endpoint=stage)
+        return rejected_response(url)
+
+    attempt = 0
+    while True:
+        # While the endpoint keeps failing, fail at once rather than wait out another timeout
+        probe = circuit_breaker.before_call(stage)
+
+        # Whether this attempt's outcome reached the circuit breaker
+        recorded = False
+        try:
+            # Every attempt waits its turn under the API key's shared rate limit
+            queued_at = time.perf_counter()
+            queue_limit = deadline.bound(rate_limiter.MAX_QUEUE_WAIT)
+            try:
+                slot = rate_limiter.acquire(api_key, CONNECT_TIMEOUT + timeout, max_wait=queue_limit)
+            except rate_limiter.RateLimitTimeout:
+                if queue_limit < rate_limiter.MAX_QUEUE_WAIT:
+                    raise deadline.DeadlineExceeded("Deadline reached while waiting for the rate limit")
+                raise
+            sent_at = time.perf_counter()
+            metrics.record("rate_limit_wait", sent_at - queued_at)
+            connect_timeout = deadline.bound(CONNECT_TIMEOUT)
+            read_timeout = deadline.bound(timeout)
+
+            def send():
+                # A hedge starts later, so its timeouts are cut to what is left of the deadline then
+                return session.request(
+                    method,
+                    url,
+                    params=params,
+                    timeout=(deadline.bound(connect_timeout), deadline.bound(read_timeout)),
+                    **kwargs
+                )
+
+            try:
+                if hedge and hedging.HEDGING_ENABLED and not probe:
+                    response = hedging.send(stage, api_key, CONNECT_TIMEOUT + timeout, send)
+                else:
+                    response = send()
+            except requests.exceptions.ConnectTimeout:
+                metrics.increment("bettercontact_api_calls_total", endpoint=stage, status="connect_timeout")
+                # A timeout cut short by our own deadline says nothing about the API
+                circuit_breaker.record(stage, True if connect_timeout >= CONNECT_TIMEOUT else None, probe)
+                recorded = True
+                # The request never reached the API, so it is always safe to repeat
+                delay = backoff_delay(attempt)
+                if attempt >= retries or not deadline.allows(delay):
+                    deadline.check()
+                    raise
+                sleep_backoff(delay)
+                attempt += 1
+                continue
+            except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout) as e:
+                failure = "read_timeout" if isinstance(e, requests.exceptions.ReadTimeout) else "connection_error"
+                metrics.increment("bettercontact_api_calls_total", endpoint=stage, status=failure)
+                cut_short = failure == "read_timeout" and read_timeout < timeout
+                circuit_breaker.record(stage, None if cut_short else True, probe)
+                recorded = True
+                delay = backoff_delay(attempt)
+                if not retry_on_connection_error or attempt >= retries or not deadline.allows(delay):
+                    deadline.check()
+                    raise
+                sleep_backoff(delay)
+                attempt += 1
+                continue
+            finally:
+                metrics.record(stage, time.perf_counter() - sent_at)
+                rate_limiter.release(slot)
+
+            metrics.increment("bettercontact_api_calls_total", endpoint=stage, status=str(response.status_code))
+            circuit_breaker.record(stage, response.status_code >= 500, probe)
+            recorded = True
+
+            if response.status_code == 429:
+                rate_limiter.throttled(api_key, response.headers.get("Retry-After"))
+            elif response.status_code == 401:
+                credentials.reject(api_key)
+
+            delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+            if response.status_code in retry_statuses and attempt < retries and deadline.allows(delay):
+                response.close()
+                sleep_backoff(delay)
+                attempt += 1
+                continue
+
+            return response
+        finally:
+            if probe and not recorded:
+                # The probe never got an answer that says anything about the API (rate-limit
+                # wait, deadline, unexpected error): let the next call probe instead
+                circuit_breaker.record(stage, None, probe)
+
+
+def submit_leads(api_key, request_body, timeout=None):
+    """
+    Submit leads for asynchronous enrichment (POST /api/v2/async).
+    """
+    return request(
+        "POST",
+        "/api/v2/async",
+        api_key,
+        timeout=SUBMIT_TIMEOUT if timeout is None else timeout,
+        retry_statuses=SUBMIT_RETRY_STATUSES,
+        retry_on_connection_error=False,
+        stage="submit",
+        # Never hedged: a second send would create (and bill) a second request
+        json=request_body,
+        headers={"Content-Type": "application/json"}
+    )
+
+
+def fetch_results(api_key, request_id, version="v2", timeout=None):
+    """
+    Fetch the enrichment results for a request ID.
+    `version` selects /api/v2/async/{id} ("v2") or the unversioned /api/async/{id} (None).
+    """
+    prefix = f"/api/{version}/async" if version else "/api/async"
+    return request(
+        "GET",
+        f"{prefix}/{request_id}",
+        api_key,
+        timeout=RESULTS_TIMEOUT if timeout is None else timeout,
+        stage="poll",
+        hedge=True
+    )
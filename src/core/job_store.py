@@ -0,0 +1,243 @@
+"""
+Durable record of submitted enrichment requests and their polling state.
+
+Every submission is recorded with its lead fingerprint, enrichment type and
+timestamps. While the background poller watches a request it keeps the row's
+status and poll count current and holds a lease on it, renewed with every
+poll. The table lives in the shared SQLite database, so it outlives any one
+worker.
+
+A watched request whose lease runs out was being polled by a worker that is
+gone: recycled, killed on timeout, or the whole server restarted. Every
+worker's poller sweeps for such orphans when it starts and then every
+RECOVERY_INTERVAL seconds, and resumes polling them. Their results still
+reach the dedup store, result cache and completion subscribers, and the
+leads are not submitted (and paid for) again.
+
+Resuming a poll needs the API key, so recovery is opt-in
+(BETTERCONTACT_JOB_RECOVERY=true). Only then is the key kept in the row, while
+the request is watched, and erased once the request reaches a final state or
+its watch ends. The state database is only readable by the connector's user
+(see storage). Without recovery, rows hold the key's hash alone. Storage
+errors never fail an enrichment.
+"""
+import os
+import sqlite3
+import time
+
+from src.core import storage
+from src.core.result_cache import api_key_hash
+
+# Stores API keys of watched requests in the state database, so it is off by default
+RECOVERY_ENABLED = os.environ.get("BETTERCONTACT_JOB_RECOVERY", "false").lower() in ("1", "true", "yes")
+# Requests submitted longer ago than this are neither recovered nor reattached to (seconds)
+RECOVERY_WINDOW = float(os.environ.get("BETTERCONTACT_JOB_RECOVERY_WINDOW", 3600))
+# How often each worker sweeps for orphaned requests (seconds)
+RECOVERY_INTERVAL = float(os.environ.get("BETTERCONTACT_JOB_RECOVERY_INTERVAL", 30))
+# A lease outlives its next scheduled poll by this much before the request counts as orphaned (seconds)
+LEASE_GRACE = 30
+# Most orphans one sweep claims
+RECOVERY_BATCH = 100
+
+# Statuses of requests still waiting for a result. A request whose watch ended
+# without an answer from the API ("timeout", "error") may still complete, so
+# it is updated by later results and can be watched again.
+OUTSTANDING_STATUSES = ("submitted", "processing", "not_ready")
+UNRESOLVED_STATUSES = OUTSTANDING_STATUSES + ("timeout", "error")
+_OUTSTANDING = ", ".join(f"'{status}'" for status in OUTSTANDING_STATUSES)
+_UNRESOLVED = ", ".join(f"'{status}'" for status in UNRESOLVED_STATUSES)
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS enrichment_jobs (
+    request_id TEXT PRIMARY KEY,
+    api_key_hash TEXT NOT NULL,
+    api_key TEXT,
+    fingerprint TEXT,
+    lead_count INTEGER NOT NULL DEFAULT 1,
+    enrichment_type TEXT,
+    status TEXT NOT NULL,
+    poll_count INTEGER NOT NULL DEFAULT 0,
+    submitted_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    completed_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS enrichment_jobs_fingerprint ON enrichment_jobs (fingerprint);
+CREATE INDEX IF NOT EXISTS enrichment_jobs_lease ON enrichment_jobs (status, lease_until);
+""")
+
+
+@storage.off_hub
+def record_submission(api_key, request_id, fingerprint=None, lead_count=1, enrichment_type=None, submitted_at=None):
+    """
+    Record a request ID the API just accepted.
+    """
+    now = time.time()
+    try:
+        storage.get_connection().execute(
+            """
+            INSERT INTO enrichment_jobs (request_id, api_key_hash, fingerprint, lead_count, enrichment_type,
+                                         status, submitted_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'submitted', ?, ?)
+            ON CONFLICT (request_id) DO UPDATE SET
+                fingerprint = COALESCE(excluded.fingerprint, fingerprint),
+                enrichment_type = COALESCE(excluded.enrichment_type, enrichment_type),
+                updated_at = excluded.updated_at
+            """,
+            (request_id, api_key_hash(api_key), fingerprint, lead_count, enrichment_type, submitted_at or now, now)
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def watch(api_key, request_id, submitted_at, next_poll_at, enrichment_type=None):
+    """
+    The poller started watching a request: take its lease until shortly
+    after the first poll. Requests submitted elsewhere get a row too.
+    """
+    now = time.time()
+    try:
+        storage.get_connection().execute(
+            f"""
+            INSERT INTO enrichment_jobs (request_id, api_key_hash, api_key, enrichment_type, status,
+                                         submitted_at, updated_at, lease_until)
+            VALUES (?, ?, ?, ?, 'submitted', ?, ?, ?)
+            ON CONFLICT (request_id) DO UPDATE SET
+                api_key = excluded.api_key,
+                enrichment_type = COALESCE(enrichment_type, excluded.enrichment_type),
+                status = CASE WHEN status IN ('timeout', 'error') THEN 'submitted' ELSE status END,
+                updated_at = excluded.updated_at,
+                lease_until = MAX(COALESCE(lease_until, 0), excluded.lease_until)
+            WHERE status IN ({_UNRESOLVED})
+            """,
+            (request_id, api_key_hash(api_key), api_key if RECOVERY_ENABLED else None, enrichment_type,
+             submitted_at, now, next_poll_at + LEASE_GRACE)
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def polled(request_id, status, poll_count, next_poll_at):
+    """
+    A poll found the request still running: store what it saw and renew the lease.
+    """
+    try:
+        storage.get_connection().execute(
+            f"""
+            UPDATE enrichment_jobs SET status = ?, poll_count = MAX(poll_count, ?), updated_at = ?, lease_until = ?
+            WHERE request_id = ? AND status IN ({_OUTSTANDING})
+            """,
+            (status, poll_count, time.time(), next_poll_at + LEASE_GRACE, request_id)
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def finish(request_id, status, poll_count=None):
+    """
+    The request reached a final state (or nobody watches it any more): release
+    its lease and erase its API key.
+    """
+    now = time.time()
+    try:
+        storage.get_connection().execute(
+            f"""
+            UPDATE enrichment_jobs SET status = ?, poll_count = MAX(poll_count, COALESCE(?, 0)),
+                                       updated_at = ?, completed_at = ?, api_key = NULL, lease_until = NULL
+            WHERE request_id = ? AND status IN ({_UNRESOLVED})
+            """,
+            (status, poll_count, now, now, request_id)
+        )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def lookup(fingerprint):
+    """
+    The request a lead with this fingerprint is still waiting on, as a dict
+    with "request_id", "lead_uuid" (None), "submitted_at", "result" (None) and
+    "lead_count", or None when there is none. Only single-lead submissions
+    are recorded with a fingerprint.
+    """
+    try:
+        row = storage.get_connection().execute(
+            f"""
+            SELECT request_id, submitted_at FROM enrichment_jobs
+            WHERE fingerprint = ? AND status IN ({_OUTSTANDING}) AND submitted_at > ?
+            ORDER BY submitted_at DESC LIMIT 1
+            """,
+            (fingerprint, time.time() - RECOVERY_WINDOW)
+        ).fetchone()
+    except (sqlite3.Error, OSError):
+        return None
+
+    if row is None:
+        return None
+    return {
+        "request_id": row['request_id'],
+        "lead_uuid": None,
+        "submitted_at": row['submitted_at'],
+        "result": None,
+        "lead_count": 1
+    }
+
+
+@storage.off_hub
+def claim_orphans(limit=RECOVERY_BATCH):
+    """
+    Take over watched requests whose lease ran out. Returns a list of dicts
+    with "api_key", "request_id", "submitted_at", "enrichment_type" and
+    "poll_count" for the caller to resume polling.
+    """
+    if not RECOVERY_ENABLED:
+        return []
+
+    now = time.time()
+    claimed = []
+    try:
+        connection = storage.get_connection()
+        rows = connection.execute(
+            f"""
+            SELECT request_id, api_key, submitted_at, enrichment_type, poll_count, lease_until FROM enrichment_jobs
+            WHERE status IN ({_OUTSTANDING}) AND lease_until < ?
+                  AND api_key IS NOT NULL AND submitted_at > ?
+            ORDER BY submitted_at LIMIT ?
+            """,
+            (now, now - RECOVERY_WINDOW, limit)
+        ).fetchall()
+        for row in rows:
+            # Only one worker wins each orphan
+            taken = connection.execute(
+                "UPDATE enrichment_jobs SET lease_until = ?, updated_at = ? WHERE request_id = ? AND lease_until = ?",
+                (now + LEASE_GRACE, now, row['request_id'], row['lease_until'])
+            ).rowcount
+            if taken:
+                claimed.append({
+                    "api_key": row['api_key'],
+                    "request_id": row['request_id'],
+                    "submitted_at": row['submitted_at'],
+                    "enrichment_type": row['enrichment_type'],
+                    "poll_count": row['poll_count']
+                })
+    except (sqlite3.Error, OSError):
+        pass
+    return claimed
+
+
+@storage.off_hub
+def purge_expired():
+    """
+    Delete requests submitted before the recovery window; they are never
+    recovered or reattached to.
+    """
+    try:
+        storage.get_connection().execute(
+            "DELETE FROM enrichment_jobs WHERE submitted_at <= ?",
+            (time.time() - RECOVERY_WINDOW,)
+        )
+    except (sqlite3.Error, OSError):
+        pass
@@ -0,0 +1,157 @@
+"""
+Lazy loading of the connector's modules.
+
+With BETTERCONTACT_LAZY_ROUTES set, main.py uses LazyRouter instead of the
+workflows_cdk Router. Every module directory under the routes directory
+(src/modules/<module>/<version>/ with a module_config.yaml and a route.py)
+has its URL rules registered at startup from the `@router.route(...)`
+decorators in route.py, which are read from the source without importing
+it. A module's route.py (and whatever it imports) is imported the first time
+one of its URLs is called, so a cold start only pays for the modules that
+are used.
+
+Route modules call `router.route` on import as usual; during a lazy import
+the decorator records the view function instead of adding a Flask rule.
+"""
+import ast
+import importlib.util
+import os
+import sys
+import threading
+
+import yaml
+
+# Settings file read for the routes directory and the local development server
+APP_CONFIG = "app_config.yaml"
+
+
+def read_app_config(path=APP_CONFIG):
+    with open(path) as config_file:
+        return yaml.safe_load(config_file) or {}
+
+
+def declared_routes(route_path):
+    """
+    The (rule, methods) pairs of the `@router.route(...)` decorators in a
+    route.py, read from its source.
+    """
+    with open(route_path) as route_file:
+        tree = ast.parse(route_file.read(), route_path)
+
+    routes = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            if not (
+                isinstance(decorator, ast.Call)
+                and isinstance(decorator.func, ast.Attribute)
+                and decorator.func.attr == "route"
+                and isinstance(decorator.func.value, ast.Name)
+                and decorator.func.value.id == "router"
+            ):
+                continue
+            rule = ast.literal_eval(decorator.args[0])
+            methods = None
+            for keyword in decorator.keywords:
+                if keyword.arg == "methods":
+                    methods = ast.literal_eval(keyword.value)
+            routes.append((rule, methods))
+    return routes
+
+
+def module_directories(routes_directory):
+    """
+    (module, version, directory) for every module version that has both a
+    module_config.yaml and a route.py.
+    """
+    found = []
+    for module in sorted(os.listdir(routes_directory)):
+        module_directory = os.path.join(routes_directory, module)
+        if not os.path.isdir(module_directory):
+            continue
+        for version in sorted(os.listdir(module_directory)):
+            directory = os.path.join(module_directory, version)
+            if os.path.isfile(os.path.join(directory, "module_config.yaml")) and \
+                    os.path.isfile(os.path.join(directory, "route.py")):
+                found.append((module, version, directory))
+    return found
+
+
+class LazyRouter:
+    """
+    Registers every module's routes at startup and imports a module's
+    route.py on the first call to one of them.
+    """
+
+    def __init__(self, app, routes_directory=None):
+        self.app = app
+        self.config = read_app_config()
+        self.routes_directory = routes_directory or self.config['app_settings']['routes_directory']
+        # URL prefix -> route.py path, view functions by full rule once imported
+        self._modules = {}
+        self._views = {}
+        self._loading = None
+        self._lock = threading.RLock()
+
+        for module, version, directory in module_directories(self.routes_directory):
+            prefix = f"/{module}/{version}"
+            route_path = os.path.join(directory, "route.py")
+            self._modules[prefix] = route_path
+            for rule, methods in declared_routes(route_path):
+                self.app.add_url_rule(
+                    prefix + rule, endpoint=prefix + rule, view_func=self._stub(prefix, rule), methods=methods
+                )
+
+    def route(self, rule, methods=None):
+        """
+        Decorator used by route.py: records the view for the module being loaded.
+        """
+        def decorator(function):
+            if self._loading is None:
+                raise RuntimeError("LazyRouter routes are only declared while a module is being loaded")
+            self._views[self._loading + rule] = function
+            return function
+        return decorator
+
+    def loaded(self, prefix):
+        return any(rule.startswith(prefix + "/") for rule in self._views)
+
+    def load(self, prefix):
+        """
+        Import the route.py serving `prefix` unless it already has been.
+        """
+        with self._lock:
+            if self.loaded(prefix):
+                return
+            # Under `python main.py` the routes' `from main import router` must find this module
+            if "main" not in sys.modules and "__main__" in sys.modules:
+                sys.modules["main"] = sys.modules["__main__"]
+            name = "src.modules." + prefix.strip("/").replace("/", ".") + ".route"
+            spec = importlib.util.spec_from_file_location(name, self._modules[prefix])
+            module = importlib.util.module_from_spec(spec)
+            self._loading = prefix
+            try:
+                spec.loader.exec_module(module)
+            finally:
+                self._loading = None
+            sys.modules[name] = module
+
+    def load_all(self):
+        """
+        Import every module now, e.g. in the gunicorn master before forking.
+        """
+        for prefix in self._modules:
+            self.load(prefix)
+
+    def _stub(self, prefix, rule):
+        def view(**kwargs):
+            if prefix + rule not in self._views:
+                self.load(prefix)
+            return self._views[prefix + rule](**kwargs)
+        view.__name__ = f"lazy{prefix}{rule}".replace("/", "_")
+        return view
+
+    def run_app(self, app):
+        settings = self.config.get('local_development_settings') or {}
+        app.run(host=settings.get('host', "0.0.0.0"), port=settings.get('port', 2003), debug=settings.get('debug', False))
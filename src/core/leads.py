@@ -0,0 +1,297 @@
+"""
+Lead validation, packing and submission shared by the multi-lead modules.
+
+validate_lead applies the same Clay-style rules as the single-lead modules,
+validate_leads runs a whole list through the schema validator and those
+rules at once, build_lead_data produces the BetterContact lead object and submit_chunk sends
+one BetterContact-sized list of leads, turning every failure into an error
+dict instead of raising. iter_ndjson_leads and iter_csv_leads read uploaded
+lead lists incrementally, one row at a time; a line longer than
+MAX_LINE_BYTES is rejected without being held in memory.
+"""
+import csv
+import json
+import uuid
+
+import requests
+
+from src.core import circuit_breaker, http_client, job_store, poll_schedule, validation
+
+# BetterContact accepts up to 200 leads in a single async submission
+MAX_LEADS_PER_SUBMISSION = 200
+DEFAULT_LEADS_PER_SUBMISSION = 100
+
+# Bytes read from an upload stream at a time
+READ_SIZE = 64 * 1024
+
+# Longest upload line (one NDJSON lead or CSV row) accepted
+MAX_LINE_BYTES = 1024 * 1024
+
+# CSV columns copied onto the lead; "uuid" becomes custom_fields.uuid
+CSV_FIELDS = ('first_name', 'last_name', 'company', 'company_domain', 'linkedin_url')
+
+# Upload rows validated together by validated_rows
+VALIDATION_BLOCK = 100
+
+# Lead fields in schema.json form, for uploads that have no schema of their own
+LEAD_FIELDS = [
+    {"id": "first_name", "type": "string", "label": "First Name"},
+    {"id": "last_name", "type": "string", "label": "Last Name"},
+    {"id": "linkedin_url", "type": "string", "label": "LinkedIn URL"},
+    {"id": "company", "type": "string", "label": "Company Name"},
+    {"id": "company_domain", "type": "string", "label": "Company Domain"},
+    {
+        "id": "custom_fields",
+        "type": "object",
+        "label": "Custom Fields",
+        "fields": [{"id": "uuid", "type": "string", "label": "Lead UUID"}]
+    }
+]
+LEAD_VALIDATOR = validation.ItemsValidator(LEAD_FIELDS, "Lead", "Lead")
+
+
+def validate_lead(lead):
+    """
+    Validate a single lead according to Clay logic.
+    Returns an error message, or None when the lead is valid.
+    """
+    if not isinstance(lead, dict):
+        return "Lead must be an object"
+
+    first_name = lead.get('first_name', '')
+    last_name = lead.get('last_name', '')
+    company = lead.get('company', '')
+    company_domain = lead.get('company_domain', '')
+    linkedin_url = lead.get('linkedin_url', '')
+
+    # Person Name is required when LinkedIn Profile is not given
+    if not linkedin_url:
+        if not first_name or not last_name:
+            return "First name and last name are required when LinkedIn URL is not provided"
+
+    # Company Name is required when Company Domain is not given
+    if not company_domain:
+        if not company:
+            return "Company name is required when company domain is not provided"
+
+    return None
+
+
+def validate_leads(leads, validator=LEAD_VALIDATOR):
+    """
+    Validate and normalize a list of leads against the schema and the Clay
+    rules. Returns a list of (lead, error) pairs in input order; exactly one
+    of each is set.
+    """
+    results = validator.validate_many(leads)
+    for index, (lead, error) in enumerate(results):
+        if error is None:
+            error = validate_lead(lead)
+            if error:
+                results[index] = (None, error)
+    return results
+
+
+def build_lead_data(lead, list_name="StackSync Batch Lead"):
+    """
+    Build the BetterContact lead object, keeping the caller's custom_fields.uuid when given.
+    """
+    custom_fields = dict(lead.get('custom_fields') or {})
+    if not custom_fields.get('uuid'):
+        custom_fields['uuid'] = str(uuid.uuid4())
+    custom_fields.setdefault('list_name', list_name)
+
+    lead_data = {
+        "first_name": lead.get('first_name', ''),
+        "last_name": lead.get('last_name', ''),
+        "custom_fields": custom_fields
+    }
+
+    for field in ('company', 'company_domain', 'linkedin_url'):
+        if lead.get(field):
+            lead_data[field] = lead[field]
+
+    return lead_data
+
+
+def submit_chunk(api_key, chunk, enrich_email, enrich_phone, webhook_url=None):
+    """
+    Submit one chunk of leads to BetterContact.
+    Returns a dict with either the request ID or an error message for the chunk.
+    """
+    request_body = {
+        "data": chunk,
+        "enrich_email_address": enrich_email,
+        "enrich_phone_number": enrich_phone
+    }
+    if webhook_url:
+        request_body['webhook'] = webhook_url
+    uuids = [lead['custom_fields']['uuid'] for lead in chunk]
+
+    try:
+        response = http_client.submit_leads(api_key, request_body)
+    except circuit_breaker.CircuitOpenError as e:
+        return {"uuids": uuids, "error": str(e), "retry_after_seconds": e.retry_after}
+    except requests.exceptions.Timeout:
+        return {"uuids": uuids, "error": "Timeout while submitting leads for enrichment"}
+    except requests.exceptions.ConnectionError:
+        return {"uuids": uuids, "error": "Network error: Unable to connect to BetterContact API"}
+    except requests.exceptions.RequestException as e:
+        return {"uuids": uuids, "error": f"Request error during submission: {str(e)}"}
+
+    if response.status_code == 401:
+        return {"uuids": uuids, "error": "Invalid API key or unauthorized access", "status_code": 401}
+    elif response.status_code == 400:
+        try:
+            error_msg = response.json().get('message', 'Bad request')
+        except:
+            error_msg = 'Bad request'
+        return {"uuids": uuids, "error": f"Invalid request: {error_msg}", "status_code": 400}
+    elif response.status_code != 201:
+        return {
+            "uuids": uuids,
+            "error": f"API request failed with status {response.status_code}",
+            "status_code": response.status_code
+        }
+
+    try:
+        request_id = response.json().get("id", "")
+    except:
+        request_id = ""
+
+    if not request_id:
+        return {"uuids": uuids, "error": "No request ID returned from BetterContact"}
+
+    job_store.record_submission(
+        api_key, request_id,
+        lead_count=len(chunk),
+        enrichment_type=poll_schedule.enrichment_type(enrich_email, enrich_phone, len(chunk))
+    )
+    return {"uuids": uuids, "request_id": request_id}
+
+
+class UploadError(ValueError):
+    """
+    Raised when an upload cannot be read any further.
+    """
+
+
+def iter_lines(stream, read_size=READ_SIZE, max_line=None):
+    """
+    Yield decoded lines (newline included) from a binary stream without reading
+    it all. A line longer than `max_line` bytes is yielded as None as soon as
+    it is known to be too long, and the rest of it is skipped. `max_line`
+    defaults to MAX_LINE_BYTES.
+    """
+    if max_line is None:
+        max_line = MAX_LINE_BYTES
+    parts = []
+    size = 0
+    skipping = False
+    first = True
+
+    def decode(line):
+        nonlocal first
+        if first:
+            line = line.lstrip(b"\xef\xbb\xbf")
+            first = False
+        return line.decode("utf-8", errors="replace")
+
+    while True:
+        block = stream.read(read_size)
+        if not block:
+            break
+        start = 0
+        while start < len(block):
+            end = block.find(b"\n", start)
+            piece = block[start:] if end == -1 else block[start:end + 1]
+            start = len(block) if end == -1 else end + 1
+            if not skipping:
+                parts.append(piece)
+                size += len(piece)
+                if size - (end != -1) > max_line:
+                    # Reported now; the rest of the line is never kept
+                    parts, size, skipping, first = [], 0, True, False
+                    yield None
+            if end != -1:
+                if parts:
+                    yield decode(b"".join(parts))
+                parts, size, skipping = [], 0, False
+    if parts:
+        yield decode(b"".join(parts))
+
+
+def iter_ndjson_leads(stream):
+    """
+    Yield (row_number, lead, error) for each non-blank line of an NDJSON upload.
+    Exactly one of lead and error is set.
+    """
+    row_number = 0
+    for line in iter_lines(stream):
+        if line is None:
+            yield row_number, None, f"Row is longer than {MAX_LINE_BYTES} bytes"
+            row_number += 1
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            lead = json.loads(line)
+        except ValueError:
+            yield row_number, None, "Row is not valid JSON"
+        else:
+            yield row_number, lead, None
+        row_number += 1
+
+
+def validated_rows(rows, block=VALIDATION_BLOCK):
+    """
+    Validate the (row_number, lead, error) rows of an upload parser `block`
+    rows at a time with validate_leads, yielding them in the same form.
+    """
+    pending = []
+
+    def flush():
+        parsed = [(row_number, lead) for row_number, lead, error in pending if error is None]
+        checked = iter(validate_leads([lead for _, lead in parsed]))
+        for row_number, lead, error in pending:
+            if error is None:
+                lead, error = next(checked)
+            yield row_number, lead, error
+        del pending[:]
+
+    for row in rows:
+        pending.append(row)
+        if len(pending) >= block:
+            yield from flush()
+    yield from flush()
+
+
+def iter_csv_leads(stream):
+    """
+    Yield (row_number, lead, error) for each data row of a CSV upload with a
+    header row. A row can span lines (quoted newlines), so a line longer than
+    MAX_LINE_BYTES ends the upload with UploadError rather than skipping a row.
+    """
+    def checked_lines():
+        for line in iter_lines(stream):
+            if line is None:
+                raise UploadError(f"CSV line is longer than {MAX_LINE_BYTES} bytes")
+            yield line
+
+    reader = csv.DictReader(checked_lines())
+    rows = enumerate(reader)
+    while True:
+        try:
+            row_number, row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            raise UploadError(f"CSV could not be read: {str(e)}")
+        if None in row:
+            yield row_number, None, "Row has more columns than the header"
+            continue
+        lead = {field: (row.get(field) or '').strip() for field in CSV_FIELDS if row.get(field)}
+        if row.get('uuid'):
+            lead['custom_fields'] = {"uuid": row['uuid'].strip()}
+        yield row_number, lead, None
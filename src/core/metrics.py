@@ -0,0 +1,348 @@
+"""
+Per-stage latency and outcome metrics, exported on /metrics in the Prometheus
+text format.
+
+Each request to a module collects the time spent in each of its stages:
+parsing the request, validating it, the submit round trip, every poll round
+trip, the wait between polls, rate-limit queueing and retry backoff. Once the
+response has been sent they are added to histograms grouped by module, stage
+and outcome, next to the request's total duration. Stages that run on the
+poller's threads are collected by the poll job and merged into the request
+waiting on it, the same way rate-limit waits are.
+
+Every worker process keeps its own running totals and writes them to the
+shared SQLite database at most every FLUSH_SECONDS, so scraping any worker
+shows the whole host. Metrics never fail a request: storage errors only delay
+the totals until the next flush.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from src.core import storage
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("BETTERCONTACT_METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+# Longest a worker keeps totals to itself before writing them to the shared database (seconds)
+FLUSH_SECONDS = float(os.environ.get("BETTERCONTACT_METRICS_FLUSH_SECONDS", 5))
+# Totals of workers that stopped writing this long ago are dropped (seconds)
+RETENTION_SECONDS = float(os.environ.get("BETTERCONTACT_METRICS_RETENTION", 86400))
+
+# Histogram bucket upper bounds (seconds); the +Inf bucket is implied
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Exported metrics: name -> (type, help)
+METRICS = {
+    "bettercontact_request_duration_seconds": (
+        "histogram", "Time from receiving a module request to sending its last byte"
+    ),
+    "bettercontact_stage_duration_seconds": (
+        "histogram", "Time spent in one stage of a module request (one observation per occurrence)"
+    ),
+    "bettercontact_api_calls_total": (
+        "counter", "Calls made to the BetterContact API, by endpoint and response status"
+    ),
+    "bettercontact_rejected_key_calls_total": (
+        "counter", "Calls answered locally because the API rejected their key within the cooldown, by endpoint"
+    ),
+    "bettercontact_circuit_opens_total": (
+        "counter", "Times a circuit breaker opened after repeated API failures, by endpoint"
+    ),
+    "bettercontact_circuit_open_calls_total": (
+        "counter", "Calls failed at once because their endpoint's circuit breaker was open, by endpoint"
+    ),
+    "bettercontact_export_rows_total": (
+        "counter", "Enriched leads written to (or dropped by) the result export, by status"
+    ),
+    "bettercontact_predicted_leads_total": (
+        "counter", "Leads answered in local-first mode from their domain's email pattern instead of being submitted"
+    ),
+    "bettercontact_hedged_calls_total": (
+        "counter", "Calls sent a second time for being slower than usual, by endpoint and the send that answered first"
+    ),
+    "bettercontact_hedge_saved_seconds": (
+        "histogram", "How much sooner a winning hedge answered than the call's first send, by endpoint"
+    )
+}
+
+# Module routes are mounted at /<module>/<version>/<route>
+ROUTE_PATTERN = re.compile(r"^/([A-Za-z0-9_]+)/v\d+/([A-Za-z0-9_]+)$")
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS metrics_series (
+    instance TEXT NOT NULL,
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    bucket_counts TEXT,
+    sum REAL NOT NULL,
+    count REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (instance, name, labels)
+);
+""")
+
+_current = contextvars.ContextVar("bettercontact_metrics", default=None)
+
+_series = {}
+_series_lock = threading.Lock()
+_series_pid = None
+_instance = None
+_flushed_at = 0.0
+
+
+def new_timings():
+    """
+    Empty per-request collector: stage observations plus the request's outcome.
+    """
+    return {"stages": [], "outcome": None, "started": time.perf_counter(), "lap": time.perf_counter()}
+
+
+def track(timings=None):
+    """
+    Collect stage timings of the current context (request, greenlet or thread)
+    into `timings`, or a new collector, and return it.
+    """
+    if timings is None:
+        timings = new_timings()
+    _current.set(timings)
+    return timings
+
+
+def record(stage, seconds):
+    """
+    Add one occurrence of a stage to the current context's collector, if any.
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings['stages'].append((stage, seconds))
+
+
+def lap(stage):
+    """
+    Record the time since the request started, or since its previous lap, as
+    `stage`. Routes call this after parsing and after validation.
+    """
+    timings = _current.get()
+    if timings is None:
+        return
+    now = time.perf_counter()
+    timings['stages'].append((stage, now - timings['lap']))
+    timings['lap'] = now
+
+
+def merge(timings):
+    """
+    Add the stages collected elsewhere (e.g. by a poller job) to the current
+    context's collector.
+    """
+    current = _current.get()
+    if current is not None and timings:
+        current['stages'].extend(timings['stages'])
+
+
+def set_outcome(outcome):
+    """
+    Label the current request's metrics with a specific outcome (e.g.
+    "timeout") instead of the one derived from its status code.
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings['outcome'] = outcome
+
+
+def start_request(path):
+    """
+    Begin collecting for a request to a module route. Other paths are ignored.
+    """
+    match = ROUTE_PATTERN.match(path) if METRICS_ENABLED else None
+    if match is None:
+        _current.set(None)
+        return
+    module, route = match.groups()
+    timings = track()
+    timings['module'] = module if route == "execute" else f"{module}.{route}"
+
+
+def finish_request(response):
+    """
+    Flask after_request hook: observe the request's metrics once its
+    response has been fully sent (streamed bodies included).
+    """
+    timings = _current.get()
+    if timings is None or 'module' not in timings:
+        return response
+    status_code = response.status_code
+    response.call_on_close(lambda: _observe_request(timings, status_code))
+    return response
+
+
+def _observe_request(timings, status_code):
+    outcome = timings['outcome'] or ("ok" if status_code < 400 else "error")
+    module = timings['module']
+    observe(
+        "bettercontact_request_duration_seconds",
+        time.perf_counter() - timings['started'],
+        module=module, outcome=outcome
+    )
+    for stage, seconds in list(timings['stages']):
+        observe("bettercontact_stage_duration_seconds", seconds, module=module, stage=stage, outcome=outcome)
+    flush_if_due()
+
+
+def observe(name, seconds, **labels):
+    """
+    Add an observation to a histogram.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _series_lock:
+        _reset_after_fork()
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+        index = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+        series['buckets'][index] += 1
+        series['sum'] += seconds
+        series['count'] += 1
+
+
+def increment(name, amount=1, **labels):
+    """
+    Add to a counter.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _series_lock:
+        _reset_after_fork()
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = {"buckets": None, "sum": 0.0, "count": 0}
+        series['count'] += amount
+
+
+def _reset_after_fork():
+    # Caller holds _series_lock. A forked worker starts its own totals under a new instance ID.
+    global _series_pid, _instance, _flushed_at
+    pid = os.getpid()
+    if _series_pid != pid:
+        _series.clear()
+        _series_pid = pid
+        _instance = f"{pid}-{uuid.uuid4().hex[:8]}"
+        _flushed_at = time.time()
+
+
+def flush_if_due():
+    if time.time() - _flushed_at >= FLUSH_SECONDS:
+        flush()
+
+
+def flush():
+    """
+    Write this worker's totals to the shared database.
+    """
+    global _flushed_at
+
+    with _series_lock:
+        _reset_after_fork()
+        instance = _instance
+        rows = [
+            (
+                instance, name, json.dumps(labels),
+                json.dumps(series['buckets']) if series['buckets'] is not None else None,
+                series['sum'], series['count']
+            )
+            for (name, labels), series in _series.items()
+        ]
+        _flushed_at = time.time()
+    _write_series(rows)
+
+
+@storage.off_hub
+def _write_series(rows):
+    now = time.time()
+    try:
+        connection = storage.get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                """
+                INSERT INTO metrics_series (instance, name, labels, bucket_counts, sum, count, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (instance, name, labels) DO UPDATE SET
+                    bucket_counts = excluded.bucket_counts, sum = excluded.sum,
+                    count = excluded.count, updated_at = excluded.updated_at
+                """,
+                [row + (now,) for row in rows]
+            )
+            if random.random() < 0.01:
+                connection.execute("DELETE FROM metrics_series WHERE updated_at < ?", (now - RETENTION_SECONDS,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Could not write metrics: %s", e)
+
+
+def _read_series():
+    return storage.get_connection().execute(
+        "SELECT name, labels, bucket_counts, sum, count FROM metrics_series"
+    ).fetchall()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render():
+    """
+    All workers' totals in the Prometheus text exposition format.
+    """
+    flush()
+
+    totals = {}
+    rows = storage.run_blocking(_read_series)
+    for row in rows:
+        key = (row['name'], tuple(tuple(pair) for pair in json.loads(row['labels'])))
+        total = totals.setdefault(key, {"buckets": None, "sum": 0.0, "count": 0})
+        if row['bucket_counts'] is not None:
+            buckets = json.loads(row['bucket_counts'])
+            total['buckets'] = [a + b for a, b in zip(total['buckets'] or [0] * len(buckets), buckets)]
+        total['sum'] += row['sum']
+        total['count'] += row['count']
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (series_name, labels), total in sorted(totals.items()):
+            if series_name != name:
+                continue
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {total['count']:g}")
+                continue
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in BUCKETS] + ["+Inf"]
+            for bound, count in zip(bounds, total['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {total['count']:g}")
+    return "\n".join(lines) + "\n"
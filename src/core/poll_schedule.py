@@ -0,0 +1,172 @@
+"""
+Adaptive poll timing learned from observed enrichment completion times.
+
+Every request the poller sees complete leaves a sample: the completion
+happened after its last "in progress" poll and before the poll that found
+it done. Samples are kept per enrichment type (email, phone or both, single
+lead or batch) in the shared SQLite database, so all workers learn from all
+traffic.
+
+From those intervals the completion-time distribution is estimated (each
+sample spread evenly over its interval) and polls are placed at its quantiles:
+the first poll lands on the median, later ones on the 65th, 80th, ... 99.5th
+percentiles. Until a type has MIN_SAMPLES samples the poller keeps its fixed
+progressive schedule. benchmarks/poll_replay.py compares both on a trace.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from src.core import storage
+
+ADAPTIVE_ENABLED = os.environ.get("BETTERCONTACT_ADAPTIVE_POLLING", "true").lower() not in ("0", "false", "no")
+
+# Completion-time quantiles a poll is placed on, in order
+QUANTILES = (0.5, 0.65, 0.8, 0.9, 0.95, 0.98, 0.995)
+# Samples needed before a type's schedule is trusted
+MIN_SAMPLES = int(os.environ.get("BETTERCONTACT_POLL_MIN_SAMPLES", 20))
+# Most recent samples kept per type
+MAX_SAMPLES = int(os.environ.get("BETTERCONTACT_POLL_MAX_SAMPLES", 500))
+# Polls are never scheduled closer together (or sooner after submission) than this (seconds)
+MIN_GAP = 0.5
+# How long a worker reuses a computed schedule before reloading samples (seconds)
+REFRESH_SECONDS = 30
+# Share of recorded samples that also trim old ones
+TRIM_PROBABILITY = 0.05
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS poll_completion_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    enrichment_type TEXT NOT NULL,
+    lower_seconds REAL NOT NULL,
+    upper_seconds REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS poll_completion_samples_type ON poll_completion_samples (enrichment_type, id);
+""")
+
+_schedules = {}
+_schedules_lock = threading.Lock()
+
+
+def enrichment_type(enrich_email, enrich_phone, lead_count=1):
+    """
+    Label grouping requests that take about as long to complete.
+    """
+    if enrich_email and enrich_phone:
+        label = "email_phone"
+    elif enrich_phone:
+        label = "phone"
+    else:
+        label = "email"
+    return label if lead_count <= 1 else f"{label}:batch"
+
+
+@storage.off_hub
+def record(enrichment_type, lower_seconds, upper_seconds):
+    """
+    Store that a request of this type completed between lower_seconds and
+    upper_seconds after submission.
+    """
+    if not ADAPTIVE_ENABLED or upper_seconds <= 0:
+        return
+    try:
+        connection = storage.get_connection()
+        connection.execute(
+            """
+            INSERT INTO poll_completion_samples (enrichment_type, lower_seconds, upper_seconds, recorded_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (enrichment_type, max(lower_seconds, 0), upper_seconds, time.time())
+        )
+        if random.random() < TRIM_PROBABILITY:
+            connection.execute(
+                """
+                DELETE FROM poll_completion_samples WHERE enrichment_type = ? AND id <= (
+                    SELECT id FROM poll_completion_samples WHERE enrichment_type = ?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (enrichment_type, enrichment_type, MAX_SAMPLES)
+            )
+    except (sqlite3.Error, OSError):
+        pass
+
+
+@storage.off_hub
+def load_samples(enrichment_type, limit=MAX_SAMPLES):
+    """
+    Most recent (lower, upper) completion intervals for a type.
+    """
+    rows = storage.get_connection().execute(
+        """
+        SELECT lower_seconds, upper_seconds FROM poll_completion_samples
+        WHERE enrichment_type = ? ORDER BY id DESC LIMIT ?
+        """,
+        (enrichment_type, limit)
+    ).fetchall()
+    return [(row['lower_seconds'], row['upper_seconds']) for row in rows]
+
+
+def completion_quantile(samples, quantile):
+    """
+    Time by which `quantile` of requests have completed, treating each
+    (lower, upper) sample as spread evenly over its interval.
+    """
+    def completed_share(seconds):
+        total = 0.0
+        for lower, upper in samples:
+            if seconds >= upper:
+                total += 1
+            elif seconds > lower:
+                total += (seconds - lower) / (upper - lower)
+        return total / len(samples)
+
+    low, high = 0.0, max(upper for _, upper in samples)
+    for _ in range(30):
+        middle = (low + high) / 2
+        if completed_share(middle) < quantile:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def quantile_offsets(samples):
+    """
+    Poll times (seconds after submission) placed on the completion-time
+    quantiles of the samples, at least MIN_GAP apart.
+    """
+    offsets = []
+    for quantile in QUANTILES:
+        seconds = max(completion_quantile(samples, quantile), MIN_GAP)
+        if not offsets or seconds >= offsets[-1] + MIN_GAP:
+            offsets.append(round(seconds, 2))
+    return offsets
+
+
+def offsets_for(enrichment_type):
+    """
+    Adaptive poll times for a type, or None while it has too few samples
+    (the caller then uses its fixed schedule).
+    """
+    if not ADAPTIVE_ENABLED or not enrichment_type:
+        return None
+
+    now = time.time()
+    with _schedules_lock:
+        cached = _schedules.get(enrichment_type)
+    if cached is not None and now - cached[0] < REFRESH_SECONDS:
+        return cached[1]
+
+    try:
+        samples = load_samples(enrichment_type)
+    except (sqlite3.Error, OSError):
+        samples = []
+    offsets = quantile_offsets(samples) if len(samples) >= MIN_SAMPLES else None
+
+    with _schedules_lock:
+        _schedules[enrichment_type] = (now, offsets)
+    return offsets
@@ -0,0 +1,410 @@
+"""
+Per-process background poller for BetterContact enrichment results.
+
+Routes register a request ID and wait on the returned future instead of
+running their own sleep/poll loop. A single scheduler thread keeps one
+priority queue ordered by next-due time and hands due polls to a small shared
+thread pool. Two callers waiting on the same request ID share one poll stream.
+
+Registrations that name their enrichment type are polled on the adaptive
+schedule learned from past completions (see poll_schedule). Otherwise, and
+once that schedule is used up, polls follow the progressive delay the sync
+module always used: a short initial wait, then 2 seconds growing by 0.5
+seconds per poll, capped at 5.
+
+While the results endpoint's circuit breaker is open, polls are put off
+until it lets calls through again instead of failing their jobs (see
+circuit_breaker).
+
+Each job collects the metrics stages of its polls (round trips and the waits
+between them); waiters merge them into their own request's metrics.
+
+Watched requests are also tracked in the durable job store, with a lease
+renewed by every poll. The scheduler periodically takes over requests whose
+lease ran out because the worker watching them is gone (see job_store).
+"""
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from src.core import (
+    circuit_breaker, deadline, dedup_store, email_patterns, export_sink, http_client, job_store, metrics, poll_schedule,
+    rate_limiter
+)
+from src.core.result_cache import get_result_cache
+
+logger = logging.getLogger(__name__)
+
+# Polling schedule (seconds)
+INITIAL_DELAY = 1
+BASE_DELAY = 2
+DELAY_STEP = 0.5
+MAX_DELAY = 5
+# Extra wait after a 406 on the first poll, while the API registers the request
+NOT_REGISTERED_DELAY = 2
+
+# Default time a registration keeps polling before resolving as "timeout"
+DEFAULT_MAX_WAIT = 45
+
+POLL_WORKERS = int(os.environ.get("BETTERCONTACT_POLL_WORKERS", 8))
+
+
+def next_delay(poll_count):
+    """
+    Delay before the next poll once `poll_count` polls have been made.
+    """
+    return min(BASE_DELAY + (poll_count * DELAY_STEP), MAX_DELAY)
+
+
+def interpret_response(response, request_id, poll_count):
+    """
+    Turn a results response into a final outcome dict, or None to keep polling.
+    """
+    if response.status_code == 200:
+        try:
+            return {"status": "completed", "data": response.json()}
+        except ValueError:
+            return {"status": "error", "error": "Invalid response format from enrichment results"}
+
+    if response.status_code == 202:
+        try:
+            response_data = response.json()
+            status = response_data.get('status', '').lower()
+        except (ValueError, AttributeError):
+            # If we can't parse the response, continue polling
+            return None
+
+        if status == 'completed':
+            # Results are included in 202 response
+            return {"status": "completed", "data": response_data}
+        if status in ['failed', 'error']:
+            return {
+                "status": "failed",
+                "error": f"Enrichment failed: {response_data.get('message', 'Enrichment failed')}",
+                "data": {"request_id": request_id, "status": status}
+            }
+        # Otherwise still 'in progress' or similar
+        return None
+
+    if response.status_code == 404:
+        return {
+            "status": "not_found",
+            "error": f"Request ID '{request_id}' not found. It may have expired or been invalid."
+        }
+    if response.status_code == 401:
+        return {"status": "unauthorized", "error": "Authentication failed while checking results"}
+    if response.status_code == 406:
+        # "Unvalid request_id" right after submission just means the API is not ready yet
+        if poll_count == 0:
+            return None
+        return {"status": "invalid_request_id", "error": f"Invalid request ID format: {request_id}"}
+
+    return {
+        "status": "error",
+        "error": f"Unexpected response status {response.status_code} while checking results"
+    }
+
+
+class ResultPoller:
+    """
+    Polls registered request IDs until they reach a final state.
+    Each registration resolves its future with an outcome dict holding
+    "status", "poll_count" and either "data" or "error".
+    """
+
+    def __init__(self, max_workers=POLL_WORKERS):
+        self._jobs = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bettercontact-poll")
+        self._thread = threading.Thread(target=self._run, name="bettercontact-poller", daemon=True)
+        self._thread.start()
+
+    def register(self, api_key, request_id, max_wait=DEFAULT_MAX_WAIT, initial_delay=INITIAL_DELAY,
+                 cache_result=True, enrichment_type=None, submitted_at=None):
+        """
+        Start (or join) polling for a request ID and return its future.
+        Bulk callers that consume results once pass cache_result=False to keep
+        them out of the in-memory result cache. Passing the enrichment type
+        (and submission time, when it was not just now) enables adaptive
+        polling and teaches the schedule from this request's completion.
+        """
+        key = (api_key, request_id)
+        now = time.time()
+
+        with self._condition:
+            job = self._jobs.get(key)
+            if job is not None:
+                # Someone is already polling this ID; extend its lifetime for the new waiter
+                job['expires_at'] = max(job['expires_at'], now + max_wait)
+                job['cache_result'] = job['cache_result'] or cache_result
+                return job['future']
+
+            job = {
+                "api_key": api_key,
+                "request_id": request_id,
+                "future": Future(),
+                "poll_count": 0,
+                "registered_at": now,
+                "expires_at": now + max_wait,
+                "cache_result": cache_result,
+                "rate_limit": rate_limiter.new_tracker(),
+                "timings": metrics.new_timings(),
+                "last_polled_at": now,
+                "enrichment_type": enrichment_type,
+                "submitted_at": submitted_at or now,
+                "offsets": poll_schedule.offsets_for(enrichment_type),
+                "last_pending_at": None,
+                "last_status": "submitted"
+            }
+            self._jobs[key] = job
+            if job['offsets']:
+                first_poll_at = max(job['submitted_at'] + job['offsets'][0], now)
+            else:
+                first_poll_at = now + initial_delay
+            self._schedule(key, first_poll_at)
+
+        job_store.watch(api_key, request_id, job['submitted_at'], first_poll_at, enrichment_type)
+        return job['future']
+
+    def progress(self, api_key, request_id):
+        """
+        What is known about a request still being polled: its poll count and
+        the last status the API reported. None once it is no longer polled.
+        """
+        with self._condition:
+            job = self._jobs.get((api_key, request_id))
+            if job is None:
+                return None
+            return {"poll_count": job['poll_count'], "last_status": job['last_status']}
+
+    def pending_count(self):
+        with self._condition:
+            return len(self._jobs)
+
+    def _schedule(self, key, due_at):
+        # Caller holds self._condition
+        heapq.heappush(self._queue, (due_at, next(self._sequence), key))
+        self._condition.notify()
+
+    def _finish(self, key, outcome):
+        with self._condition:
+            job = self._jobs.pop(key, None)
+        if job is None:
+            return
+        try:
+            self._record(job, outcome)
+        finally:
+            # Waiters always get their outcome, whatever recording it cost
+            outcome['poll_count'] = job['poll_count']
+            outcome['last_status'] = job['last_status']
+            outcome['rate_limit'] = job['rate_limit']
+            outcome['timings'] = job['timings']
+            outcome['elapsed_seconds'] = round(time.time() - job['registered_at'], 2)
+            job['future'].set_result(outcome)
+
+    def _record(self, job, outcome):
+        """
+        Hand a finished job's outcome to the stores that learn from it. A store
+        that fails (a locked database, a full disk) is reported and skipped.
+        """
+        steps = []
+        if outcome['status'] == 'completed':
+            if job['enrichment_type'] and 'completed_at' in job:
+                # It completed after the last "in progress" poll and before the one that found it done
+                last_pending_at = job['last_pending_at'] or job['submitted_at']
+                steps.append(("poll schedule", lambda: poll_schedule.record(
+                    job['enrichment_type'],
+                    last_pending_at - job['submitted_at'],
+                    job['completed_at'] - job['submitted_at']
+                )))
+            # Later get_enrichment_results calls and duplicate leads are served locally
+            if job['cache_result']:
+                steps.append(("result cache", lambda: get_result_cache().put_completed(
+                    job['api_key'], job['request_id'], outcome['data']
+                )))
+            steps.append(("dedup store", lambda: dedup_store.record_result(job['request_id'], outcome['data'])))
+            steps.append(("result export", lambda: export_sink.export(job['api_key'], job['request_id'], outcome['data'])))
+            steps.append(("email pattern index", lambda: email_patterns.learn(job['api_key'], outcome['data'])))
+        elif outcome['status'] in ('failed', 'not_found', 'invalid_request_id'):
+            # Let the same leads be submitted again instead of reattaching to a dead request
+            steps.append(("dedup store", lambda: dedup_store.forget_request(job['request_id'])))
+        steps.append(("job store", lambda: job_store.finish(job['request_id'], outcome['status'], job['poll_count'])))
+
+        for name, step in steps:
+            try:
+                step()
+            except Exception as e:
+                logger.warning("Could not record request %s in the %s: %s", job['request_id'], name, e)
+
+    def _run(self):
+        # The first sweep runs as soon as the worker starts its poller
+        next_sweep_at = time.time() if job_store.RECOVERY_ENABLED else None
+        while True:
+            if next_sweep_at is not None and time.time() >= next_sweep_at:
+                self._recover_orphans()
+                next_sweep_at = time.time() + job_store.RECOVERY_INTERVAL
+
+            with self._condition:
+                due_at = self._queue[0][0] if self._queue else None
+                if due_at is None or due_at > time.time():
+                    # Sleep until the next poll or sweep is due, or a registration wakes us
+                    wake_times = [at for at in (due_at, next_sweep_at) if at is not None]
+                    self._condition.wait(max(min(wake_times) - time.time(), 0) if wake_times else None)
+                    continue
+                _, _, key = heapq.heappop(self._queue)
+                job = self._jobs.get(key)
+
+            if job is None:
+                continue
+
+            if time.time() >= job['expires_at']:
+                self._finish(key, {
+                    "status": "timeout",
+                    "error": f"Timed out waiting for results. Request ID: {job['request_id']}"
+                })
+                continue
+
+            self._executor.submit(self._poll, key, job)
+
+    def _recover_orphans(self):
+        """
+        Resume polling requests whose watcher went away, until the end of the
+        recovery window, and complete their subscriptions when they finish.
+        """
+        # Imported here because completions itself imports this module
+        from src.core import completions
+
+        try:
+            orphans = job_store.claim_orphans()
+            for orphan in orphans:
+                request_id = orphan['request_id']
+                future = self.register(
+                    orphan['api_key'],
+                    request_id,
+                    max_wait=orphan['submitted_at'] + job_store.RECOVERY_WINDOW - time.time(),
+                    enrichment_type=orphan['enrichment_type'],
+                    submitted_at=orphan['submitted_at']
+                )
+                future.add_done_callback(
+                    lambda done, request_id=request_id: completions.complete_from_outcome(request_id, done.result())
+                )
+            if orphans:
+                logger.info("Resumed polling %d request(s) left by a stopped worker", len(orphans))
+            if random.random() < 0.1:
+                job_store.purge_expired()
+        except Exception:
+            logger.exception("Job recovery sweep failed")
+
+    def _poll(self, key, job):
+        request_id = job['request_id']
+        # Rate-limit waits of this job's polls are reported to whoever waits on it
+        rate_limiter.track_queue_wait(job['rate_limit'])
+        metrics.track(job['timings'])
+        # No poll (or its retries) runs past the job's expiry
+        deadline.until(job['expires_at'])
+        polled_at = time.time()
+        # Time since registration or the previous poll: the scheduled delay plus any queueing for a poll thread
+        metrics.record("poll_wait", polled_at - job['last_polled_at'])
+
+        try:
+            response = http_client.fetch_results(job['api_key'], request_id)
+        except deadline.DeadlineExceeded:
+            return self._finish(key, {
+                "status": "timeout",
+                "error": f"Timed out waiting for results. Request ID: {request_id}"
+            })
+        except circuit_breaker.CircuitOpenError as e:
+            # The request is still being enriched; ask again once polls are let through
+            job['last_polled_at'] = polled_at
+            due_at = min(polled_at + e.retry_after, job['expires_at'])
+            job_store.polled(request_id, job['last_status'], job['poll_count'], due_at)
+            with self._condition:
+                if key in self._jobs:
+                    self._schedule(key, due_at)
+            return
+        except requests.exceptions.Timeout:
+            return self._finish(key, {
+                "status": "error",
+                "error": f"Timeout while checking enrichment results. Request ID: {request_id}"
+            })
+        except requests.exceptions.ConnectionError:
+            return self._finish(key, {
+                "status": "error",
+                "error": f"Network error while checking results. Request ID: {request_id}"
+            })
+        except requests.exceptions.RequestException as e:
+            return self._finish(key, {
+                "status": "error",
+                "error": f"Error checking results: {str(e)}. Request ID: {request_id}"
+            })
+        except Exception as e:
+            return self._finish(key, {
+                "status": "error",
+                "error": f"Unexpected error while polling: {str(e)}. Request ID: {request_id}"
+            })
+
+        outcome = interpret_response(response, request_id, job['poll_count'])
+        first_poll_not_ready = response.status_code == 406 and job['poll_count'] == 0
+        job['poll_count'] += 1
+        job['last_polled_at'] = time.time()
+
+        if outcome is not None:
+            job['completed_at'] = polled_at
+            return self._finish(key, outcome)
+
+        if response.status_code == 202:
+            job['last_pending_at'] = polled_at
+            job['last_status'] = "processing"
+        elif first_poll_not_ready:
+            job['last_status'] = "not_ready"
+
+        now = time.time()
+        # Next learned poll time still ahead of us, else the fixed progressive delay
+        due_at = next(
+            (job['submitted_at'] + offset for offset in job['offsets'] or ()
+             if job['submitted_at'] + offset >= now + poll_schedule.MIN_GAP),
+            now + next_delay(job['poll_count'])
+        )
+        if first_poll_not_ready:
+            due_at += NOT_REGISTERED_DELAY
+
+        due_at = min(due_at, job['expires_at'])
+        job_store.polled(request_id, job['last_status'], job['poll_count'], due_at)
+
+        with self._condition:
+            if key in self._jobs:
+                # A poll due after the expiry would only find the job timed out; resolve it on time
+                self._schedule(key, due_at)
+
+
+_poller = None
+_poller_pid = None
+_poller_lock = threading.Lock()
+
+
+def get_poller():
+    """
+    Return the poller for the current process, starting it on first use.
+    A forked worker gets its own poller thread.
+    """
+    global _poller, _poller_pid
+
+    pid = os.getpid()
+    if _poller is not None and _poller_pid == pid:
+        return _poller
+
+    with _poller_lock:
+        if _poller is None or _poller_pid != pid:
+            _poller = ResultPoller()
+            _poller_pid = pid
+
+    return _poller
@@ -0,0 +1,53 @@
+"""
+Field projection of enrichment results.
+
+BetterContact returns a few dozen fields per enriched lead, while most
+workflows only read a handful (the email, the phone number and their
+statuses). Modules that return enrichment results accept a `fields` list and
+trim every lead to those fields before the response is built, which shrinks
+both the bytes sent and the work the workflow engine spends parsing them.
+
+custom_fields is always kept, since it carries the uuid that matches each
+result to its input lead. Unknown field names are ignored, so new fields
+BetterContact adds can be asked for without a connector change.
+"""
+
+# Kept on every projected lead
+ALWAYS_KEPT = ("custom_fields",)
+
+
+def parse_fields(fields):
+    """
+    The projection for a `fields` input: a list of field names, or a comma
+    separated string (query parameters). Returns None when every field is
+    wanted.
+    """
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    names = [name.strip() for name in fields or () if name and name.strip()]
+    if not names:
+        return None
+    return tuple(dict.fromkeys(names + [name for name in ALWAYS_KEPT if name not in names]))
+
+
+def project_lead(lead, fields):
+    """
+    An enriched lead trimmed to `fields` (as returned by parse_fields).
+    """
+    if fields is None or not isinstance(lead, dict):
+        return lead
+    return {name: lead[name] for name in fields if name in lead}
+
+
+def project(enrichment_data, fields):
+    """
+    A BetterContact results payload with every lead in its `data` list trimmed
+    to `fields`. The request-level keys (id, status, credits) are kept. The
+    payload itself is not modified, since it may be shared with the cache.
+    """
+    if fields is None or not isinstance(enrichment_data, dict):
+        return enrichment_data
+    leads = enrichment_data.get('data')
+    if not isinstance(leads, list):
+        return enrichment_data
+    return dict(enrichment_data, data=[project_lead(lead, fields) for lead in leads])
@@ -0,0 +1,311 @@
+"""
+Client-side rate limiting of BetterContact calls, per API key.
+
+Every outbound call takes a token from the API key's token bucket and holds
+one of its in-flight slots until the response arrives. The limits hold across
+all gunicorn workers on the host without a database round trip per call:
+each worker keeps its buckets and slots in memory and gets an equal share of
+the key's rate, burst and in-flight cap, split among the workers using the
+key. Every SYNC_INTERVAL seconds a worker using a key marks itself active in
+the shared SQLite database and reads how many workers share the key. A
+worker that stops using a key drops out of the count after ACTIVE_SECONDS.
+
+A 429 from the API pauses the key at once in the worker that got it, and in
+the others at their next sync, for as long as its Retry-After asks.
+
+Under gevent, the database work runs on gevent's native thread pool (see
+storage.run_blocking), so a wait for the database lock never stalls the
+worker's other greenlets.
+
+Time spent waiting for a token or slot is added to the current context's
+tracker (see track_queue_wait) so routes can report it in their metadata.
+Storage errors never block a call: the worker keeps its last known share.
+"""
+import contextvars
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import requests
+
+from src.core import storage
+from src.core.result_cache import api_key_hash
+
+RATE_LIMIT_ENABLED = os.environ.get("BETTERCONTACT_RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+# Sustained calls per second per API key (0 disables the token bucket)
+RATE_PER_SECOND = float(os.environ.get("BETTERCONTACT_RATE_LIMIT", 20))
+# Calls that can be made at once after an idle period
+RATE_BURST = float(os.environ.get("BETTERCONTACT_RATE_BURST", 40))
+# Calls in flight at the same time per API key (0 disables the cap)
+MAX_IN_FLIGHT = int(os.environ.get("BETTERCONTACT_MAX_IN_FLIGHT", 20))
+# Longest a call waits for a token or slot before failing as a timeout (seconds)
+MAX_QUEUE_WAIT = float(os.environ.get("BETTERCONTACT_RATE_LIMIT_MAX_WAIT", 20))
+
+# Longest single sleep while waiting, so freed slots are noticed quickly
+MAX_SLEEP = 0.25
+# Slots outlive their call's timeouts by this much before they are reclaimed
+LEASE_MARGIN = 5
+# How often a worker using a key re-reads how many workers share it (seconds)
+SYNC_INTERVAL = 1.0
+# A worker counts as using a key for this long after its last sync (seconds)
+ACTIVE_SECONDS = 5
+# Share of syncs that also delete long-gone workers' rows
+PURGE_PROBABILITY = 0.01
+
+storage.register_schema("""
+CREATE TABLE IF NOT EXISTS rate_limit_workers (
+    api_key_hash TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    active_until REAL NOT NULL,
+    PRIMARY KEY (api_key_hash, worker)
+);
+CREATE TABLE IF NOT EXISTS rate_limit_pauses (
+    api_key_hash TEXT PRIMARY KEY,
+    paused_until REAL NOT NULL
+);
+""")
+
+
+class _Bucket:
+    """
+    One API key's limiter state in this worker.
+    """
+
+    def __init__(self):
+        # None until the first sync tells this worker its share of the burst
+        self.tokens = None
+        self.updated_at = time.monotonic()
+        # slot ID -> time (monotonic) after which the slot is reclaimed
+        self.slots = {}
+        # Workers sharing the key's limits, this one included
+        self.workers = 1
+        self.paused_until = 0.0
+        self.synced_at = None
+
+
+_buckets = {}
+_lock = threading.Lock()
+_buckets_pid = None
+_slot_ids = itertools.count(1)
+
+_queue_wait = contextvars.ContextVar("bettercontact_queue_wait", default=None)
+
+
+class RateLimitTimeout(requests.exceptions.Timeout):
+    """
+    Raised when a call could not get a token or slot within its maximum wait.
+    Being a requests Timeout, routes report it like any other API timeout.
+    """
+
+
+def new_tracker():
+    return {"queue_wait_seconds": 0.0, "throttled_calls": 0}
+
+
+def track_queue_wait(tracker=None):
+    """
+    Start counting rate-limit waits for the current context (request, greenlet
+    or thread) into `tracker`, or a new one, and return it. report() turns a
+    tracker into response metadata.
+    """
+    if tracker is None:
+        tracker = new_tracker()
+    _queue_wait.set(tracker)
+    return tracker
+
+
+def merge(tracker, other):
+    """
+    Add the waits counted in another tracker (e.g. a poller job's) to this one.
+    """
+    if other:
+        tracker['queue_wait_seconds'] += other['queue_wait_seconds']
+        tracker['throttled_calls'] += other['throttled_calls']
+
+
+def record_wait(seconds, throttled):
+    """
+    Add a call's wait to the current context's tracker, if one is active.
+    """
+    tracker = _queue_wait.get()
+    if tracker is None:
+        return
+    tracker['queue_wait_seconds'] += seconds
+    if throttled:
+        tracker['throttled_calls'] += 1
+
+
+def report(tracker):
+    return {
+        "queue_wait_seconds": round(tracker['queue_wait_seconds'], 3),
+        "throttled_calls": tracker['throttled_calls']
+    }
+
+
+def acquire(api_key, lease_seconds, max_wait=MAX_QUEUE_WAIT):
+    """
+    Wait up to `max_wait` seconds for a token and an in-flight slot for this
+    API key. Returns a slot to pass to release(), or None when no slot is held.
+    """
+    if not RATE_LIMIT_ENABLED or (RATE_PER_SECOND <= 0 and MAX_IN_FLIGHT <= 0):
+        return None
+
+    key_hash = api_key_hash(api_key)
+    bucket = _bucket(key_hash)
+    started = time.monotonic()
+    throttled = False
+
+    while True:
+        _sync(key_hash, bucket)
+        slot_id, wait = _try_acquire(bucket, lease_seconds)
+
+        waited = time.monotonic() - started
+        if slot_id is not None:
+            record_wait(waited, throttled)
+            return (key_hash, slot_id)
+
+        if waited + wait > max_wait:
+            record_wait(waited, True)
+            raise RateLimitTimeout(
+                f"Rate limit queue wait exceeded {max_wait:g} seconds"
+            )
+
+        throttled = True
+        time.sleep(min(wait, MAX_SLEEP))
+
+
+def release(slot):
+    if not slot:
+        return
+    key_hash, slot_id = slot
+    with _lock:
+        bucket = _buckets.get(key_hash)
+        if bucket is not None:
+            bucket.slots.pop(slot_id, None)
+
+
+def throttled(api_key, retry_after=None):
+    """
+    The API answered 429: empty the key's bucket and pause it in every worker,
+    for `retry_after` seconds when the API said how long.
+    """
+    if not RATE_LIMIT_ENABLED or RATE_PER_SECOND <= 0:
+        return
+    try:
+        pause = float(retry_after) if retry_after is not None else 0
+    except (TypeError, ValueError):
+        pause = 0
+
+    key_hash = api_key_hash(api_key)
+    bucket = _bucket(key_hash)
+    # At least as long as one token takes to come back
+    paused_until = time.time() + max(pause, 1 / RATE_PER_SECOND)
+    with _lock:
+        bucket.tokens = 0.0
+        bucket.updated_at = time.monotonic()
+        bucket.paused_until = max(bucket.paused_until, paused_until)
+    try:
+        storage.run_blocking(_share_pause, key_hash, paused_until)
+    except (sqlite3.Error, OSError):
+        pass
+
+
+def _bucket(key_hash):
+    global _buckets, _buckets_pid
+
+    pid = os.getpid()
+    with _lock:
+        if _buckets_pid != pid:
+            # A forked worker holds none of its parent's slots
+            _buckets = {}
+            _buckets_pid = pid
+        return _buckets.setdefault(key_hash, _Bucket())
+
+
+def _try_acquire(bucket, lease_seconds):
+    """
+    One attempt at taking a token and a slot from this worker's share.
+    Returns (slot_id, None) on success or (None, seconds_to_wait) when the
+    share is used up.
+    """
+    now = time.monotonic()
+    with _lock:
+        paused = bucket.paused_until - time.time()
+        if paused > 0:
+            return None, paused
+
+        if RATE_PER_SECOND > 0:
+            rate = RATE_PER_SECOND / bucket.workers
+            burst = max(RATE_BURST / bucket.workers, 1)
+            tokens = burst if bucket.tokens is None else bucket.tokens + (now - bucket.updated_at) * rate
+            bucket.tokens = min(tokens, burst)
+            bucket.updated_at = now
+            if bucket.tokens < 1:
+                return None, (1 - bucket.tokens) / rate
+
+        slot_id = next(_slot_ids)
+        if MAX_IN_FLIGHT > 0:
+            # Slots of calls that hung past their timeouts are reclaimed
+            for expired in [held for held, until in bucket.slots.items() if until <= now]:
+                del bucket.slots[expired]
+            if len(bucket.slots) >= max(MAX_IN_FLIGHT // bucket.workers, 1):
+                return None, MAX_SLEEP
+            bucket.slots[slot_id] = now + lease_seconds + LEASE_MARGIN
+
+        if RATE_PER_SECOND > 0:
+            bucket.tokens -= 1
+        return slot_id, None
+
+
+def _sync(key_hash, bucket):
+    """
+    Every SYNC_INTERVAL, mark this worker as using the key and pick up how
+    many workers share it and any pause another worker was told of.
+    """
+    now = time.monotonic()
+    with _lock:
+        if bucket.synced_at is not None and now - bucket.synced_at < SYNC_INTERVAL:
+            return
+        bucket.synced_at = now
+    try:
+        workers, paused_until = storage.run_blocking(_sync_shared, key_hash, str(os.getpid()))
+    except (sqlite3.Error, OSError):
+        return
+    with _lock:
+        bucket.workers = workers
+        bucket.paused_until = max(bucket.paused_until, paused_until)
+
+
+def _sync_shared(key_hash, worker):
+    connection = storage.get_connection()
+    now = time.time()
+    connection.execute(
+        """
+        INSERT INTO rate_limit_workers (api_key_hash, worker, active_until) VALUES (?, ?, ?)
+        ON CONFLICT (api_key_hash, worker) DO UPDATE SET active_until = excluded.active_until
+        """,
+        (key_hash, worker, now + ACTIVE_SECONDS)
+    )
+    workers = connection.execute(
+        "SELECT COUNT(*) FROM rate_limit_workers WHERE api_key_hash = ? AND active_until > ?", (key_hash, now)
+    ).fetchone()[0]
+    row = connection.execute(
+        "SELECT paused_until FROM rate_limit_pauses WHERE api_key_hash = ?", (key_hash,)
+    ).fetchone()
+    if random.random() < PURGE_PROBABILITY:
+        connection.execute("DELETE FROM rate_limit_workers WHERE active_until < ?", (now - 3600,))
+        connection.execute("DELETE FROM rate_limit_pauses WHERE paused_until < ?", (now - 3600,))
+    return max(workers, 1), row['paused_until'] if row else 0.0
+
+
+def _share_pause(key_hash, paused_until):
+    storage.get_connection().execute(
+        """
+        INSERT INTO rate_limit_pauses (api_key_hash, paused_until) VALUES (?, ?)
+        ON CONFLICT (api_key_hash) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)
+        """,
+        (key_hash, paused_until)
+    )
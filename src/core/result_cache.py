@@ -0,0 +1,229 @@
+"""
+Cache for completed BetterContact enrichment results.
+
+Completed payloads never change, so once a request ID has finished there is
+no reason to ask the API for it again. Entries are keyed by (API key hash,
+request ID) and kept in a bounded in-memory LRU with a TTL. An optional disk
+tier (one JSON file per entry) lets every worker process on the host serve a
+hot ID with zero network I/O. 404s can optionally be cached for a short time.
+
+The disk tier is swept every DISK_SWEEP_INTERVAL seconds, in a background
+thread started by a write: files older than the TTL are deleted, and while
+the directory holds more than CACHE_DISK_MAX_MB the least recently used files
+go first. A file's mtime is when it was written and its atime when it was
+last served, set explicitly so noatime mounts do not matter.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.environ.get("BETTERCONTACT_CACHE_MAX_ENTRIES", 1000))
+CACHE_TTL = float(os.environ.get("BETTERCONTACT_CACHE_TTL", 3600))
+# Seconds a 404 is remembered; 0 disables negative caching
+CACHE_NEGATIVE_TTL = float(os.environ.get("BETTERCONTACT_CACHE_NEGATIVE_TTL", 0))
+# Directory for the disk tier; empty disables it
+CACHE_DIR = os.environ.get("BETTERCONTACT_CACHE_DIR", "")
+# Size the disk tier is trimmed to, least recently used files first; 0 disables the cap
+CACHE_DISK_MAX_MB = float(os.environ.get("BETTERCONTACT_CACHE_DISK_MAX_MB", 512))
+
+# Seconds between sweeps of the disk tier
+DISK_SWEEP_INTERVAL = 300
+# Temporary files of writes that died are removed after this long (seconds)
+TMP_FILE_MAX_AGE = 60
+
+COMPLETED = "completed"
+NOT_FOUND = "not_found"
+
+
+def api_key_hash(api_key):
+    """
+    Stable, non-reversible identifier for an API key, safe to keep in memory or on disk.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    LRU + TTL cache of enrichment results with an optional disk tier.
+    get() returns (entry, tier) where entry is {"status": ..., "data": ...}
+    and tier is "memory" or "disk", or (None, None) on a miss.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                 negative_ttl=CACHE_NEGATIVE_TTL, disk_dir=CACHE_DIR, disk_max_mb=CACHE_DISK_MAX_MB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self._next_sweep = time.time() + DISK_SWEEP_INTERVAL
+        self._sweeping = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, api_key, request_id):
+        key = (api_key_hash(api_key), request_id)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['expires_at'] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    self._stats['memory_hits'] += 1
+                    return entry, "memory"
+                del self._entries[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is not None:
+                self._store(key, entry)
+                self._stats['hits'] += 1
+                self._stats['disk_hits'] += 1
+                return entry, "disk"
+            self._stats['misses'] += 1
+        return None, None
+
+    def put_completed(self, api_key, request_id, data):
+        key = (api_key_hash(api_key), request_id)
+        entry = {"status": COMPLETED, "data": data, "expires_at": time.time() + self.ttl}
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+    def put_not_found(self, api_key, request_id):
+        if self.negative_ttl <= 0:
+            return
+        key = (api_key_hash(api_key), request_id)
+        entry = {"status": NOT_FOUND, "data": None, "expires_at": time.time() + self.negative_ttl}
+        with self._lock:
+            self._store(key, entry)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def _store(self, key, entry):
+        # Caller holds self._lock
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(f"{key[0]}:{key[1]}".encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{name}.json")
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('expires_at', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            # Record the use for the sweep's LRU order, keeping the write time
+            os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        # Write to a temporary file first so readers in other workers never see a partial file
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError:
+            pass
+
+        now = time.time()
+        with self._lock:
+            if self._sweeping or now < self._next_sweep:
+                return
+            self._sweeping = True
+            self._next_sweep = now + DISK_SWEEP_INTERVAL
+        threading.Thread(target=self._sweep_disk, name="bettercontact-cache-sweep", daemon=True).start()
+
+    def _sweep_disk(self):
+        """
+        Delete disk entries past their TTL, then the least recently used ones
+        while the directory is over its size cap.
+        """
+        try:
+            now = time.time()
+            kept = []
+            with os.scandir(self.disk_dir) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.endswith(".tmp"):
+                        if stat.st_mtime < now - TMP_FILE_MAX_AGE:
+                            self._remove(entry.path)
+                    elif entry.name.endswith(".json"):
+                        if stat.st_mtime + self.ttl <= now:
+                            self._remove(entry.path)
+                        else:
+                            kept.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in kept)
+            if self.disk_max_bytes > 0 and total > self.disk_max_bytes:
+                for _, size, path in sorted(kept):
+                    if total <= self.disk_max_bytes:
+                        break
+                    self._remove(path)
+                    total -= size
+        except OSError as e:
+            logger.warning("Could not sweep the result cache directory %s: %s", self.disk_dir, e)
+        finally:
+            with self._lock:
+                self._sweeping = False
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Return the process-wide result cache.
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
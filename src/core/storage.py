@@ -0,0 +1,146 @@
+"""
+Local SQLite state shared by every worker process on the host.
+
+The database runs in WAL mode so readers in one worker never block writers in
+another. Each thread gets its own connection, and a forked worker opens fresh
+connections instead of reusing its parent's. Under gevent, "thread" means a
+real OS thread: the greenlets of a worker share one connection rather than
+each opening (and setting up) their own.
+
+Under gevent, every database call made while serving requests or polling
+runs through run_blocking() (or a function decorated with off_hub), so a
+worker waiting for another worker's write lock does not stall its other
+greenlets.
+
+The database holds enrichment results (and, with job recovery on, API keys),
+so its directory is created readable by the connector's user only and the
+file is kept at mode 0600. SQLite gives its -wal and -shm files the same mode.
+"""
+import functools
+import os
+import sqlite3
+import threading
+
+STATE_DB = os.environ.get("BETTERCONTACT_STATE_DB", "/tmp/bettercontact/state.db")
+
+# Seconds a writer waits for another process to release its lock
+BUSY_TIMEOUT = 5
+
+
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def _native(name):
+    """
+    threading.<name> as it was before gevent patched it: connections belong to
+    real threads, and the schema lock is also taken on gevent's thread pool.
+    """
+    if _gevent_patched():
+        from gevent import monkey
+        return monkey.get_original("threading", name)
+    return getattr(threading, name)
+
+
+_local = _native("local")()
+_schemas = []
+_schema_lock = _native("Lock")()
+
+
+def register_schema(statements):
+    """
+    Register CREATE statements to run on every new connection.
+    Modules owning a table call this at import time.
+    """
+    with _schema_lock:
+        _schemas.append(statements)
+
+
+def get_connection():
+    """
+    Return this thread's connection to the shared state database.
+    """
+    connection = getattr(_local, "connection", None)
+    if connection is not None and getattr(_local, "pid", None) == os.getpid():
+        if _local.schema_count != len(_schemas):
+            apply_schemas(connection)
+        return connection
+
+    directory = os.path.dirname(STATE_DB)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    _restrict_permissions()
+
+    connection = sqlite3.connect(STATE_DB, timeout=BUSY_TIMEOUT, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    _local.connection = connection
+    _local.pid = os.getpid()
+    _local.schema_count = 0
+    apply_schemas(connection)
+    return connection
+
+
+def run_blocking(function, *args, **kwargs):
+    """
+    Call `function(*args, **kwargs)` and return its result. In a gevent worker
+    the call runs on gevent's native thread pool, so a wait for the database
+    lock (up to BUSY_TIMEOUT) blocks only that thread and not the worker's
+    greenlets. Calls made from the pool itself run directly.
+
+    The function runs in another thread: it must only do database work, not
+    take the caller's (gevent) locks or read its context variables.
+    """
+    if not _gevent_patched() or getattr(_local, "off_hub", False):
+        return function(*args, **kwargs)
+
+    from gevent import get_hub
+    return get_hub().threadpool.apply(_call_off_hub, (function, args, kwargs))
+
+
+def off_hub(function):
+    """
+    Decorator for functions that only do database work: they run through
+    run_blocking().
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return run_blocking(function, *args, **kwargs)
+    return wrapper
+
+
+def _call_off_hub(function, args, kwargs):
+    _local.off_hub = True
+    return function(*args, **kwargs)
+
+
+def _restrict_permissions():
+    """
+    Create the database file readable by its owner only, or make it so.
+    """
+    try:
+        os.close(os.open(STATE_DB, os.O_CREAT | os.O_RDWR, 0o600))
+        if os.stat(STATE_DB).st_mode & 0o077:
+            os.chmod(STATE_DB, 0o600)
+    except OSError:
+        # Not ours to change (e.g. created by another user); SQLite reports real access problems
+        pass
+
+
+def apply_schemas(connection):
+    """
+    Run the CREATE statements registered since this thread's connection last saw them.
+    """
+    with _schema_lock:
+        pending = _schemas[_local.schema_count:]
+        count = len(_schemas)
+    for statements in pending:
+        connection.executescript(statements)
+    _local.schema_count = count
@@ -0,0 +1,257 @@
+"""
+Input validation compiled from the modules' schema.json files.
+
+Each route loads its module's schema once, at import, with load(__file__).
+The fields are compiled into pydantic TypedDict adapters: field types,
+"required" and "minimum"/"maximum" are enforced, schema defaults are filled
+in, and lead fields are normalized on the way through (whitespace trimmed,
+company domains reduced to their lowercased host, LinkedIn profile URLs put
+in one canonical form). Connection fields are left to the routes, which fall
+back to a test key when none is given.
+
+Arrays of objects (lead lists) are only checked to be lists by validate();
+their rows are validated separately by items(field_id).validate_many(rows),
+which checks a whole list in one pydantic call and reports an error per row
+instead of failing the request.
+"""
+import functools
+import json
+import os
+import re
+from typing import Any, List, Optional
+
+from pydantic import AfterValidator, ConfigDict, Field, TypeAdapter, ValidationError, with_config
+from typing_extensions import Annotated, NotRequired, Required, TypedDict
+
+from src.core.dedup_store import normalize_domain
+
+_LINKEDIN_PROFILE = re.compile(r"^(?:https?://)?(?:[a-z]{2,3}\.)?linkedin\.com/in/([^/?#]+)", re.IGNORECASE)
+
+# Compiled validators by schema path
+_validators = {}
+
+
+def canonical_linkedin_url(url):
+    """
+    Put a LinkedIn profile URL in the form https://www.linkedin.com/in/<slug>.
+    Anything else is returned as given.
+    """
+    match = _LINKEDIN_PROFILE.match(url)
+    if match:
+        return f"https://www.linkedin.com/in/{match.group(1).lower()}"
+    return url
+
+
+# Lead lists repeat the same few companies, so normalized domains are remembered
+_cached_domain = functools.lru_cache(maxsize=4096)(normalize_domain)
+
+# Normalization applied to string fields with these ids, wherever they appear
+NORMALIZERS = {
+    "company_domain": _cached_domain,
+    "linkedin_url": canonical_linkedin_url
+}
+
+
+def _normalizer(function):
+    return AfterValidator(lambda value: function(value) if value else value)
+
+
+def _field_type(field, name):
+    """
+    The annotation for one schema field.
+    """
+    field_type = field.get('type')
+    validation = field.get('validation') or {}
+    bounds = {}
+    if 'minimum' in validation:
+        bounds['ge'] = validation['minimum']
+    if 'maximum' in validation:
+        bounds['le'] = validation['maximum']
+
+    if field_type == 'string':
+        annotation = str
+        if field.get('id') in NORMALIZERS:
+            annotation = Annotated[str, _normalizer(NORMALIZERS[field['id']])]
+    elif field_type == 'number':
+        annotation = Annotated[float, Field(**bounds)] if bounds else float
+    elif field_type == 'integer':
+        annotation = Annotated[int, Field(**bounds)] if bounds else int
+    elif field_type == 'boolean':
+        annotation = bool
+    elif field_type == 'object' and field.get('fields'):
+        annotation = _typed_dict(field['fields'], f"{name}_{field['id']}")
+    elif field_type == 'object':
+        annotation = dict
+    elif field_type == 'array':
+        items = field.get('items') or {}
+        if items.get('type') == 'object' and items.get('fields'):
+            annotation = List[_typed_dict(items['fields'], f"{name}_{field['id']}")]
+        elif items.get('type') in ('string', 'number', 'integer', 'boolean'):
+            annotation = List[_field_type(items, name)]
+        else:
+            annotation = list
+    else:
+        annotation = Any
+    return annotation
+
+
+def _typed_dict(fields, name, shallow=()):
+    """
+    A TypedDict for a list of schema fields. Fields in `shallow` are only
+    checked to be lists; unknown keys are kept.
+    """
+    annotations = {}
+    for field in fields:
+        if field['id'] in shallow:
+            annotation = list
+        else:
+            annotation = _field_type(field, name)
+        if field.get('type') != 'connection' and (field.get('validation') or {}).get('required'):
+            annotations[field['id']] = Required[annotation]
+        else:
+            annotations[field['id']] = NotRequired[Optional[annotation]]
+    config = ConfigDict(extra='allow', str_strip_whitespace=True, coerce_numbers_to_str=True)
+    return with_config(config)(TypedDict(name, annotations))
+
+
+def _labels(fields):
+    """
+    Field labels by id, nested for objects and arrays of objects.
+    """
+    labels = {}
+    for field in fields:
+        nested = field.get('fields') or (field.get('items') or {}).get('fields') or []
+        labels[field['id']] = (field.get('label') or field['id'], _labels(nested))
+    return labels
+
+
+def _message(error, labels, subject="Input"):
+    """
+    A readable message for one pydantic error, naming the field by its label
+    (or `subject` when the error is about the value as a whole).
+    """
+    names = []
+    for part in error['loc']:
+        if isinstance(part, int):
+            continue
+        label, nested = labels.get(part, (part, {}))
+        names.append(label)
+        labels = nested
+    name = " / ".join(str(name) for name in names)
+
+    if not name:
+        return f"{subject}: {error['msg']}"
+    if error['type'] == 'missing':
+        return f"{name} is required"
+    return f"{name}: {error['msg']}"
+
+
+class ItemsValidator:
+    """
+    Validates the rows of an array of objects, a whole list at a time.
+    """
+
+    def __init__(self, fields, name="Item", label="Row"):
+        self._adapter = TypeAdapter(List[_typed_dict(fields, name)])
+        self._labels = _labels(fields)
+        self._label = label
+
+    def validate_many(self, rows):
+        """
+        Validate and normalize a list of rows. Returns a list of
+        (row, error) pairs in the same order; exactly one of each is set.
+        """
+        try:
+            return [(row, None) for row in self._adapter.validate_python(rows)]
+        except ValidationError as e:
+            errors = {}
+            for error in e.errors():
+                index = error['loc'][0]
+                if index not in errors:
+                    errors[index] = _message(dict(error, loc=error['loc'][1:]), self._labels, self._label)
+
+        # Validate the rows that passed again in one call to get their normalized values
+        valid = iter(self._adapter.validate_python(
+            [row for index, row in enumerate(rows) if index not in errors]
+        ))
+        return [
+            (None, errors[index]) if index in errors else (next(valid), None)
+            for index in range(len(rows))
+        ]
+
+
+class SchemaValidator:
+    """
+    Validates a module's input against its schema.json.
+    """
+
+    def __init__(self, schema, defaults=None):
+        fields = schema.get('fields') or []
+        # Arrays of objects are validated row by row through items()
+        self._items = {
+            field['id']: ItemsValidator(
+                field['items']['fields'], f"{field['id']}_item", field['items'].get('label') or "Row"
+            )
+            for field in fields
+            if field.get('type') == 'array' and (field.get('items') or {}).get('fields')
+        }
+        self._types = {field['id']: field.get('type') for field in fields}
+        self._required = {
+            field['id'] for field in fields
+            if field.get('type') != 'connection' and (field.get('validation') or {}).get('required')
+        }
+        self._defaults = {field['id']: field['default'] for field in fields if 'default' in field}
+        self._defaults.update(defaults or {})
+        self._adapter = TypeAdapter(_typed_dict(fields, "Input", shallow=self._items))
+        self._labels = _labels(fields)
+
+    def validate(self, data):
+        """
+        Validate and normalize a module's input. Returns (values, error):
+        the input with defaults filled in and None, or None and a message.
+        """
+        if not isinstance(data, dict):
+            return None, "Request data must be an object"
+
+        # Blank inputs count as not given, except for optional text
+        data = {
+            key: value for key, value in data.items()
+            if value is not None and not (
+                value == "" and (key in self._required or self._types.get(key) not in (None, 'string'))
+            )
+        }
+        try:
+            values = self._adapter.validate_python(data)
+        except ValidationError as e:
+            return None, _message(e.errors()[0], self._labels)
+
+        for key, default in self._defaults.items():
+            if values.get(key) is None:
+                values[key] = default
+        return values, None
+
+    def items(self, field_id):
+        """
+        The row validator of an array-of-objects field.
+        """
+        return self._items[field_id]
+
+
+def compile_schema(path, defaults=None):
+    """
+    Compile a schema.json file, once per path. `defaults` overrides the
+    schema's default values, for settings taken from the environment.
+    """
+    validator = _validators.get(path)
+    if validator is None:
+        with open(path) as schema_file:
+            validator = SchemaValidator(json.load(schema_file), defaults)
+        _validators[path] = validator
+    return validator
+
+
+def load(route_file, defaults=None):
+    """
+    The validator for the schema.json next to a module's route.py.
+    """
+    return compile_schema(os.path.join(os.path.dirname(os.path.abspath(route_file)), "schema.json"), defaults)
@@ -0,0 +1,213 @@
+"""
+Resolution of which BetterContact results endpoint serves a request ID.
+
+Results live either under /api/v2/async/{id} or under the legacy unversioned
+/api/async/{id}. Instead of always trying v2 first and repeating the call on
+404, the endpoint that answered is remembered per request ID and per API key:
+
+- a remembered request ID goes straight to its endpoint, and to the other
+  one only when its endpoint answers 404;
+- otherwise the API key's last working endpoint is tried first;
+- a first lookup with nothing to go on probes both endpoints in parallel;
+- a request ID both endpoints answered 404 for is, for NOT_FOUND_SECONDS,
+  looked up on one endpoint only, so repeated lookups of a missing ID (polls,
+  bulk checks) cost one call instead of two sequential ones.
+
+Per-path latency statistics show how much each endpoint costs.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.core import http_client
+from src.core.result_cache import api_key_hash
+
+# Results endpoints, keyed by the label used in stats and metadata
+VERSIONS = OrderedDict([
+    ("v2", "v2"),
+    ("legacy", None)
+])
+
+MAX_REMEMBERED_IDS = int(os.environ.get("BETTERCONTACT_VERSION_MEMORY", 10000))
+LATENCY_WINDOW = 500
+# How long a request ID that neither endpoint knows is looked up on one endpoint only (seconds)
+NOT_FOUND_SECONDS = float(os.environ.get("BETTERCONTACT_VERSION_NOT_FOUND_TTL", 300))
+
+
+class VersionResolver:
+    """
+    Remembers which results endpoint answers for request IDs and API keys.
+    """
+
+    def __init__(self, max_remembered_ids=MAX_REMEMBERED_IDS):
+        self.max_remembered_ids = max_remembered_ids
+        self._by_request_id = OrderedDict()
+        self._by_key = {}
+        # (key_hash, request_id) -> time until which the ID counts as missing on both endpoints
+        self._missing = OrderedDict()
+        self._latencies = {label: deque(maxlen=LATENCY_WINDOW) for label in VERSIONS}
+        self._calls = {label: 0 for label in VERSIONS}
+        self._strategies = {"remembered": 0, "preferred": 0, "parallel": 0, "not_found": 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bettercontact-probe")
+
+    def fetch(self, api_key, request_id):
+        """
+        Fetch results for a request ID from the endpoint most likely to serve it.
+        Returns (response, version_label, strategy). Exceptions from the HTTP
+        client propagate as they would from a direct call.
+        """
+        key_hash = api_key_hash(api_key)
+
+        with self._lock:
+            remembered = self._by_request_id.get((key_hash, request_id))
+            if remembered is not None:
+                self._by_request_id.move_to_end((key_hash, request_id))
+            preferred = self._by_key.get(key_hash)
+            missing_until = self._missing.get((key_hash, request_id))
+
+        if remembered is None and missing_until is not None and missing_until > time.time():
+            # Both endpoints said 404 recently: one call checks whether the ID has appeared since
+            label = preferred or next(iter(VERSIONS))
+            self._count_strategy("not_found")
+            response = self._timed_fetch(api_key, request_id, label)
+            if response.status_code != 404:
+                self._remember(key_hash, request_id, label)
+            return response, label, "not_found"
+
+        if remembered is not None:
+            self._count_strategy("remembered")
+            response = self._timed_fetch(api_key, request_id, remembered)
+            if response.status_code != 404:
+                return response, remembered, "remembered"
+            # The ID is gone from its endpoint; only the other endpoint is left to ask
+            self._forget(key_hash, request_id)
+            other = next(label for label in VERSIONS if label != remembered)
+            response = self._timed_fetch(api_key, request_id, other)
+            if response.status_code != 404:
+                self._remember(key_hash, request_id, other)
+            else:
+                self._remember_missing(key_hash, request_id)
+            return response, other, "remembered"
+
+        if preferred is not None:
+            self._count_strategy("preferred")
+            response = self._timed_fetch(api_key, request_id, preferred)
+            if response.status_code != 404:
+                self._remember(key_hash, request_id, preferred)
+                return response, preferred, "preferred"
+            other = next(label for label in VERSIONS if label != preferred)
+            response = self._timed_fetch(api_key, request_id, other)
+            if response.status_code != 404:
+                self._remember(key_hash, request_id, other)
+            else:
+                self._remember_missing(key_hash, request_id)
+            return response, other, "preferred"
+
+        return self._probe_parallel(api_key, key_hash, request_id)
+
+    def stats(self):
+        """
+        Call counts and latency percentiles (seconds) per endpoint.
+        """
+        with self._lock:
+            paths = {}
+            for label, samples in self._latencies.items():
+                ordered = sorted(samples)
+                paths[label] = {
+                    "calls": self._calls[label],
+                    "avg": round(sum(ordered) / len(ordered), 4) if ordered else None,
+                    "p50": round(ordered[len(ordered) // 2], 4) if ordered else None,
+                    "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4) if ordered else None
+                }
+            return {
+                "paths": paths,
+                "strategies": dict(self._strategies)
+            }
+
+    def _probe_parallel(self, api_key, key_hash, request_id):
+        self._count_strategy("parallel")
+        # Probes run in a copy of the caller's context so their rate-limit waits are reported
+        futures = OrderedDict(
+            (label, self._executor.submit(
+                contextvars.copy_context().run, self._timed_fetch, api_key, request_id, label
+            ))
+            for label in VERSIONS
+        )
+
+        responses = OrderedDict()
+        errors = []
+        for label, future in futures.items():
+            try:
+                responses[label] = future.result()
+            except Exception as e:
+                errors.append(e)
+
+        # v2 wins when both endpoints answer
+        for label, response in responses.items():
+            if response.status_code != 404:
+                self._remember(key_hash, request_id, label)
+                return response, label, "parallel"
+
+        # Neither endpoint knows the ID; a failed probe means we cannot be sure of that
+        if errors:
+            raise errors[0]
+
+        self._remember_missing(key_hash, request_id)
+        label, response = next(iter(responses.items()))
+        return response, label, "parallel"
+
+    def _timed_fetch(self, api_key, request_id, label):
+        started = time.perf_counter()
+        try:
+            return http_client.fetch_results(api_key, request_id, version=VERSIONS[label])
+        finally:
+            with self._lock:
+                self._latencies[label].append(time.perf_counter() - started)
+                self._calls[label] += 1
+
+    def _count_strategy(self, strategy):
+        with self._lock:
+            self._strategies[strategy] += 1
+
+    def _remember(self, key_hash, request_id, label):
+        with self._lock:
+            self._by_request_id[(key_hash, request_id)] = label
+            self._by_request_id.move_to_end((key_hash, request_id))
+            while len(self._by_request_id) > self.max_remembered_ids:
+                self._by_request_id.popitem(last=False)
+            self._by_key[key_hash] = label
+            self._missing.pop((key_hash, request_id), None)
+
+    def _remember_missing(self, key_hash, request_id):
+        if NOT_FOUND_SECONDS <= 0:
+            return
+        with self._lock:
+            self._missing[(key_hash, request_id)] = time.time() + NOT_FOUND_SECONDS
+            self._missing.move_to_end((key_hash, request_id))
+            while len(self._missing) > self.max_remembered_ids:
+                self._missing.popitem(last=False)
+
+    def _forget(self, key_hash, request_id):
+        with self._lock:
+            self._by_request_id.pop((key_hash, request_id), None)
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_version_resolver():
+    """
+    Return the process-wide version resolver.
+    """
+    global _resolver
+
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = VersionResolver()
+    return _resolver
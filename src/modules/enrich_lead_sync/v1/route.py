@@ -1,80 +1,87 @@
 from main import router
 from workflows_cdk import Request, Response
 from flask import request as flask_request
+from src.core import (
+    circuit_breaker, credentials, deadline, dedup_store, email_patterns, http_client, job_store, metrics, poll_schedule,
+    poller, projection, rate_limiter, validation
+)
+from src.core.leads import validate_lead
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import requests
+import os
 import uuid
 import time
 
+# End-to-end time budget when the caller does not set max_wait_seconds (seconds)
+DEFAULT_MAX_WAIT = float(os.environ.get("BETTERCONTACT_SYNC_MAX_WAIT", 45))
+
+# Input checks compiled from this module's schema.json
+VALIDATOR = validation.load(__file__, defaults={"max_wait_seconds": DEFAULT_MAX_WAIT})
+
 @router.route("/execute", methods=["POST"])
 def execute():
     """
     Synchronous lead enrichment function that combines submission and result retrieval.
-    Follows the two-phase process strategy with smart polling and comprehensive error handling.
+    Follows the two-phase process strategy: the lead is submitted here and the shared
+    background poller waits for the results with its progressive polling schedule.
+    The whole call, submission included, answers within its time budget; when the
+    budget runs out it returns what is known and a handle to resume waiting with.
     """
     try:
+        # Wall time of the whole request, submission and polling included
+        started_at = time.time()
+        
+        # Count time spent waiting on the BetterContact rate limit
+        rate_limit = rate_limiter.track_queue_wait()
+        
         # Parse the incoming request
         req = Request(flask_request)
+        metrics.lap("parse")
         
-        # Extract API key from connection
-        connection = req.data.get('connection', {})
-        
-        # For testing, use hardcoded API key if connection is empty
-        if not connection or connection == {}:
-            api_key = "2d7316008303a1c3400d"  # Test API key
-        else:
-            # Try different possible structures
-            if isinstance(connection, dict):
-                # Check if api_key is directly in connection
-                if 'api_key_bearer' in connection:
-                    api_key = connection['api_key_bearer']
-                # Check if it's in connection_data.value
-                elif 'connection_data' in connection:
-                    connection_data = connection.get('connection_data', {})
-                    if 'value' in connection_data:
-                        api_key = connection_data['value'].get('api_key_bearer')
-                    else:
-                        api_key = connection_data.get('api_key_bearer')
-                # Check if it's in value directly
-                elif 'value' in connection:
-                    api_key = connection['value'].get('api_key_bearer')
-                else:
-                    api_key = None
-            else:
-                api_key = None
+        # Resolve the API key from the connection; keys the API rejected recently are refused here
+        api_key, error = credentials.resolve(req.data.get('connection'))
+        if error:
+            return Response.error(
+                error=error
+            )
         
-        if not api_key:
+        # Check field types against the schema and normalize the lead fields
+        data, error = VALIDATOR.validate(req.data)
+        if error:
             return Response.error(
-                error="API key not found in connection"
+                error=error
             )
         
-        # Extract lead data from individual fields
-        first_name = req.data.get('first_name', '')
-        last_name = req.data.get('last_name', '')
-        company = req.data.get('company', '')
-        company_domain = req.data.get('company_domain', '')
-        linkedin_url = req.data.get('linkedin_url', '')
+        # End-to-end time budget: the caller's max_wait_seconds, capped below the server timeout
+        budget = deadline.budget(data['max_wait_seconds'], DEFAULT_MAX_WAIT)
+        deadline.start(budget, started_at)
+        
+        # The resume handle of an earlier call that ran out of time: wait on its request again
+        resume_request_id = data.get('request_id') or ''
         
         # Validate according to Clay logic:
         # - Person Name is required when LinkedIn Profile is not given
         # - Company Name is required when Company Domain is not given
-        
-        if not linkedin_url:
-            # LinkedIn not provided, so name is required
-            if not first_name or not last_name:
+        if not resume_request_id:
+            error = validate_lead(data)
+            if error:
                 return Response.error(
-                    error="First name and last name are required when LinkedIn URL is not provided"
+                    error=error
                 )
         
-        if not company_domain:
-            # Company domain not provided, so company name is required
-            if not company:
-                return Response.error(
-                    error="Company name is required when company domain is not provided"
-                )
+        # Extract lead data from individual fields
+        first_name = data.get('first_name') or ''
+        last_name = data.get('last_name') or ''
+        company = data.get('company') or ''
+        company_domain = data.get('company_domain') or ''
+        linkedin_url = data.get('linkedin_url') or ''
         
         # Extract enrichment options
-        enrich_email = req.data.get('enrich_email_address', True)
-        enrich_phone = req.data.get('enrich_phone_number', True)
+        enrich_email = data['enrich_email_address']
+        enrich_phone = data['enrich_phone_number']
+        # Enriched lead fields to return (all when not set)
+        fields = projection.parse_fields(data.get('fields'))
+        metrics.lap("validate")
         
         # Build lead object
         lead_data = {
@@ -100,185 +107,205 @@ def execute():
             "enrich_phone_number": enrich_phone
         }
         
-        # Step 1: Submit to BetterContact API
-        submit_url = f"https://app.bettercontact.rocks/api/v2/async?api_key={api_key}"
-        headers = {
-            "Content-Type": "application/json"
-        }
+        if resume_request_id:
+            existing = {
+                "request_id": resume_request_id,
+                "submitted_at": data.get('submitted_at'),
+                "result": None,
+                "lead_count": 1
+            }
+        else:
+            # Reuse an earlier submission of the same lead instead of enriching (and paying) twice,
+            # or at least reattach to one that is still running
+            fingerprint = dedup_store.lead_fingerprint(api_key, lead_data, enrich_email, enrich_phone)
+            existing = dedup_store.lookup(fingerprint) or job_store.lookup(fingerprint)
         
-        try:
-            submit_response = requests.post(submit_url, json=request_body, headers=headers, timeout=30)
-        except requests.exceptions.Timeout:
-            return Response.error(
-                error="Timeout while submitting lead for enrichment"
-            )
-        except requests.exceptions.ConnectionError:
-            return Response.error(
-                error="Network error: Unable to connect to BetterContact API"
-            )
-        except requests.exceptions.RequestException as e:
-            return Response.error(
-                error=f"Request error during submission: {str(e)}"
-            )
+        if existing and existing['lead_count'] != 1:
+            # Submitted together with other leads: answer with this lead's own results once they are in,
+            # never with the shared request (or its ID, which would fetch the other leads too)
+            own_result = dedup_store.lead_result(existing)
+            if own_result is not None:
+                metrics.set_outcome("deduplicated")
+                return Response(
+                    data=projection.project(own_result, fields),
+                    metadata={
+                        "request_id": None,
+                        "processing_time_seconds": 0,
+                        "poll_attempts": 0,
+                        "status": "completed",
+                        "deduplicated": True
+                    }
+                )
+            existing = None
         
-        # Handle submission response
-        if submit_response.status_code == 401:
-            return Response.error(
-                error="Invalid API key or unauthorized access"
-            )
-        elif submit_response.status_code == 400:
-            try:
-                error_msg = submit_response.json().get('message', 'Bad request')
-            except:
-                error_msg = 'Bad request'
-            return Response.error(
-                error=f"Invalid request: {error_msg}"
-            )
-        elif submit_response.status_code != 201:
-            return Response.error(
-                error=f"API submission failed with status {submit_response.status_code}"
+        if existing and existing['result'] is not None:
+            metrics.set_outcome("deduplicated")
+            return Response(
+                data=projection.project(existing['result'], fields),
+                metadata={
+                    "request_id": existing['request_id'],
+                    "processing_time_seconds": 0,
+                    "poll_attempts": 0,
+                    "status": "completed",
+                    "deduplicated": True
+                }
             )
         
-        # Get the request ID from submission
-        try:
-            submit_data = submit_response.json()
-            request_id = submit_data.get("id", "")
-        except:
-            return Response.error(
-                error="Invalid response format from BetterContact submission"
-            )
+        # Local-first: a lead at a domain whose email pattern is well known is answered without submitting it
+        prediction = None
+        if not existing and data['local_first'] and email_patterns.can_predict(enrich_email, enrich_phone):
+            prediction = email_patterns.Predictor(api_key).predict(lead_data)
         
-        if not request_id:
-            return Response.error(
-                error="No request ID returned from BetterContact"
+        if prediction:
+            metrics.set_outcome("predicted")
+            return Response(
+                data=projection.project(email_patterns.predict_result(prediction), fields),
+                metadata={
+                    "request_id": None,
+                    "processing_time_seconds": round(time.time() - started_at, 2),
+                    "poll_attempts": 0,
+                    "status": "predicted",
+                    "email_pattern": prediction['email_pattern']
+                }
             )
         
-        # Step 2: Poll for results with smart waiting strategy
-        results_url = f"https://app.bettercontact.rocks/api/v2/async/{request_id}?api_key={api_key}"
-        
-        # Polling configuration
-        max_wait_time = 45  # 45 seconds total timeout
-        initial_delay = 2   # Start with 2 seconds
-        max_delay = 5       # Max 5 seconds between checks
-        elapsed_time = 0
-        poll_count = 0
-        
-        # Initial delay to allow API to register the request
-        time.sleep(1)
-        
-        while elapsed_time < max_wait_time:
-            # Calculate dynamic delay (increases with each poll, up to max_delay)
-            current_delay = min(initial_delay + (poll_count * 0.5), max_delay)
-            
-            # Wait before checking (except on first iteration)
-            if poll_count > 0:
-                time.sleep(current_delay)
-                elapsed_time += current_delay
-            
-            # Check for results
+        if existing:
+            # Already submitted and still processing: wait on that request instead
+            request_id = existing['request_id']
+        else:
+            # Step 1: Submit to BetterContact API
             try:
-                results_response = requests.get(results_url, timeout=10)
+                submit_response = http_client.submit_leads(api_key, request_body)
+            except deadline.DeadlineExceeded:
+                metrics.set_outcome("timeout")
+                return Response.error(
+                    error=f"Time budget of {budget:g} seconds ran out while submitting the lead. It may still have been submitted"
+                )
+            except circuit_breaker.CircuitOpenError as e:
+                metrics.set_outcome("circuit_open")
+                return Response.error(
+                    error=str(e),
+                    data={"retry_after_seconds": e.retry_after}
+                )
             except requests.exceptions.Timeout:
                 return Response.error(
-                    error=f"Timeout while checking enrichment results. Request ID: {request_id}"
+                    error="Timeout while submitting lead for enrichment"
                 )
             except requests.exceptions.ConnectionError:
                 return Response.error(
-                    error=f"Network error while checking results. Request ID: {request_id}"
+                    error="Network error: Unable to connect to BetterContact API"
                 )
             except requests.exceptions.RequestException as e:
                 return Response.error(
-                    error=f"Error checking results: {str(e)}. Request ID: {request_id}"
+                    error=f"Request error during submission: {str(e)}"
                 )
             
-            # Handle different response scenarios
-            if results_response.status_code == 200:
-                # Results are ready - return the full enrichment data
-                try:
-                    enrichment_data = results_response.json()
-                    return Response(
-                        data=enrichment_data,
-                        metadata={
-                            "request_id": request_id,
-                            "processing_time_seconds": elapsed_time,
-                            "poll_attempts": poll_count + 1,
-                            "status": "completed"
-                        }
-                    )
-                except:
-                    return Response.error(
-                        error="Invalid response format from enrichment results"
-                    )
-                    
-            elif results_response.status_code == 202:
-                # Still processing - check the response for status
+            # Handle submission response
+            if submit_response.status_code == 401:
+                return Response.error(
+                    error="Invalid API key or unauthorized access"
+                )
+            elif submit_response.status_code == 400:
                 try:
-                    response_data = results_response.json()
-                    status = response_data.get('status', '').lower()
-                    
-                    if status == 'completed':
-                        # Results are included in 202 response
-                        return Response(
-                            data=response_data,
-                            metadata={
-                                "request_id": request_id,
-                                "processing_time_seconds": elapsed_time,
-                                "poll_attempts": poll_count + 1,
-                                "status": "completed"
-                            }
-                        )
-                    elif status in ['failed', 'error']:
-                        # Enrichment failed
-                        error_message = response_data.get('message', 'Enrichment failed')
-                        return Response.error(
-                            error=f"Enrichment failed: {error_message}",
-                            data={
-                                "request_id": request_id,
-                                "status": status
-                            }
-                        )
-                    # Otherwise continue polling (status is 'in progress' or similar)
+                    error_msg = submit_response.json().get('message', 'Bad request')
                 except:
-                    # If we can't parse the response, continue polling
-                    pass
-                    
-            elif results_response.status_code == 404:
+                    error_msg = 'Bad request'
                 return Response.error(
-                    error=f"Request ID '{request_id}' not found. It may have expired or been invalid."
+                    error=f"Invalid request: {error_msg}"
                 )
-            elif results_response.status_code == 401:
+            elif submit_response.status_code != 201:
                 return Response.error(
-                    error="Authentication failed while checking results"
+                    error=f"API submission failed with status {submit_response.status_code}"
                 )
-            elif results_response.status_code == 406:
-                # Handle the "Unvalid request_id" error
-                if poll_count == 0:
-                    # If it fails on first attempt, wait a bit more and retry
-                    time.sleep(2)
-                    elapsed_time += 2
-                else:
-                    return Response.error(
-                        error=f"Invalid request ID format: {request_id}"
-                    )
-            else:
-                # Unexpected status code
+            
+            # Get the request ID from submission
+            try:
+                submit_data = submit_response.json()
+                request_id = submit_data.get("id", "")
+            except:
                 return Response.error(
-                    error=f"Unexpected response status {results_response.status_code} while checking results"
+                    error="Invalid response format from BetterContact submission"
                 )
             
-            poll_count += 1
+            if not request_id:
+                return Response.error(
+                    error="No request ID returned from BetterContact"
+                )
             
-            # Add some progress tracking for long-running enrichments
-            if elapsed_time > 20 and poll_count % 3 == 0:
-                print(f"Still waiting for enrichment... {elapsed_time}s elapsed")
+            dedup_store.record_submission(
+                api_key, fingerprint, request_id, lead_data['custom_fields']['uuid']
+            )
+            job_store.record_submission(
+                api_key, request_id, fingerprint,
+                enrichment_type=poll_schedule.enrichment_type(enrich_email, enrich_phone)
+            )
+        
+        # Step 2: Wait for results from the shared background poller, for what is left of the budget
+        submitted_at = (existing['submitted_at'] if existing else None) or time.time()
+        
+        # Polls are timed to how long this kind of enrichment usually takes
+        future = poller.get_poller().register(
+            api_key,
+            request_id,
+            max_wait=deadline.remaining(),
+            enrichment_type=poll_schedule.enrichment_type(enrich_email, enrich_phone),
+            submitted_at=submitted_at
+        )
+        
+        try:
+            # Polls are bounded by the same deadline, so the outcome is normally in by then
+            outcome = future.result(timeout=deadline.remaining())
+        except FuturesTimeoutError:
+            outcome = {"status": "timeout"}
+        
+        elapsed_time = round(time.time() - started_at, 2)
+        # Polls ran on the poller's threads; count their rate-limit waits and stage timings here too
+        rate_limiter.merge(rate_limit, outcome.get('rate_limit'))
+        metrics.merge(outcome.get('timings'))
+        metrics.set_outcome(outcome['status'])
+        
+        if outcome['status'] == 'completed':
+            # Results are ready - return the full enrichment data
+            return Response(
+                data=projection.project(outcome['data'], fields),
+                metadata={
+                    "request_id": request_id,
+                    "processing_time_seconds": elapsed_time,
+                    "poll_attempts": outcome['poll_count'],
+                    "status": "completed",
+                    "deduplicated": existing is not None and not resume_request_id,
+                    "resumed": bool(resume_request_id),
+                    "rate_limit": rate_limiter.report(rate_limit)
+                }
+            )
+        elif outcome['status'] == 'failed':
+            # Enrichment failed
+            return Response.error(
+                error=outcome['error'],
+                data=projection.project(outcome['data'], fields)
+            )
+        elif outcome['status'] != 'timeout':
+            return Response.error(
+                error=outcome['error']
+            )
         
-        # Timeout reached
+        # Budget used up: report what is known and how to resume waiting
+        progress = poller.get_poller().progress(api_key, request_id) or outcome
         return Response.error(
-            error=f"Enrichment timeout after {max_wait_time} seconds. The request may still be processing. Request ID: {request_id}",
+            error=f"Enrichment timeout after {elapsed_time} seconds (budget {budget:g}s). The request may still be processing. Request ID: {request_id}",
             data={
                 "request_id": request_id,
                 "status": "timeout",
-                "elapsed_seconds": elapsed_time
+                "last_status": progress.get('last_status', "submitted"),
+                "poll_attempts": progress.get('poll_count', 0),
+                "elapsed_seconds": elapsed_time,
+                "max_wait_seconds": budget,
+                # Send these back to this module (or request_id to Get Enrichment Results) to continue
+                "resume": {
+                    "request_id": request_id,
+                    "submitted_at": round(submitted_at, 3)
+                },
+                "rate_limit": rate_limiter.report(rate_limit)
             }
         )
         
@@ -1,76 +1,76 @@
 from main import router
 from workflows_cdk import Request, Response
 from flask import request as flask_request
+from src.core import (
+    circuit_breaker, completions, credentials, dedup_store, email_patterns, http_client, job_store, metrics,
+    poll_schedule, rate_limiter, validation
+)
+from src.core.leads import validate_lead
+import logging
 import requests
 import uuid
 
+logger = logging.getLogger(__name__)
+
+# Input checks compiled from this module's schema.json
+VALIDATOR = validation.load(__file__)
+
 @router.route("/execute", methods=["POST"])
 def execute():
     try:
+        # Count time spent waiting on the BetterContact rate limit
+        rate_limit = rate_limiter.track_queue_wait()
+        
         # Parse the incoming request
         req = Request(flask_request)
+        metrics.lap("parse")
         
-        # Extract API key from connection
-        connection = req.data.get('connection', {})
-        
-        # For testing, use hardcoded API key if connection is empty
-        # This will be replaced with proper connection handling in production
-        if not connection or connection == {}:
-            api_key = "2d7316008303a1c3400d"  # Test API key
-        else:
-            # Try different possible structures
-            if isinstance(connection, dict):
-                # Check if api_key is directly in connection
-                if 'api_key_bearer' in connection:
-                    api_key = connection['api_key_bearer']
-                # Check if it's in connection_data.value
-                elif 'connection_data' in connection:
-                    connection_data = connection.get('connection_data', {})
-                    if 'value' in connection_data:
-                        api_key = connection_data['value'].get('api_key_bearer')
-                    else:
-                        api_key = connection_data.get('api_key_bearer')
-                # Check if it's in value directly
-                elif 'value' in connection:
-                    api_key = connection['value'].get('api_key_bearer')
-                else:
-                    api_key = None
-            else:
-                api_key = None
-        
-        if not api_key:
+        # Resolve the API key from the connection; keys the API rejected recently are refused here
+        api_key, error = credentials.resolve(req.data.get('connection'))
+        if error:
             return Response.error(
-                error="API key not found in connection"
+                error=error
             )
         
-        # Extract lead data from individual fields
-        first_name = req.data.get('first_name', '')
-        last_name = req.data.get('last_name', '')
-        company = req.data.get('company', '')
-        company_domain = req.data.get('company_domain', '')
-        linkedin_url = req.data.get('linkedin_url', '')
+        # Check field types against the schema and normalize the lead fields
+        data, error = VALIDATOR.validate(req.data)
+        if error:
+            return Response.error(
+                error=error
+            )
         
         # Validate according to Clay logic:
         # - Person Name is required when LinkedIn Profile is not given
         # - Company Name is required when Company Domain is not given
+        error = validate_lead(data)
+        if error:
+            return Response.error(
+                error=error
+            )
         
-        if not linkedin_url:
-            # LinkedIn not provided, so name is required
-            if not first_name or not last_name:
-                return Response.error(
-                    error="First name and last name are required when LinkedIn URL is not provided"
-                )
-        
-        if not company_domain:
-            # Company domain not provided, so company name is required
-            if not company:
-                return Response.error(
-                    error="Company name is required when company domain is not provided"
-                )
+        # Extract lead data from individual fields
+        first_name = data.get('first_name') or ''
+        last_name = data.get('last_name') or ''
+        company = data.get('company') or ''
+        company_domain = data.get('company_domain') or ''
+        linkedin_url = data.get('linkedin_url') or ''
         
         # Extract enrichment options
-        enrich_email = req.data.get('enrich_email_address', True)
-        enrich_phone = req.data.get('enrich_phone_number', True)
+        enrich_email = data['enrich_email_address']
+        enrich_phone = data['enrich_phone_number']
+        
+        # Optional completion delivery instead of polling
+        callback_url = data.get('callback_url') or ''
+        queue_results = data['queue_results']
+        notify = bool(callback_url) or queue_results
+        
+        # Callbacks are sent from this server: no private or link-local addresses
+        callback_error = completions.callback_url_error(callback_url) if callback_url else None
+        if callback_error:
+            return Response.error(
+                error=callback_error
+            )
+        metrics.lap("validate")
         
         # Build lead object
         lead_data = {
@@ -96,20 +96,99 @@ def execute():
             "enrich_phone_number": enrich_phone
         }
         
-        # Submit to BetterContact API
-        url = f"https://app.bettercontact.rocks/api/v2/async?api_key={api_key}"
-        headers = {
-            "Content-Type": "application/json"
-        }
+        # Let BetterContact push the results to our webhook when one is configured
+        webhook_url = completions.webhook_url() if notify else None
+        if webhook_url:
+            request_body['webhook'] = webhook_url
+        
+        # Reuse an earlier submission of the same lead instead of enriching (and paying) twice
+        fingerprint = dedup_store.lead_fingerprint(api_key, lead_data, enrich_email, enrich_phone)
+        existing = dedup_store.lookup(fingerprint)
+        if existing and existing['lead_count'] != 1:
+            # Submitted together with other leads: their shared request ID would fetch their results too
+            existing = None
+        
+        if existing:
+            if notify and existing['result'] is not None:
+                completions.deliver_existing(
+                    api_key, existing['request_id'], existing['result'], callback_url, queue_results
+                )
+            elif notify:
+                completions.track(api_key, existing['request_id'], callback_url, queue_results)
+            
+            metrics.set_outcome("deduplicated")
+            return Response(
+                data={
+                    "request_id": existing['request_id'],
+                    "status": "completed" if existing['result'] is not None else "submitted",
+                    "lead": {
+                        "first_name": first_name,
+                        "last_name": last_name,
+                        "company": company or company_domain
+                    }
+                },
+                metadata={
+                    "deduplicated": True,
+                    "original_submitted_at": existing['submitted_at'],
+                    "rate_limit": rate_limiter.report(rate_limit)
+                }
+            )
         
-        response = requests.post(url, json=request_body, headers=headers)
+        # Local-first: a lead at a domain whose email pattern is well known is answered without submitting it.
+        # Callers waiting for a callback or queued result always get the lead submitted.
+        if data['local_first'] and not notify and email_patterns.can_predict(enrich_email, enrich_phone):
+            prediction = email_patterns.Predictor(api_key).predict(lead_data)
+            if prediction:
+                metrics.set_outcome("predicted")
+                return Response(
+                    data={
+                        "request_id": None,
+                        "status": "predicted",
+                        "lead": {
+                            "first_name": first_name,
+                            "last_name": last_name,
+                            "company": company or company_domain
+                        },
+                        "prediction": prediction
+                    },
+                    metadata={
+                        "deduplicated": False,
+                        "email_pattern": prediction['email_pattern'],
+                        "rate_limit": rate_limiter.report(rate_limit)
+                    }
+                )
+        
+        # Submit to BetterContact API
+        try:
+            response = http_client.submit_leads(api_key, request_body)
+        except circuit_breaker.CircuitOpenError as e:
+            metrics.set_outcome("circuit_open")
+            return Response.error(
+                error=str(e),
+                data={"retry_after_seconds": e.retry_after}
+            )
+        except requests.exceptions.Timeout:
+            return Response.error(
+                error="Timeout while submitting lead for enrichment"
+            )
+        except requests.exceptions.ConnectionError:
+            return Response.error(
+                error="Network error: Unable to connect to BetterContact API"
+            )
+        except requests.exceptions.RequestException as e:
+            return Response.error(
+                error=f"Request error during submission: {str(e)}"
+            )
         
         if response.status_code == 401:
             return Response.error(
                 error="Invalid API key or unauthorized access"
             )
         elif response.status_code == 400:
-            error_msg = response.json().get('message', 'Bad request')
+            try:
+                error_msg = response.json().get('message', 'Bad request')
+            except (ValueError, AttributeError):
+                error_msg = 'Bad request'
             return Response.error(
                 error=f"Invalid request: {error_msg}"
             )
@@ -121,6 +200,34 @@ def execute():
         # Return the response data
         response_data = response.json()
         
+        # The lead is submitted from here on: bookkeeping failures must not hide its request ID
+        tracking_error = None
+        if response_data.get("id"):
+            try:
+                dedup_store.record_submission(
+                    api_key, fingerprint, response_data["id"], lead_data['custom_fields']['uuid']
+                )
+                job_store.record_submission(
+                    api_key, response_data["id"], fingerprint,
+                    enrichment_type=poll_schedule.enrichment_type(enrich_email, enrich_phone)
+                )
+                if notify:
+                    completions.track(
+                        api_key, response_data["id"], callback_url, queue_results,
+                        webhook_registered=bool(webhook_url)
+                    )
+            except Exception as e:
+                logger.exception("Could not record submission %s", response_data["id"])
+                tracking_error = f"Lead submitted, but the submission could not be recorded: {str(e)}"
+        
+        metadata = {
+            "api_response": response_data,
+            "deduplicated": False,
+            "rate_limit": rate_limiter.report(rate_limit)
+        }
+        if tracking_error:
+            metadata['tracking_error'] = tracking_error
+        
         return Response(
             data={
                 "request_id": response_data.get("id", ""),
@@ -131,9 +238,7 @@ def execute():
                     "company": company or company_domain
                 }
             },
-            metadata={
-                "api_response": response_data
-            }
+            metadata=metadata
         )
         
     except Exception as e:
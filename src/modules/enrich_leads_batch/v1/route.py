@@ -0,0 +1,313 @@
+from main import router
+from workflows_cdk import Request, Response
+from flask import request as flask_request
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import time
+from src.core import completions, credentials, dedup_store, deadline, email_patterns, metrics, rate_limiter, validation
+from src.core.leads import build_lead_data, submit_chunk, validate_leads
+
+# Number of submissions sent to BetterContact at the same time
+MAX_CONCURRENT_SUBMISSIONS = 4
+
+# Time budget for all submissions when the caller does not set max_wait_seconds (seconds)
+DEFAULT_MAX_WAIT = float(os.environ.get("BETTERCONTACT_BATCH_MAX_WAIT", 120))
+# A chunk is only sent with at least this much of the budget left (seconds)
+MIN_SUBMIT_SECONDS = 1
+
+# Input checks compiled from this module's schema.json; LEAD_VALIDATOR checks each lead
+VALIDATOR = validation.load(__file__)
+LEAD_VALIDATOR = VALIDATOR.items('leads')
+
+
+def submit_in_budget(api_key, chunk, enrich_email, enrich_phone, webhook_url):
+    """
+    Submit one chunk unless the budget has run out while it waited for a
+    free submission slot. A chunk that is not sent is returned as
+    {"uuids": [...], "unsubmitted": True}.
+    """
+    if not deadline.allows(MIN_SUBMIT_SECONDS):
+        return {"uuids": [lead['custom_fields']['uuid'] for lead in chunk], "unsubmitted": True}
+    return submit_chunk(api_key, chunk, enrich_email, enrich_phone, webhook_url)
+
+
+@router.route("/execute", methods=["POST"])
+def execute():
+    """
+    Batch lead enrichment. Validates every lead, packs the valid ones into
+    BetterContact-sized submissions, sends them concurrently and returns the
+    request ID for each lead keyed by its custom_fields.uuid. In local-first
+    mode, leads at domains whose email pattern is well known are answered with
+    a predicted email instead of being submitted. Submissions share one time
+    budget; chunks not yet sent when it runs out are returned unsubmitted.
+    """
+    try:
+        # Wall time of the whole request, submissions included
+        started_at = time.time()
+
+        # Count time spent waiting on the BetterContact rate limit
+        rate_limit = rate_limiter.track_queue_wait()
+
+        # Parse the incoming request
+        req = Request(flask_request)
+        metrics.lap("parse")
+
+        # Resolve the API key from the connection; keys the API rejected recently are refused here
+        api_key, error = credentials.resolve(req.data.get('connection'))
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Check field types and limits against the schema
+        data, error = VALIDATOR.validate(req.data)
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Extract the list of leads
+        leads = data['leads']
+
+        if not leads:
+            return Response.error(
+                error="A non-empty list of leads is required"
+            )
+
+        chunk_size = data['chunk_size']
+
+        # Time budget for the submissions: the caller's max_wait_seconds, capped below the server timeout
+        budget = deadline.budget(data['max_wait_seconds'], DEFAULT_MAX_WAIT)
+        deadline.start(budget, started_at)
+
+        # Extract enrichment options
+        enrich_email = data['enrich_email_address']
+        enrich_phone = data['enrich_phone_number']
+
+        # Optional completion delivery instead of polling
+        callback_url = data.get('callback_url') or ''
+        queue_results = data['queue_results']
+        notify = bool(callback_url) or queue_results
+
+        # Callbacks are sent from this server: no private or link-local addresses
+        callback_error = completions.callback_url_error(callback_url) if callback_url else None
+        if callback_error:
+            return Response.error(
+                error=callback_error
+            )
+
+        webhook_url = completions.webhook_url() if notify else None
+
+        # Local-first predictions; callers waiting for callbacks or queued results get every lead submitted
+        predictor = None
+        if data['local_first'] and not notify and email_patterns.can_predict(enrich_email, enrich_phone):
+            predictor = email_patterns.Predictor(api_key)
+
+        # Validate every lead, keeping the valid ones in their original order
+        valid_leads = []
+        invalid_leads = []
+        seen_uuids = set()
+        # Leads submitted earlier are mapped to their existing request ID instead of resubmitted
+        request_ids = {}
+        deduplicated_uuids = []
+        deduplicated_requests = {}
+        fingerprints = {}
+        # Leads identical to an earlier lead of this batch ride on its submission: first uuid -> their uuids
+        first_uuids = {}
+        batch_duplicates = {}
+        # Leads answered from their domain's email pattern, by uuid
+        predicted_leads = {}
+
+        # Every lead is checked and normalized in one pass, then by the Clay rules
+        for index, (lead, error) in enumerate(validate_leads(leads, LEAD_VALIDATOR)):
+            if error:
+                invalid_leads.append({"index": index, "error": error})
+                continue
+
+            lead_data = build_lead_data(lead)
+            lead_uuid = lead_data['custom_fields']['uuid']
+            if lead_uuid in seen_uuids:
+                invalid_leads.append({
+                    "index": index,
+                    "error": f"Duplicate custom_fields.uuid '{lead_uuid}'"
+                })
+                continue
+
+            seen_uuids.add(lead_uuid)
+
+            fingerprint = dedup_store.lead_fingerprint(api_key, lead_data, enrich_email, enrich_phone)
+            existing = dedup_store.lookup(fingerprint)
+            if existing:
+                request_ids[lead_uuid] = existing['request_id']
+                deduplicated_uuids.append(lead_uuid)
+                deduplicated_requests[existing['request_id']] = existing['result']
+                continue
+
+            prediction = predictor.predict(lead_data) if predictor else None
+            if prediction:
+                predicted_leads[lead_uuid] = prediction
+                continue
+
+            if fingerprint in first_uuids:
+                batch_duplicates.setdefault(first_uuids[fingerprint], []).append(lead_uuid)
+                continue
+
+            first_uuids[fingerprint] = lead_uuid
+            fingerprints[lead_uuid] = fingerprint
+            valid_leads.append(lead_data)
+
+        metrics.lap("validate")
+
+        if notify:
+            for request_id, result in deduplicated_requests.items():
+                if result is not None:
+                    completions.deliver_existing(api_key, request_id, result, callback_url, queue_results)
+                else:
+                    completions.track(api_key, request_id, callback_url, queue_results)
+
+        if not valid_leads and (deduplicated_uuids or predicted_leads):
+            # Every valid lead was already submitted or predicted; nothing to send
+            metrics.set_outcome("deduplicated" if deduplicated_uuids else "predicted")
+            return Response(
+                data={
+                    "request_ids": request_ids,
+                    "status": "submitted" if request_ids else "predicted",
+                    "submissions": [],
+                    "failed_submissions": [],
+                    "invalid_leads": invalid_leads,
+                    "predicted_leads": predicted_leads
+                },
+                metadata={
+                    "total_leads": len(leads),
+                    "submitted_leads": len(request_ids),
+                    "invalid_leads": len(invalid_leads),
+                    "deduplicated_leads": len(deduplicated_uuids),
+                    "predicted_leads": len(predicted_leads),
+                    "submission_count": 0,
+                    "rate_limit": rate_limiter.report(rate_limit)
+                }
+            )
+
+        if not valid_leads:
+            return Response.error(
+                error="None of the provided leads passed validation",
+                data={
+                    "invalid_leads": invalid_leads
+                }
+            )
+
+        # Split into API-sized chunks and submit them concurrently
+        chunks = [
+            valid_leads[start:start + chunk_size]
+            for start in range(0, len(valid_leads), chunk_size)
+        ]
+
+        # Submissions run in copies of this request's context so they share its
+        # deadline and their rate-limit waits are counted
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_SUBMISSIONS, len(chunks))) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    submit_in_budget, api_key, chunk, enrich_email, enrich_phone, webhook_url
+                )
+                for chunk in chunks
+            ]
+            results = [future.result() for future in futures]
+
+        # An invalid API key fails every chunk the same way
+        if all(result.get('status_code') == 401 for result in results):
+            return Response.error(
+                error="Invalid API key or unauthorized access"
+            )
+
+        submissions = []
+        failed_submissions = []
+        unsubmitted_chunks = []
+
+        for result in results:
+            # Duplicates within the batch share the outcome of the lead they repeat
+            duplicate_uuids = [
+                duplicate_uuid for lead_uuid in result['uuids'] for duplicate_uuid in batch_duplicates.get(lead_uuid, [])
+            ]
+            if 'request_id' in result:
+                for lead_uuid in result['uuids']:
+                    request_ids[lead_uuid] = result['request_id']
+                    dedup_store.record_submission(
+                        api_key, fingerprints[lead_uuid], result['request_id'], lead_uuid, len(result['uuids'])
+                    )
+                for lead_uuid in duplicate_uuids:
+                    request_ids[lead_uuid] = result['request_id']
+                submissions.append({
+                    "request_id": result['request_id'],
+                    "lead_count": len(result['uuids'])
+                })
+                if notify:
+                    completions.track(
+                        api_key, result['request_id'], callback_url, queue_results,
+                        webhook_registered=bool(webhook_url)
+                    )
+            elif result.get('unsubmitted'):
+                # Never sent: safe to submit again in a later call
+                unsubmitted_chunks.append({
+                    "uuids": result['uuids'] + duplicate_uuids
+                })
+            else:
+                failed = {
+                    "uuids": result['uuids'] + duplicate_uuids,
+                    "error": result['error']
+                }
+                # Submissions refused while the API was failing can be sent again after this long
+                if 'retry_after_seconds' in result:
+                    failed['retry_after_seconds'] = result['retry_after_seconds']
+                failed_submissions.append(failed)
+
+        if not submissions and not failed_submissions and not deduplicated_uuids and not predicted_leads:
+            return Response.error(
+                error="The time budget ran out before any lead was submitted",
+                data={
+                    "unsubmitted_chunks": unsubmitted_chunks,
+                    "invalid_leads": invalid_leads
+                }
+            )
+
+        if not submissions and not deduplicated_uuids and not predicted_leads:
+            return Response.error(
+                error=f"All submissions failed: {failed_submissions[0]['error']}",
+                data={
+                    "failed_submissions": failed_submissions,
+                    "unsubmitted_chunks": unsubmitted_chunks,
+                    "invalid_leads": invalid_leads
+                }
+            )
+
+        partial = failed_submissions or unsubmitted_chunks
+        if partial:
+            metrics.set_outcome("partially_submitted")
+
+        return Response(
+            data={
+                "request_ids": request_ids,
+                "status": "submitted" if not partial else "partially_submitted",
+                "submissions": submissions,
+                "failed_submissions": failed_submissions,
+                "unsubmitted_chunks": unsubmitted_chunks,
+                "invalid_leads": invalid_leads,
+                "predicted_leads": predicted_leads
+            },
+            metadata={
+                "total_leads": len(leads),
+                "submitted_leads": len(request_ids),
+                "invalid_leads": len(invalid_leads),
+                "deduplicated_leads": len(deduplicated_uuids) + sum(len(uuids) for uuids in batch_duplicates.values()),
+                "unsubmitted_leads": sum(len(chunk['uuids']) for chunk in unsubmitted_chunks),
+                "predicted_leads": len(predicted_leads),
+                "submission_count": len(submissions),
+                "rate_limit": rate_limiter.report(rate_limit)
+            }
+        )
+
+    except Exception as e:
+        return Response.error(
+            error=f"Unexpected error: {str(e)}"
+        )
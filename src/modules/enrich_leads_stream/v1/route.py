@@ -0,0 +1,317 @@
+from main import router
+from workflows_cdk import Response
+from flask import Response as FlaskResponse, request as flask_request, stream_with_context
+from concurrent.futures import FIRST_COMPLETED, wait
+from src.core import (
+    credentials, dedup_store, email_patterns, encoding, metrics, poll_schedule, projection, rate_limiter, validation
+)
+from src.core.leads import (
+    READ_SIZE, UploadError, build_lead_data, iter_csv_leads, iter_ndjson_leads, submit_chunk, validated_rows
+)
+from src.core.poller import get_poller
+import os
+import tempfile
+
+# Submissions waiting for results at the same time. Reading the upload pauses
+# while the window is full, which keeps memory flat however long the file is.
+MAX_PENDING_SUBMISSIONS = int(os.environ.get("BETTERCONTACT_STREAM_WINDOW", 8))
+
+# How long each submission is polled before its rows are reported as failed (seconds)
+STREAM_MAX_WAIT = float(os.environ.get("BETTERCONTACT_STREAM_MAX_WAIT", 600))
+
+# Largest upload accepted; it is spooled to a temporary file before any result is sent
+MAX_UPLOAD_BYTES = int(float(os.environ.get("BETTERCONTACT_STREAM_MAX_UPLOAD_MB", 1024)) * 1024 * 1024)
+# Directory for the spooled uploads (the system temporary directory when empty)
+SPOOL_DIR = os.environ.get("BETTERCONTACT_STREAM_SPOOL_DIR", "") or None
+
+# Query parameter checks compiled from this module's schema.json
+VALIDATOR = validation.load(__file__)
+
+
+def get_api_key():
+    """
+    The upload body is the lead list, so the API key comes from the
+    Authorization bearer header (or X-Api-Key). Never from the query string,
+    which access logs record.
+    """
+    authorization = flask_request.headers.get('Authorization', '')
+    if authorization.lower().startswith('bearer '):
+        return authorization[7:].strip()
+    return flask_request.headers.get('X-Api-Key')
+
+
+def spool_upload(stream):
+    """
+    Copy the upload to a temporary file, so it is read in full before the
+    response starts (clients that only read the response once their upload is
+    sent would otherwise deadlock) without being held in memory. Returns the
+    file, rewound, or None when the upload is larger than MAX_UPLOAD_BYTES.
+    """
+    spool = tempfile.TemporaryFile(dir=SPOOL_DIR)
+    size = 0
+    while True:
+        block = stream.read(READ_SIZE)
+        if not block:
+            break
+        size += len(block)
+        if size > MAX_UPLOAD_BYTES:
+            spool.close()
+            return None
+        spool.write(block)
+    spool.seek(0)
+    return spool
+
+
+def result_rows(pending, outcome, fields=None):
+    """
+    Yield an output row for every lead of a finished submission, with the
+    enriched lead trimmed to `fields`.
+    """
+    rows = pending['rows']
+
+    if outcome['status'] == 'completed':
+        for lead in (outcome.get('data') or {}).get('data') or []:
+            result_uuid = (lead.get('custom_fields') or {}).get('uuid')
+            row = rows.pop(result_uuid, None)
+            if row is None:
+                continue
+            row_number, lead_uuid = row
+            yield {
+                "row": row_number,
+                "uuid": lead_uuid,
+                "status": "completed",
+                "request_id": pending['request_id'],
+                "lead": projection.project_lead(lead, fields)
+            }
+        error = "Lead missing from enrichment results"
+    else:
+        error = outcome.get('error') or f"Enrichment {outcome['status']}"
+
+    for row_number, lead_uuid in rows.values():
+        yield {
+            "row": row_number,
+            "uuid": lead_uuid,
+            "status": "failed",
+            "request_id": pending['request_id'],
+            "error": error
+        }
+
+
+@router.route("/execute", methods=["POST"])
+def execute():
+    """
+    Streaming bulk enrichment. Reads an NDJSON or CSV lead list from the request
+    body row by row, submits valid leads in chunks as it goes and streams one
+    NDJSON row per lead back as each submission completes, followed by a summary.
+    In local-first mode, leads at domains whose email pattern is well known are
+    answered at once with a predicted email instead of being submitted.
+    """
+    try:
+        api_key = get_api_key()
+        if not api_key:
+            return Response.error(
+                error="API key not found. Send it as an Authorization bearer token"
+            )
+
+        # Keys the API rejected recently are refused before the upload is read
+        api_key, error = credentials.check(api_key)
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Check the query parameters against the schema
+        params, error = VALIDATOR.validate(flask_request.args.to_dict())
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Upload format: ?format= wins, otherwise the content type
+        upload_format = (params.get('format') or '').lower()
+        if not upload_format:
+            upload_format = 'csv' if flask_request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+        if upload_format not in ('csv', 'ndjson'):
+            return Response.error(
+                error="Format must be 'ndjson' or 'csv'"
+            )
+
+        chunk_size = params['chunk_size']
+
+        # Extract enrichment options
+        enrich_email = params['enrich_email_address']
+        enrich_phone = params['enrich_phone_number']
+        # Enriched lead fields to return (all when not set)
+        fields = projection.parse_fields(params.get('fields'))
+        # Local-first predictions, when the upload only asks for emails
+        predictor = None
+        if params['local_first'] and email_patterns.can_predict(enrich_email, enrich_phone):
+            predictor = email_patterns.Predictor(api_key)
+
+        parse_rows = iter_csv_leads if upload_format == 'csv' else iter_ndjson_leads
+        metrics.lap("validate")
+
+        upload = spool_upload(flask_request.stream)
+        if upload is None:
+            return Response.error(
+                error=f"Upload is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+            )
+        metrics.lap("upload")
+
+    except Exception as e:
+        return Response.error(
+            error=f"Unexpected error: {str(e)}"
+        )
+
+    def generate():
+        rate_limit = rate_limiter.track_queue_wait()
+        counts = {"completed": 0, "predicted": 0, "invalid": 0, "failed": 0, "deduplicated": 0, "submissions": 0}
+        # Submissions waiting on the poller: request ID, future and result uuid -> (row, caller uuid)
+        pending = []
+        # Every custom_fields.uuid read so far, so a duplicate in a later chunk is not submitted (and billed) again
+        seen_uuids = set()
+        # Leads read but not yet submitted
+        chunk = []
+        chunk_rows = {}
+        fingerprints = {}
+        stop_error = None
+        stop_outcome = None
+
+        def emit(row):
+            counts[row['status']] += 1
+            return encoding.dumps(row) + "\n"
+
+        def submit_pending_chunk():
+            result = submit_chunk(api_key, chunk, enrich_email, enrich_phone)
+            lines = []
+            if 'request_id' in result:
+                counts['submissions'] += 1
+                for lead_uuid in result['uuids']:
+                    dedup_store.record_submission(
+                        api_key, fingerprints[lead_uuid], result['request_id'], lead_uuid, len(result['uuids'])
+                    )
+                pending.append({
+                    "request_id": result['request_id'],
+                    "rows": dict(chunk_rows),
+                    "future": get_poller().register(
+                        api_key, result['request_id'], max_wait=STREAM_MAX_WAIT, cache_result=False,
+                        enrichment_type=poll_schedule.enrichment_type(enrich_email, enrich_phone, len(chunk))
+                    )
+                })
+            else:
+                for row_number, lead_uuid in chunk_rows.values():
+                    lines.append(emit({
+                        "row": row_number,
+                        "uuid": lead_uuid,
+                        "status": "failed",
+                        "error": result['error']
+                    }))
+            del chunk[:]
+            chunk_rows.clear()
+            fingerprints.clear()
+            return lines, result
+
+        def finished_lines(block):
+            lines = []
+            if pending and block:
+                wait([item['future'] for item in pending], return_when=FIRST_COMPLETED)
+            for item in [item for item in pending if item['future'].done()]:
+                pending.remove(item)
+                outcome = item['future'].result()
+                rate_limiter.merge(rate_limit, outcome.get('rate_limit'))
+                metrics.merge(outcome.get('timings'))
+                lines.extend(emit(row) for row in result_rows(item, outcome, fields))
+            return lines
+
+        # Rows are checked and normalized a block at a time as they are read
+        upload_rows = validated_rows(parse_rows(upload))
+        while True:
+            try:
+                row_number, lead, error = next(upload_rows)
+            except StopIteration:
+                break
+            except UploadError as e:
+                # The rest of the upload cannot be read; what was read is still submitted
+                stop_error = str(e)
+                stop_outcome = "invalid_upload"
+                break
+            if error:
+                yield emit({"row": row_number, "status": "invalid", "error": error})
+                continue
+
+            lead_data = build_lead_data(lead, "StackSync Stream Lead")
+            lead_uuid = lead_data['custom_fields']['uuid']
+            if lead_uuid in seen_uuids:
+                yield emit({
+                    "row": row_number,
+                    "uuid": lead_uuid,
+                    "status": "invalid",
+                    "error": f"Duplicate custom_fields.uuid '{lead_uuid}'"
+                })
+                continue
+            seen_uuids.add(lead_uuid)
+
+            # Reuse an earlier submission of the same lead
+            fingerprint = dedup_store.lead_fingerprint(api_key, lead_data, enrich_email, enrich_phone)
+            existing = dedup_store.lookup(fingerprint)
+            if existing and existing['lead_uuid']:
+                counts['deduplicated'] += 1
+                reused = {
+                    "request_id": existing['request_id'],
+                    "rows": {existing['lead_uuid']: (row_number, lead_uuid)}
+                }
+                if existing['result'] is not None:
+                    for row in result_rows(reused, {"status": "completed", "data": existing['result']}, fields):
+                        yield emit(row)
+                else:
+                    reused['future'] = get_poller().register(
+                        api_key, existing['request_id'], max_wait=STREAM_MAX_WAIT, cache_result=False
+                    )
+                    pending.append(reused)
+            else:
+                # Answer leads at domains whose email pattern is well known without submitting them
+                prediction = predictor.predict(lead_data) if predictor else None
+                if prediction:
+                    yield emit({
+                        "row": row_number,
+                        "uuid": lead_uuid,
+                        "status": "predicted",
+                        "lead": projection.project_lead(prediction, fields)
+                    })
+                else:
+                    chunk.append(lead_data)
+                    chunk_rows[lead_uuid] = (row_number, lead_uuid)
+                    fingerprints[lead_uuid] = fingerprint
+
+            if len(chunk) >= chunk_size:
+                lines, result = submit_pending_chunk()
+                yield from lines
+                if result.get('status_code') == 401:
+                    stop_error = "Invalid API key or unauthorized access"
+                    stop_outcome = "unauthorized"
+                    break
+                if 'retry_after_seconds' in result:
+                    # The API keeps failing: stop reading rather than fail every chunk that follows
+                    stop_error = result['error']
+                    stop_outcome = "circuit_open"
+                    break
+
+            # Stream whatever has completed; wait for a slot when the window is full
+            yield from finished_lines(block=len(pending) >= MAX_PENDING_SUBMISSIONS)
+
+        if chunk and stop_outcome in (None, "invalid_upload"):
+            lines, _ = submit_pending_chunk()
+            yield from lines
+
+        while pending:
+            yield from finished_lines(block=True)
+
+        summary = dict(counts, rate_limit=rate_limiter.report(rate_limit))
+        if stop_error:
+            summary['error'] = stop_error
+            metrics.set_outcome(stop_outcome)
+        yield encoding.dumps({"summary": summary}) + "\n"
+
+    response = FlaskResponse(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.call_on_close(upload.close)
+    return response
@@ -0,0 +1,314 @@
+from main import router
+from workflows_cdk import Request, Response
+from flask import request as flask_request
+from concurrent.futures import ThreadPoolExecutor, wait
+from src.core import (
+    credentials, deadline, dedup_store, email_patterns, metrics, poll_schedule, poller, projection, rate_limiter,
+    validation
+)
+from src.core.leads import build_lead_data, submit_chunk, validate_leads
+import contextvars
+import os
+import time
+
+# End-to-end time budget when the caller does not set max_wait_seconds (seconds)
+DEFAULT_MAX_WAIT = float(os.environ.get("BETTERCONTACT_SYNC_MAX_WAIT", 45))
+
+# Most leads one call may enrich; larger lists belong in the batch or stream modules
+MAX_LEADS = int(os.environ.get("BETTERCONTACT_SYNC_MAX_LEADS", 1000))
+
+# Number of submissions sent to BetterContact at the same time
+MAX_CONCURRENT_SUBMISSIONS = 4
+
+# Input checks compiled from this module's schema.json; LEAD_VALIDATOR checks each lead
+VALIDATOR = validation.load(__file__, defaults={"max_wait_seconds": DEFAULT_MAX_WAIT})
+LEAD_VALIDATOR = VALIDATOR.items('leads')
+
+
+def merge_outcome(results, pending, outcome):
+    """
+    Fill in the result of every lead of one request from its poll outcome.
+    `pending` maps the uuid each lead was submitted under to its input indexes.
+    """
+    rows = dict(pending['rows'])
+
+    if outcome['status'] == 'completed':
+        for lead in (outcome.get('data') or {}).get('data') or []:
+            result_uuid = (lead.get('custom_fields') or {}).get('uuid')
+            for index in rows.pop(result_uuid, []):
+                results[index].update({"status": "completed", "lead": lead})
+        error = "Lead missing from enrichment results"
+    else:
+        error = outcome.get('error') or f"Enrichment {outcome['status']}"
+
+    for indexes in rows.values():
+        for index in indexes:
+            results[index].update({"status": "failed", "error": error})
+
+
+@router.route("/execute", methods=["POST"])
+def execute():
+    """
+    Synchronous multi-lead enrichment. Validates every lead, submits the valid
+    ones in BetterContact-sized chunks sent concurrently, waits on all of their
+    request IDs together through the shared background poller and returns one
+    result per lead in input order. The whole call answers within one time
+    budget, so it takes about as long as its slowest submission rather than
+    the sum of them; leads still processing when the budget runs out are
+    returned with their request ID. In local-first mode, leads at domains
+    whose email pattern is well known are answered with a predicted email
+    instead of being submitted.
+    """
+    try:
+        # Wall time of the whole request, submissions and polling included
+        started_at = time.time()
+
+        # Count time spent waiting on the BetterContact rate limit
+        rate_limit = rate_limiter.track_queue_wait()
+
+        # Parse the incoming request
+        req = Request(flask_request)
+        metrics.lap("parse")
+
+        # Resolve the API key from the connection; keys the API rejected recently are refused here
+        api_key, error = credentials.resolve(req.data.get('connection'))
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Check field types and limits against the schema
+        data, error = VALIDATOR.validate(req.data)
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Extract the list of leads
+        leads = data['leads']
+
+        if not leads:
+            return Response.error(
+                error="A non-empty list of leads is required"
+            )
+
+        if len(leads) > MAX_LEADS:
+            return Response.error(
+                error=f"At most {MAX_LEADS} leads can be enriched in one call. Use Enrich Leads (Batch) or (Stream) for longer lists"
+            )
+
+        chunk_size = data['chunk_size']
+
+        # End-to-end time budget: the caller's max_wait_seconds, capped below the server timeout
+        budget = deadline.budget(data['max_wait_seconds'], DEFAULT_MAX_WAIT)
+        deadline.start(budget, started_at)
+
+        # Extract enrichment options
+        enrich_email = data['enrich_email_address']
+        enrich_phone = data['enrich_phone_number']
+        # Enriched lead fields to return (all when not set)
+        fields = projection.parse_fields(data.get('fields'))
+        # Local-first predictions, when the call only asks for emails
+        predictor = None
+        if data['local_first'] and email_patterns.can_predict(enrich_email, enrich_phone):
+            predictor = email_patterns.Predictor(api_key)
+
+        # One result per input lead, filled in as submissions and polls finish
+        results = [{"index": index} for index in range(len(leads))]
+        # Leads waiting to be submitted, and the input index of each by uuid
+        valid_leads = []
+        seen_uuids = set()
+        submitted_indexes = {}
+        fingerprints = {}
+        # Requests being waited on: request ID -> submission time and result uuid -> input indexes
+        pending = {}
+        deduplicated = 0
+        predicted = 0
+
+        # Every lead is checked and normalized in one pass, then by the Clay rules
+        for index, (lead, error) in enumerate(validate_leads(leads, LEAD_VALIDATOR)):
+            if error:
+                results[index].update({"status": "invalid", "error": error})
+                continue
+
+            lead_data = build_lead_data(lead, "StackSync Sync Lead")
+            lead_uuid = lead_data['custom_fields']['uuid']
+            results[index]['uuid'] = lead_uuid
+            if lead_uuid in seen_uuids:
+                results[index].update({
+                    "status": "invalid",
+                    "error": f"Duplicate custom_fields.uuid '{lead_uuid}'"
+                })
+                continue
+
+            seen_uuids.add(lead_uuid)
+
+            # Reuse an earlier submission of the same lead instead of enriching (and paying) twice
+            fingerprint = dedup_store.lead_fingerprint(api_key, lead_data, enrich_email, enrich_phone)
+            existing = dedup_store.lookup(fingerprint)
+            if existing and existing['lead_uuid']:
+                deduplicated += 1
+                results[index]['request_id'] = existing['request_id']
+                reused = {"rows": {existing['lead_uuid']: [index]}}
+                if existing['result'] is not None:
+                    merge_outcome(results, reused, {"status": "completed", "data": existing['result']})
+                else:
+                    entry = pending.setdefault(existing['request_id'], {
+                        "submitted_at": existing['submitted_at'],
+                        "rows": {},
+                        "reused": True
+                    })
+                    entry['rows'].setdefault(existing['lead_uuid'], []).append(index)
+                continue
+
+            # Answer leads at domains whose email pattern is well known without submitting them
+            prediction = predictor.predict(lead_data) if predictor else None
+            if prediction:
+                predicted += 1
+                results[index].update({"status": "predicted", "lead": prediction})
+                continue
+
+            submitted_indexes[lead_uuid] = index
+            fingerprints[lead_uuid] = fingerprint
+            valid_leads.append(lead_data)
+
+        metrics.lap("validate")
+
+        if not valid_leads and not deduplicated and not predicted:
+            return Response.error(
+                error="None of the provided leads passed validation",
+                data={
+                    "invalid_leads": [
+                        {"index": result['index'], "error": result['error']} for result in results
+                    ]
+                }
+            )
+
+        submissions = []
+        if valid_leads:
+            # Split into API-sized chunks and submit them concurrently.
+            # Submissions run in copies of this request's context so they share its
+            # deadline and their rate-limit waits are counted.
+            chunks = [
+                valid_leads[start:start + chunk_size]
+                for start in range(0, len(valid_leads), chunk_size)
+            ]
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_SUBMISSIONS, len(chunks))) as executor:
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        submit_chunk, api_key, chunk, enrich_email, enrich_phone
+                    )
+                    for chunk in chunks
+                ]
+                submissions = [future.result() for future in futures]
+
+            # An invalid API key fails every chunk the same way
+            if all(result.get('status_code') == 401 for result in submissions):
+                return Response.error(
+                    error="Invalid API key or unauthorized access"
+                )
+
+        submitted_at = time.time()
+        for submission in submissions:
+            if 'request_id' not in submission:
+                for lead_uuid in submission['uuids']:
+                    results[submitted_indexes[lead_uuid]].update({
+                        "status": "failed",
+                        "error": submission['error']
+                    })
+                continue
+
+            request_id = submission['request_id']
+            for lead_uuid in submission['uuids']:
+                results[submitted_indexes[lead_uuid]]['request_id'] = request_id
+                dedup_store.record_submission(
+                    api_key, fingerprints[lead_uuid], request_id, lead_uuid, len(submission['uuids'])
+                )
+            pending[request_id] = {
+                "submitted_at": submitted_at,
+                "rows": {lead_uuid: [submitted_indexes[lead_uuid]] for lead_uuid in submission['uuids']},
+                "lead_count": len(submission['uuids'])
+            }
+
+        # Wait on every request at once, for what is left of the budget.
+        # Polls are timed to how long a submission of this size usually takes.
+        for request_id, entry in pending.items():
+            entry['future'] = poller.get_poller().register(
+                api_key,
+                request_id,
+                max_wait=deadline.remaining(),
+                enrichment_type=None if entry.get('reused') else poll_schedule.enrichment_type(
+                    enrich_email, enrich_phone, entry['lead_count']
+                ),
+                submitted_at=entry['submitted_at']
+            )
+
+        if pending:
+            # Polls are bounded by the same deadline, so the outcomes are normally in by then
+            wait([entry['future'] for entry in pending.values()], timeout=deadline.remaining())
+
+        timed_out = 0
+        for request_id, entry in pending.items():
+            if entry['future'].done():
+                outcome = entry['future'].result()
+                # Polls ran on the poller's threads; count their rate-limit waits and stage timings here too
+                rate_limiter.merge(rate_limit, outcome.get('rate_limit'))
+                metrics.merge(outcome.get('timings'))
+            else:
+                outcome = {"status": "timeout"}
+
+            if outcome['status'] != 'timeout':
+                merge_outcome(results, entry, outcome)
+                continue
+
+            # Budget used up: report what is known; the request ID still fetches the results later
+            progress = poller.get_poller().progress(api_key, request_id) or outcome
+            for indexes in entry['rows'].values():
+                for index in indexes:
+                    timed_out += 1
+                    results[index].update({
+                        "status": "timeout",
+                        "last_status": progress.get('last_status', "submitted")
+                    })
+
+        counts = {"completed": 0, "predicted": 0, "invalid": 0, "failed": 0, "timeout": 0}
+        for result in results:
+            counts[result['status']] += 1
+            if 'lead' in result:
+                result['lead'] = projection.project_lead(result['lead'], fields)
+
+        if counts['completed'] + counts['predicted'] + counts['invalid'] == len(leads):
+            status = "completed"
+        elif counts['completed'] or counts['predicted']:
+            status = "partially_completed"
+        elif timed_out:
+            status = "timeout"
+        else:
+            status = "failed"
+        metrics.set_outcome(status)
+
+        return Response(
+            data={
+                "results": results,
+                "status": status
+            },
+            metadata={
+                "total_leads": len(leads),
+                "completed_leads": counts['completed'],
+                "invalid_leads": counts['invalid'],
+                "failed_leads": counts['failed'],
+                "timed_out_leads": counts['timeout'],
+                "deduplicated_leads": deduplicated,
+                "predicted_leads": counts['predicted'],
+                "submission_count": sum(1 for submission in submissions if 'request_id' in submission),
+                "processing_time_seconds": round(time.time() - started_at, 2),
+                "max_wait_seconds": budget,
+                "rate_limit": rate_limiter.report(rate_limit)
+            }
+        )
+
+    except Exception as e:
+        return Response.error(
+            error=f"Unexpected error in synchronous enrichment: {str(e)}"
+        )
@@ -0,0 +1,103 @@
+from main import router
+from workflows_cdk import Request, Response
+from flask import request as flask_request
+from src.core import completions, credentials, metrics, projection, validation
+
+# Input checks compiled from this module's schema.json
+VALIDATOR = validation.load(__file__)
+
+@router.route("/execute", methods=["POST"])
+def execute():
+    """
+    Pick up enrichment results queued for this API key by the callback completion mode.
+    Each result is returned once.
+    """
+    try:
+        # Parse the incoming request
+        req = Request(flask_request)
+        metrics.lap("parse")
+
+        # Resolve the API key from the connection; keys the API rejected recently are refused here
+        api_key, error = credentials.resolve(req.data.get('connection'))
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        # Check field types and the result limit against the schema
+        data, error = VALIDATOR.validate(req.data)
+        if error:
+            return Response.error(
+                error=error
+            )
+
+        request_ids = data.get('request_ids') or None
+        limit = data['limit']
+        # Enriched lead fields to return (all when not set)
+        fields = projection.parse_fields(data.get('fields'))
+        metrics.lap("validate")
+
+        results = completions.pickup(api_key, request_ids=request_ids, limit=limit)
+        for result in results:
+            result['data'] = projection.project(result.get('data'), fields)
+
+        return Response(
+            data={
+                "results": results
+            },
+            metadata={
+                "count": len(results),
+                "completion_source": "webhook" if completions.webhook_url() else "local_poller"
+            }
+        )
+
+    except Exception as e:
+        return Response.error(
+            error=f"Unexpected error: {str(e)}"
+        )
+
+
+@router.route("/webhook", methods=["POST"])
+def webhook():
+    """
+    Receive a completion push from BetterContact and deliver it to the
+    subscribed callback URLs and pickup queue.
+    """
+    try:
+        # Without a secret anyone could push results into the dedup store, exports and pickup queue
+        if not completions.WEBHOOK_SECRET:
+            return Response.error(
+                error="Webhook is disabled: BETTERCONTACT_WEBHOOK_SECRET is not set"
+            )
+        # The push is signed with an HMAC of its raw body, so the secret never appears in a URL or log
+        body = flask_request.get_data(cache=True)
+        signature = flask_request.headers.get(completions.WEBHOOK_SIGNATURE_HEADER, '')
+        if not completions.webhook_signature_valid(body, signature):
+            return Response.error(
+                error="Invalid webhook signature"
+            )
+
+        payload = flask_request.get_json(silent=True)
+        metrics.lap("parse")
+        if not isinstance(payload, dict):
+            return Response.error(
+                error="Webhook payload must be a JSON object"
+            )
+
+        request_id = completions.receive_webhook(payload)
+        if not request_id:
+            return Response.error(
+                error="Webhook payload does not contain a request ID"
+            )
+
+        return Response(
+            data={
+                "request_id": request_id,
+                "received": True
+            }
+        )
+
+    except Exception as e:
+        return Response.error(
+            error=f"Unexpected error: {str(e)}"
+        )
@@ -1,86 +1,309 @@
 from main import router
 from workflows_cdk import Request, Response
-from flask import request as flask_request
+from flask import Response as FlaskResponse, request as flask_request, stream_with_context
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from src.core import (
+    circuit_breaker, credentials, deadline, email_patterns, encoding, export_sink, job_store, metrics, projection,
+    rate_limiter, validation
+)
+from src.core.result_cache import get_result_cache
+from src.core.version_resolver import get_version_resolver
+import contextvars
+import os
 import requests
+import time
+
+# Most request IDs one bulk call may check; longer lists should be streamed
+MAX_REQUEST_IDS = int(os.environ.get("BETTERCONTACT_BULK_MAX_IDS", 1000))
+
+# Request IDs of a bulk call fetched from BetterContact at the same time
+BULK_CONCURRENCY = int(os.environ.get("BETTERCONTACT_BULK_CONCURRENCY", 8))
+
+# Input checks compiled from this module's schema.json
+VALIDATOR = validation.load(__file__)
+
+
+def fetch_status(api_key, request_id, cache, resolver):
+    """
+    The status of one request ID in a bulk call, fetched from BetterContact:
+    completed (with its data), processing, not_found or error.
+    """
+    try:
+        response, _, _ = resolver.fetch(api_key, request_id)
+    except circuit_breaker.CircuitOpenError as e:
+        return {"status": "error", "error": str(e), "retry_after_seconds": e.retry_after}
+    except requests.exceptions.Timeout:
+        return {"status": "error", "error": "Timeout while checking enrichment results"}
+    except requests.exceptions.ConnectionError:
+        return {"status": "error", "error": "Network error while checking results"}
+    except requests.exceptions.RequestException as e:
+        return {"status": "error", "error": f"Error checking results: {str(e)}"}
+
+    if response.status_code == 200:
+        try:
+            enrichment_data = response.json()
+        except ValueError:
+            return {"status": "error", "error": "Invalid response format from enrichment results"}
+        cache.put_completed(api_key, request_id, enrichment_data)
+        export_sink.export(api_key, request_id, enrichment_data)
+        email_patterns.learn(api_key, enrichment_data)
+        job_store.finish(request_id, "completed")
+        return {"status": "completed", "data": enrichment_data}
+    elif response.status_code == 202:
+        return {"status": "processing"}
+    elif response.status_code == 404:
+        cache.put_not_found(api_key, request_id)
+        job_store.finish(request_id, "not_found")
+        return {"status": "not_found"}
+    elif response.status_code == 401:
+        return {"status": "error", "error": "Invalid API key or unauthorized access"}
+    return {"status": "error", "error": f"API request failed with status {response.status_code}"}
+
+
+def iter_statuses(api_key, request_ids, counts):
+    """
+    Yield (request_id, result) for every request ID, in the order they are
+    known. IDs the result cache holds are answered first without an API call;
+    the others are fetched BULK_CONCURRENCY at a time. Runs in the caller's
+    context, so fetches share its deadline and rate-limit tracker.
+    """
+    cache = get_result_cache()
+    resolver = get_version_resolver()
+
+    to_fetch = []
+    for request_id in request_ids:
+        cached, _ = cache.get(api_key, request_id)
+        if cached is None:
+            to_fetch.append(request_id)
+            continue
+        counts['cached'] += 1
+        if cached['status'] == 'completed':
+            yield request_id, {"status": "completed", "data": cached['data']}
+        else:
+            yield request_id, {"status": "not_found"}
+
+    if not to_fetch:
+        return
+
+    # Only a window of fetches is queued at a time, so a client that stops reading a stream stops the fetching
+    remaining = iter(to_fetch)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=min(BULK_CONCURRENCY, len(to_fetch))) as executor:
+        while True:
+            for request_id in remaining:
+                future = executor.submit(
+                    contextvars.copy_context().run, fetch_status, api_key, request_id, cache, resolver
+                )
+                pending[future] = request_id
+                if len(pending) >= 2 * BULK_CONCURRENCY:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                counts['fetched'] += 1
+                yield pending.pop(future), future.result()
+
+
+def bulk_summary(counts, total, started_at, rate_limit):
+    """
+    Metadata of a bulk call (the summary line when streamed).
+    """
+    return {
+        "total_request_ids": total,
+        "completed": counts['completed'],
+        "processing": counts['processing'],
+        "not_found": counts['not_found'],
+        "errors": counts['error'],
+        "from_cache": counts['cached'],
+        "fetched": counts['fetched'],
+        "processing_time_seconds": round(time.time() - started_at, 2),
+        "rate_limit": rate_limiter.report(rate_limit)
+    }
+
+
+def bulk_fetch(api_key, request_ids, stream, fields, started_at, rate_limit):
+    """
+    Check many request IDs in one call. Returns one response with a status per
+    ID, or with `stream` an NDJSON line per ID as it is checked and a summary.
+    Completed results are trimmed to `fields`.
+    """
+    counts = {"completed": 0, "processing": 0, "not_found": 0, "error": 0, "cached": 0, "fetched": 0}
+
+    if stream:
+        def generate():
+            rate_limit = rate_limiter.track_queue_wait()
+            for request_id, result in iter_statuses(api_key, request_ids, counts):
+                counts[result['status']] += 1
+                if 'data' in result:
+                    result = dict(result, data=projection.project(result['data'], fields))
+                yield encoding.dumps(dict(result, request_id=request_id)) + "\n"
+            metrics.set_outcome("completed" if counts['completed'] == len(request_ids) else "partially_completed")
+            summary = bulk_summary(counts, len(request_ids), started_at, rate_limit)
+            yield encoding.dumps({"summary": summary}) + "\n"
+
+        return FlaskResponse(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    if len(request_ids) > MAX_REQUEST_IDS:
+        return Response.error(
+            error=f"At most {MAX_REQUEST_IDS} request IDs can be checked in one call. Set stream to check longer lists"
+        )
+
+    # The whole call answers before the server timeout; IDs not checked by then are reported as errors
+    deadline.start(deadline.MAX_BUDGET, started_at)
+
+    statuses = {}
+    for request_id, result in iter_statuses(api_key, request_ids, counts):
+        counts[result['status']] += 1
+        if 'data' in result:
+            result = dict(result, data=projection.project(result['data'], fields))
+        statuses[request_id] = result
+
+    metrics.set_outcome("completed" if counts['completed'] == len(request_ids) else "partially_completed")
+
+    return Response(
+        data={
+            # In input order
+            "results": {request_id: statuses[request_id] for request_id in request_ids}
+        },
+        metadata=bulk_summary(counts, len(request_ids), started_at, rate_limit)
+    )
 
 @router.route("/execute", methods=["POST"])
 def execute():
     try:
+        started_at = time.time()
+
+        # Count time spent waiting on the BetterContact rate limit
+        rate_limit = rate_limiter.track_queue_wait()
+        
         # Parse the incoming request
         req = Request(flask_request)
+        metrics.lap("parse")
         
-        # Extract API key from connection
-        connection = req.data.get('connection', {})
-        
-        # For testing, use hardcoded API key if connection is empty
-        # This will be replaced with proper connection handling in production
-        if not connection or connection == {}:
-            api_key = "2d7316008303a1c3400d"  # Test API key
-        else:
-            # Try different possible structures
-            if isinstance(connection, dict):
-                # Check if api_key is directly in connection
-                if 'api_key_bearer' in connection:
-                    api_key = connection['api_key_bearer']
-                # Check if it's in connection_data.value
-                elif 'connection_data' in connection:
-                    connection_data = connection.get('connection_data', {})
-                    if 'value' in connection_data:
-                        api_key = connection_data['value'].get('api_key_bearer')
-                    else:
-                        api_key = connection_data.get('api_key_bearer')
-                # Check if it's in value directly
-                elif 'value' in connection:
-                    api_key = connection['value'].get('api_key_bearer')
-                else:
-                    api_key = None
-            else:
-                api_key = None
+        # Resolve the API key from the connection; keys the API rejected recently are refused here
+        api_key, error = credentials.resolve(req.data.get('connection'))
+        if error:
+            return Response.error(
+                error=error
+            )
         
-        if not api_key:
+        # Check field types against the schema
+        data, error = VALIDATOR.validate(req.data)
+        if error:
             return Response.error(
-                error="API key not found in connection"
+                error=error
             )
         
-        # Extract request ID
-        request_id = req.data.get('request_id', '')
+        # Enriched lead fields to return (all when not set)
+        fields = projection.parse_fields(data.get('fields'))
+        
+        if data.get('request_ids') is not None:
+            if data.get('request_id'):
+                return Response.error(
+                    error="Give either request_id or request_ids, not both"
+                )
+            # Each ID once, in input order
+            request_ids = list(dict.fromkeys(
+                request_id.strip() for request_id in data['request_ids'] if request_id and request_id.strip()
+            ))
+            if not request_ids:
+                return Response.error(
+                    error="A non-empty list of request IDs is required"
+                )
+            metrics.lap("validate")
+            return bulk_fetch(api_key, request_ids, data['stream'], fields, started_at, rate_limit)
         
+        # Extract request ID
+        request_id = data.get('request_id')
         if not request_id:
             return Response.error(
                 error="Request ID is required"
             )
+        metrics.lap("validate")
+        
+        # Completed results never change, so serve them from the cache when possible
+        cache = get_result_cache()
+        cached, cache_tier = cache.get(api_key, request_id)
+        
+        if cached is not None:
+            cache_metadata = dict(cache.stats(), hit=True, tier=cache_tier)
+            if cached['status'] == 'completed':
+                metrics.set_outcome("cached")
+                return Response(
+                    data=projection.project(cached['data'], fields),
+                    metadata={
+                        "status": "completed",
+                        "cache": cache_metadata
+                    }
+                )
+            return Response.error(
+                error=f"Request ID '{request_id}' not found"
+            )
         
-        # Fetch results from BetterContact API
-        # Try with v2 first
-        url = f"https://app.bettercontact.rocks/api/v2/async/{request_id}?api_key={api_key}"
+        cache_metadata = dict(cache.stats(), hit=False, tier=None)
         
-        response = requests.get(url)
+        # Fetch results from BetterContact API, going straight to the endpoint
+        # (v2 or unversioned) known to serve this ID or API key
+        resolver = get_version_resolver()
+        try:
+            response, api_version, resolution = resolver.fetch(api_key, request_id)
+        except circuit_breaker.CircuitOpenError as e:
+            metrics.set_outcome("circuit_open")
+            return Response.error(
+                error=f"{str(e)}. Request ID: {request_id}",
+                data={"retry_after_seconds": e.retry_after}
+            )
+        except requests.exceptions.Timeout:
+            return Response.error(
+                error=f"Timeout while checking enrichment results. Request ID: {request_id}"
+            )
+        except requests.exceptions.ConnectionError:
+            return Response.error(
+                error=f"Network error while checking results. Request ID: {request_id}"
+            )
+        except requests.exceptions.RequestException as e:
+            return Response.error(
+                error=f"Error checking results: {str(e)}. Request ID: {request_id}"
+            )
         
-        # If v2 returns 404, try without version
-        if response.status_code == 404:
-            url = f"https://app.bettercontact.rocks/api/async/{request_id}?api_key={api_key}"
-            response = requests.get(url)
+        version_metadata = dict(resolver.stats(), resolved=api_version, strategy=resolution)
         
         if response.status_code == 200:
             # Results are ready
+            enrichment_data = response.json()
+            cache.put_completed(api_key, request_id, enrichment_data)
+            export_sink.export(api_key, request_id, enrichment_data)
+            email_patterns.learn(api_key, enrichment_data)
+            job_store.finish(request_id, "completed")
+            metrics.set_outcome("completed")
             return Response(
-                data=response.json(),
+                data=projection.project(enrichment_data, fields),
                 metadata={
-                    "status": "completed"
+                    "status": "completed",
+                    "cache": cache_metadata,
+                    "api_version": version_metadata,
+                    "rate_limit": rate_limiter.report(rate_limit)
                 }
             )
         elif response.status_code == 202:
             # Still processing
+            metrics.set_outcome("processing")
             return Response(
                 data={
                     "status": "processing",
                     "message": "Enrichment is still in progress"
                 },
                 metadata={
-                    "status": "processing"
+                    "status": "processing",
+                    "cache": cache_metadata,
+                    "api_version": version_metadata,
+                    "rate_limit": rate_limiter.report(rate_limit)
                 }
             )
         elif response.status_code == 404:
+            cache.put_not_found(api_key, request_id)
+            job_store.finish(request_id, "not_found")
             return Response.error(
                 error=f"Request ID '{request_id}' not found"
             )
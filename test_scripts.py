@@ -5,137 +5,139 @@ import time
 BASE_URL = "http://localhost:2003"
 API_KEY = "2d7316008303a1c3400d"
 
-def test_check_credits_balance():
-    print("\n=== Testing Check Credits Balance Module ===")
-    
-    # Test 1: Valid API key
-    print("\nTest 1: Valid API key")
-    payload = {
-        "connection": {
-            "connection_data": {
-                "value": {
-                    "api_key_bearer": API_KEY
-                }
-            }
+CONNECTION = {
+    "connection_data": {
+        "value": {
+            "api_key_bearer": API_KEY
         }
     }
-    response = requests.post(f"{BASE_URL}/modules/check_credits_balance/v1/execute", json=payload)
+}
+
+def post(module, data):
+    response = requests.post(f"{BASE_URL}/{module}/v1/execute", json={"data": data})
     print(f"Status: {response.status_code}")
     print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
+    return response.json()
+
+def test_enrich_lead_sync():
+    print("\n=== Testing Enrich Lead (Sync) Module ===")
+
+    # Test 1: Valid lead
+    print("\nTest 1: Valid lead")
+    post("enrich_lead_sync", {
+        "connection": CONNECTION,
+        "first_name": "John",
+        "last_name": "Doe",
+        "company_domain": "example.com"
+    })
+
     # Test 2: Invalid API key
     print("\nTest 2: Invalid API key")
-    payload["connection"]["connection_data"]["value"]["api_key_bearer"] = "invalid_key_123"
-    response = requests.post(f"{BASE_URL}/modules/check_credits_balance/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
-    # Test 3: Missing connection
-    print("\nTest 3: Missing connection")
-    response = requests.post(f"{BASE_URL}/modules/check_credits_balance/v1/execute", json={})
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    post("enrich_lead_sync", {
+        "connection": {"api_key_bearer": "invalid_key_123"},
+        "first_name": "John",
+        "last_name": "Doe",
+        "company_domain": "example.com"
+    })
+
+def test_enrich_leads_sync():
+    print("\n=== Testing Enrich Leads (Sync) Module ===")
+
+    # Test 1: Several leads in one call; results come back in input order
+    print("\nTest 1: Three leads, one invalid")
+    post("enrich_leads_sync", {
+        "connection": CONNECTION,
+        "leads": [
+            {"first_name": "Jane", "last_name": "Smith", "company": "Tech Co", "custom_fields": {"uuid": "lead-1"}},
+            {"first_name": "Bob", "company_domain": "startup.io"},
+            {"linkedin_url": "https://linkedin.com/in/example", "company_domain": "example.com"}
+        ],
+        "max_wait_seconds": 60
+    })
 
 def test_enrich_leads():
     print("\n=== Testing Enrich Leads Module ===")
-    
+
     # Test 1: Valid request with single lead
     print("\nTest 1: Valid request with single lead")
     payload = {
-        "connection": {
-            "connection_data": {
-                "value": {
-                    "api_key_bearer": API_KEY
-                }
-            }
-        },
-        "leads": [
-            {
-                "first_name": "John",
-                "last_name": "Doe",
-                "company": "Example Corp",
-                "company_domain": "example.com"
-            }
-        ],
+        "connection": CONNECTION,
+        "first_name": "John",
+        "last_name": "Doe",
+        "company": "Example Corp",
+        "company_domain": "example.com",
         "enrich_email_address": True,
         "enrich_phone_number": True
     }
-    response = requests.post(f"{BASE_URL}/modules/enrich_leads/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    result = response.json()
-    print(f"Response: {json.dumps(result, indent=2)}")
-    
+    result = post("enrich_leads", payload)
+
     # Save request_id for later test
-    request_id = result.get("data", {}).get("request_id", "")
-    
-    # Test 2: Multiple leads
-    print("\nTest 2: Multiple leads (3)")
-    payload["leads"] = [
-        {"first_name": "Jane", "last_name": "Smith", "company": "Tech Co"},
-        {"first_name": "Bob", "company_domain": "startup.io"},
-        {"linkedin_url": "https://linkedin.com/in/example"}
-    ]
-    response = requests.post(f"{BASE_URL}/modules/enrich_leads/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
-    # Test 3: Empty leads array
-    print("\nTest 3: Empty leads array")
-    payload["leads"] = []
-    response = requests.post(f"{BASE_URL}/modules/enrich_leads/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
-    # Test 4: Too many leads (> 100)
-    print("\nTest 4: Too many leads (101)")
-    payload["leads"] = [{"first_name": f"User{i}"} for i in range(101)]
-    response = requests.post(f"{BASE_URL}/modules/enrich_leads/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
+    request_id = (result.get("data") or {}).get("request_id", "")
+
+    # Test 2: Multiple leads go through the batch module
+    print("\nTest 2: Multiple leads (3) through Enrich Leads (Batch)")
+    post("enrich_leads_batch", {
+        "connection": CONNECTION,
+        "leads": [
+            {"first_name": "Jane", "last_name": "Smith", "company": "Tech Co"},
+            {"first_name": "Bob", "company_domain": "startup.io"},
+            {"linkedin_url": "https://linkedin.com/in/example", "company_domain": "example.com"}
+        ]
+    })
+
+    # Test 3: Missing names without LinkedIn URL
+    print("\nTest 3: Missing names without LinkedIn URL")
+    post("enrich_leads", {"connection": CONNECTION, "company": "Example Corp"})
+
+    # Test 4: Missing company without company domain
+    print("\nTest 4: Missing company without company domain")
+    post("enrich_leads", {"connection": CONNECTION, "first_name": "John", "last_name": "Doe"})
+
     return request_id
 
 def test_get_enrichment_results(request_id):
     print("\n=== Testing Get Enrichment Results Module ===")
-    
+
     # Test 1: Valid request ID
     print(f"\nTest 1: Valid request ID: {request_id}")
     payload = {
-        "connection": {
-            "connection_data": {
-                "value": {
-                    "api_key_bearer": API_KEY
-                }
-            }
-        },
+        "connection": CONNECTION,
         "request_id": request_id
     }
-    response = requests.post(f"{BASE_URL}/modules/get_enrichment_results/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
+    post("get_enrichment_results", payload)
+
     # Test 2: Invalid request ID
     print("\nTest 2: Invalid request ID")
     payload["request_id"] = "invalid-request-id-12345"
-    response = requests.post(f"{BASE_URL}/modules/get_enrichment_results/v1/execute", json=payload)
-    print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
-    
+    post("get_enrichment_results", payload)
+
     # Test 3: Missing request ID
     print("\nTest 3: Missing request ID")
     del payload["request_id"]
-    response = requests.post(f"{BASE_URL}/modules/get_enrichment_results/v1/execute", json=payload)
+    post("get_enrichment_results", payload)
+
+    # Test 4: Several request IDs at once
+    print("\nTest 4: Bulk fetch of several request IDs")
+    payload["request_ids"] = [request_id, "invalid-request-id-12345"]
+    post("get_enrichment_results", payload)
+
+    # Test 5: The same, streamed as NDJSON
+    print("\nTest 5: Streamed bulk fetch")
+    payload["stream"] = True
+    response = requests.post(f"{BASE_URL}/get_enrichment_results/v1/execute", json={"data": payload}, stream=True)
     print(f"Status: {response.status_code}")
-    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    for line in response.iter_lines():
+        print(line.decode())
 
 def test_module_schemas():
     print("\n=== Testing Module Schemas ===")
-    
-    modules = ["check_credits_balance", "enrich_leads", "get_enrichment_results"]
-    
+
+    modules = ["enrich_leads", "get_enrichment_results", "enrich_lead_sync", "enrich_leads_batch",
+               "enrich_leads_sync"]
+
     for module in modules:
         print(f"\nTesting schema for {module}")
-        response = requests.get(f"{BASE_URL}/modules/{module}/v1/schema")
+        response = requests.get(f"{BASE_URL}/{module}/v1/schema")
         print(f"Status: {response.status_code}")
         if response.status_code == 200:
             print("Schema loaded successfully")
@@ -144,20 +146,23 @@ def test_module_schemas():
 
 if __name__ == "__main__":
     print("Starting comprehensive testing of BetterContact connector...")
-    
+
     # Test module schemas
     test_module_schemas()
-    
-    # Test Check Credits Balance
-    test_check_credits_balance()
-    
+
     # Test Enrich Leads and get request ID
     request_id = test_enrich_leads()
-    
+
     # Wait a bit for async processing
     if request_id:
         print("\nWaiting 2 seconds before testing results...")
         time.sleep(2)
         test_get_enrichment_results(request_id)
-    
-    print("\n=== Testing Complete ===")
\ No newline at end of file
+
+    # Test Enrich Lead (Sync)
+    test_enrich_lead_sync()
+
+    # Test Enrich Leads (Sync)
+    test_enrich_leads_sync()
+
+    print("\n=== Testing Complete ===")
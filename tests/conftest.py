@@ -0,0 +1,61 @@
+"""
+Shared fixtures: every test session gets its own state database and a local
+mock of the BetterContact API (benchmarks/mock_bettercontact.py).
+
+The connector reads its settings when its modules are imported, so the
+environment is set here, before any of them is.
+"""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+from benchmarks.mock_bettercontact import start_mock_server
+
+_state_dir = tempfile.mkdtemp(prefix="bettercontact-tests-")
+_server, _mock_state = start_mock_server(enrichment_seconds=0.2)
+
+os.environ["BETTERCONTACT_STATE_DB"] = os.path.join(_state_dir, "state.db")
+os.environ["BETTERCONTACT_BASE_URL"] = f"http://127.0.0.1:{_server.server_address[1]}"
+
+
+@pytest.fixture
+def mock_api():
+    """
+    The mock's state, reset, with a short enrichment time and no injected faults.
+    """
+    _mock_state.reset()
+    _mock_state.enrichment_seconds = 0.2
+    _mock_state.latency_seconds = 0.0
+    _mock_state.not_found_rate = 0.0
+    _mock_state.not_ready_rate = 0.0
+    _mock_state.throttle_rate = 0.0
+    _mock_state.error_rate = 0.0
+    _mock_state.slow_rate = 0.0
+    return _mock_state
+
+
+@pytest.fixture
+def api_key():
+    """
+    A fresh API key, so results, dedup entries and rate limits of other tests are not shared.
+    """
+    return f"test-{uuid.uuid4().hex[:12]}"
+
+
+@pytest.fixture
+def client(mock_api):
+    """
+    A Flask test client of the connector with every module loaded.
+    """
+    pytest.importorskip("workflows_cdk")
+    import main
+    return main.app.test_client()
+
+
+def connection(api_key):
+    """
+    A module's connection input for `api_key`.
+    """
+    return {"connection_data": {"value": {"api_key_bearer": api_key}}}
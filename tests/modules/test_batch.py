@@ -0,0 +1,49 @@
+from tests.conftest import connection
+
+
+def batch(client, api_key, leads, **options):
+    response = client.post("/enrich_leads_batch/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "leads": leads,
+        **options
+    }})
+    return response.get_json()
+
+
+def lead(first_name, uuid):
+    return {"first_name": first_name, "last_name": "Lee", "company_domain": "example.com", "custom_fields": {"uuid": uuid}}
+
+
+def test_identical_leads_in_one_batch_are_submitted_once(client, mock_api, api_key):
+    body = batch(client, api_key, [lead("Ann", "crm-1"), lead("Bob", "crm-2"), lead(" ann ", "crm-3")], chunk_size=1)
+
+    assert mock_api.stats['submits'] == 2
+    assert body['data']['request_ids']['crm-3'] == body['data']['request_ids']['crm-1']
+    assert body['metadata']['deduplicated_leads'] == 1
+
+
+def test_chunks_not_sent_within_the_budget_are_returned(client, mock_api, api_key, monkeypatch):
+    route_globals = client.application.view_functions["/enrich_leads_batch/v1/execute"].__globals__
+    monkeypatch.setitem(route_globals, "MAX_CONCURRENT_SUBMISSIONS", 1)
+    monkeypatch.setattr(mock_api, "latency_seconds", 1.0)
+
+    body = batch(
+        client, api_key, [lead("Ann", "crm-1"), lead("Bob", "crm-2"), lead("Cid", "crm-3")],
+        chunk_size=1, max_wait_seconds=3
+    )
+
+    assert body['data']['status'] == "partially_submitted"
+    assert body['data']['unsubmitted_chunks'] == [{"uuids": ["crm-3"]}]
+    assert sorted(body['data']['request_ids']) == ["crm-1", "crm-2"]
+    assert mock_api.stats['submits'] == 2
+
+
+def test_budget_spent_before_any_submission_is_an_error(client, mock_api, api_key, monkeypatch):
+    route_globals = client.application.view_functions["/enrich_leads_batch/v1/execute"].__globals__
+    monkeypatch.setitem(route_globals, "MIN_SUBMIT_SECONDS", 10)
+
+    body = batch(client, api_key, [lead("Ann", "crm-1")], max_wait_seconds=5)
+
+    assert "time budget ran out" in body['error']
+    assert body['data']['unsubmitted_chunks'] == [{"uuids": ["crm-1"]}]
+    assert mock_api.stats['submits'] == 0
@@ -0,0 +1,42 @@
+import hashlib
+import hmac
+import json
+
+from src.core import completions
+from tests.conftest import connection
+
+
+def push(client, secret=None):
+    body = json.dumps({"id": "forged-request", "status": "terminated", "data": []}).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-BetterContact-Signature"] = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return client.post("/enrichment_callbacks/v1/webhook", data=body, headers=headers)
+
+
+def test_webhook_refuses_pushes_without_a_configured_secret(client, monkeypatch):
+    monkeypatch.setattr(completions, "WEBHOOK_SECRET", "")
+
+    assert push(client).get_json()['error'].startswith("Webhook is disabled")
+    assert push(client, secret="").get_json()['error'].startswith("Webhook is disabled")
+
+
+def test_webhook_checks_the_secret(client, monkeypatch):
+    monkeypatch.setattr(completions, "WEBHOOK_SECRET", "s3cret")
+
+    assert push(client).get_json()['error'] == "Invalid webhook signature"
+    assert push(client, secret="guess").get_json()['error'] == "Invalid webhook signature"
+    assert push(client, secret="s3cret").get_json()['data'] == {"request_id": "forged-request", "received": True}
+
+
+def test_callback_url_to_link_local_address_is_refused(client, mock_api, api_key):
+    body = client.post("/enrich_leads/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "first_name": "Ann",
+        "last_name": "Lee",
+        "company_domain": "example.com",
+        "callback_url": "http://169.254.169.254/latest/meta-data/"
+    }}).get_json()
+
+    assert "private, loopback or link-local" in body['error']
+    assert mock_api.stats['submits'] == 0
@@ -0,0 +1,31 @@
+import time
+
+from tests.conftest import connection
+
+
+def test_expired_budget_does_not_leak_into_the_next_request_on_the_thread(client, mock_api, api_key):
+    mock_api.enrichment_seconds = 30
+    timed_out = client.post("/enrich_lead_sync/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "first_name": "Ann",
+        "last_name": "Lee",
+        "company_domain": "example.com",
+        "max_wait_seconds": 1
+    }}).get_json()
+    assert timed_out['data']['status'] == "timeout"
+    time.sleep(1.5)
+
+    submitted = client.post("/enrich_leads/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "first_name": "Bob",
+        "last_name": "Lee",
+        "company_domain": "example.com"
+    }})
+    checked = client.post("/get_enrichment_results/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "request_id": submitted.get_json()['data']['request_id']
+    }})
+
+    assert submitted.status_code == 200
+    assert checked.status_code == 200
+    assert checked.get_json()['metadata']['status'] == "processing"
@@ -0,0 +1,57 @@
+from tests.conftest import connection
+
+
+def enrich_together(client, api_key, *names):
+    response = client.post("/enrich_leads_sync/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "leads": [{"first_name": name, "last_name": "Lee", "company_domain": "example.com"} for name in names],
+        "max_wait_seconds": 10
+    }})
+    body = response.get_json()
+    assert body['data']['status'] == "completed"
+    return body['data']['results'][0]['request_id']
+
+
+def test_single_lead_sync_returns_only_its_own_lead_of_a_shared_request(client, mock_api, api_key):
+    shared_request_id = enrich_together(client, api_key, "Ann", "Bob", "Cid")
+    submits = mock_api.stats['submits']
+
+    body = client.post("/enrich_lead_sync/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "first_name": "Bob",
+        "last_name": "Lee",
+        "company_domain": "example.com"
+    }}).get_json()
+
+    assert mock_api.stats['submits'] == submits
+    assert body['metadata']['deduplicated'] is True
+    assert body['metadata']['request_id'] is None
+    assert [lead['contact_first_name'] for lead in body['data']['data']] == ["Bob"]
+    assert shared_request_id not in str(body)
+
+
+def test_single_lead_async_does_not_hand_out_a_shared_request_id(client, mock_api, api_key):
+    shared_request_id = enrich_together(client, api_key, "Ann", "Bob", "Cid")
+
+    body = client.post("/enrich_leads/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "first_name": "Cid",
+        "last_name": "Lee",
+        "company_domain": "example.com"
+    }}).get_json()
+
+    assert body['data']['request_id'] != shared_request_id
+    assert body['metadata']['deduplicated'] is False
+    assert mock_api.requests[body['data']['request_id']]['leads'][0]['first_name'] == "Cid"
+    assert len(mock_api.requests[body['data']['request_id']]['leads']) == 1
+
+
+def test_single_lead_submission_is_reused_by_the_single_lead_modules(client, mock_api, api_key):
+    lead = {"connection": connection(api_key), "first_name": "Dee", "last_name": "Lee", "company_domain": "example.com"}
+    first = client.post("/enrich_leads/v1/execute", json={"data": lead}).get_json()
+
+    second = client.post("/enrich_leads/v1/execute", json={"data": lead}).get_json()
+
+    assert second['metadata']['deduplicated'] is True
+    assert second['data']['request_id'] == first['data']['request_id']
+    assert mock_api.stats['submits'] == 1
@@ -0,0 +1,41 @@
+import requests
+
+from src.core import completions, http_client
+from tests.conftest import connection
+
+
+def enrich(client, api_key, first_name, **options):
+    response = client.post("/enrich_leads/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "first_name": first_name,
+        "last_name": "Lee",
+        "company_domain": "example.com",
+        **options
+    }})
+    return response.get_json()
+
+
+def test_bad_request_without_a_json_body_is_reported(client, mock_api, api_key, monkeypatch):
+    def submit_leads(api_key, body):
+        response = requests.Response()
+        response.status_code = 400
+        response._content = b"<html>Bad Request</html>"
+        return response
+
+    monkeypatch.setattr(http_client, "submit_leads", submit_leads)
+
+    assert enrich(client, api_key, "Ann")['error'] == "Invalid request: Bad request"
+
+
+def test_request_id_is_returned_when_tracking_fails(client, mock_api, api_key, monkeypatch):
+    def track(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(completions, "track", track)
+
+    body = enrich(client, api_key, "Bob", queue_results=True)
+
+    assert body['data']['request_id']
+    assert body['data']['status'] == "submitted"
+    assert "database is locked" in body['metadata']['tracking_error']
+    assert mock_api.stats['submits'] == 1
@@ -0,0 +1,25 @@
+import requests
+
+from src.core.version_resolver import get_version_resolver
+from tests.conftest import connection
+
+
+def broken_fetch(api_key, request_id):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b"<html>Bad gateway</html>"
+    return response, "v2", None
+
+
+def test_unparseable_results_are_an_error_for_that_request_id(client, mock_api, api_key, monkeypatch):
+    monkeypatch.setattr(get_version_resolver(), "fetch", broken_fetch)
+
+    body = client.post("/get_enrichment_results/v1/execute", json={"data": {
+        "connection": connection(api_key),
+        "request_ids": ["req-broken", "req-other"]
+    }}).get_json()
+
+    assert body['data']['results'] == {
+        "req-broken": {"status": "error", "error": "Invalid response format from enrichment results"},
+        "req-other": {"status": "error", "error": "Invalid response format from enrichment results"}
+    }
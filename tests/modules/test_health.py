@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from src.core import circuit_breaker, storage
+
+
+@pytest.fixture(autouse=True)
+def clean_circuits():
+    def reset():
+        storage.get_connection().execute("DELETE FROM circuit_breakers")
+        circuit_breaker._circuits_pid = None
+
+    reset()
+    yield
+    reset()
+
+
+def set_circuit(open_until):
+    circuit_breaker.state()
+    circuit = circuit_breaker._circuits['submit']
+    circuit.opened_at = 1.0
+    circuit.open_until = open_until
+    circuit.shared = (float("inf"), 0.0, 0.0)
+
+
+def test_health_is_ok_while_circuits_are_closed(client):
+    response = client.get("/health")
+
+    assert response.status_code == 200
+    assert response.get_json()['status'] == "ok"
+
+
+def test_health_fails_while_a_circuit_is_open(client):
+    set_circuit(open_until=time.time() + 30)
+
+    response = client.get("/health")
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == "30"
+    assert response.get_json()['status'] == "degraded"
+
+
+def test_half_open_circuit_is_reported_healthy(client):
+    set_circuit(open_until=1.0)
+
+    response = client.get("/health")
+
+    assert response.status_code == 200
+    assert response.get_json()['status'] == "recovering"
+    assert response.get_json()['circuits']['submit']['state'] == "half_open"
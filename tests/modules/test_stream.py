@@ -0,0 +1,41 @@
+import json
+
+
+def stream(client, body, api_key=None, query="chunk_size=1", headers=None):
+    headers = dict(headers or {})
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    response = client.post(
+        f"/enrich_leads_stream/v1/execute?{query}", data=body, headers=headers, content_type="application/x-ndjson"
+    )
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def lead(first_name, uuid):
+    return json.dumps({
+        "first_name": first_name, "last_name": "Lee", "company_domain": "example.com", "custom_fields": {"uuid": uuid}
+    })
+
+
+def test_uuid_repeated_in_a_later_chunk_is_not_submitted_again(client, mock_api, api_key):
+    rows = stream(client, "\n".join([lead("Ann", "crm-1"), lead("Bob", "crm-2"), lead("Cid", "crm-1")]), api_key)
+
+    assert [row.get('status') for row in rows if 'summary' not in row].count("invalid") == 1
+    assert rows[-1]['summary']['submissions'] == 2
+    assert mock_api.stats['submits'] == 2
+
+
+def test_api_key_is_not_taken_from_the_query_string(client, mock_api, api_key):
+    body = stream(client, lead("Ann", "crm-1"), query=f"api_key={api_key}")
+
+    assert "API key not found" in json.dumps(body)
+    assert mock_api.stats['submits'] == 0
+
+
+def test_oversized_upload_is_refused_before_any_submission(client, mock_api, api_key, monkeypatch):
+    route_globals = client.application.view_functions["/enrich_leads_stream/v1/execute"].__globals__
+    monkeypatch.setitem(route_globals, "MAX_UPLOAD_BYTES", 100)
+    body = stream(client, "\n".join(lead(f"Ann{n}", f"crm-{n}") for n in range(5)), api_key)
+
+    assert "Upload is larger than" in json.dumps(body)
+    assert mock_api.stats['submits'] == 0
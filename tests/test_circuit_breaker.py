@@ -0,0 +1,107 @@
+import pytest
+import requests
+
+from src.core import circuit_breaker, http_client, rate_limiter, storage
+
+
+@pytest.fixture(autouse=True)
+def clean_circuits(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "MIN_CALLS", 4)
+    monkeypatch.setattr(circuit_breaker, "OPEN_SECONDS", 30)
+
+    def reset():
+        storage.get_connection().execute("DELETE FROM circuit_breakers")
+        # The next call starts every circuit afresh, as in a new worker
+        circuit_breaker._circuits_pid = None
+
+    reset()
+    yield
+    reset()
+
+
+def fail(endpoint, times):
+    for _ in range(times):
+        circuit_breaker.record(endpoint, True)
+
+
+def test_circuit_opens_after_repeated_failures():
+    fail("submit", 3)
+    assert circuit_breaker.before_call("submit") is False
+
+    fail("submit", 1)
+
+    with pytest.raises(circuit_breaker.CircuitOpenError) as error:
+        circuit_breaker.before_call("submit")
+    assert error.value.retry_after == 30
+    assert circuit_breaker.state()['submit']['state'] == "open"
+    assert circuit_breaker.state()['poll']['state'] == "closed"
+
+
+def test_open_circuit_is_shared_with_other_workers():
+    fail("poll", 4)
+    # Another worker: nothing seen locally, but the shared state says open
+    circuit_breaker._circuits_pid = None
+
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        circuit_breaker.before_call("poll")
+
+
+def test_half_open_circuit_lets_one_probe_through_and_closes_on_success():
+    fail("submit", 4)
+    # OPEN_SECONDS have passed
+    circuit_breaker._circuits['submit'].open_until = 1.0
+    assert circuit_breaker.state()['submit']['state'] == "half_open"
+
+    assert circuit_breaker.before_call("submit") is True
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        circuit_breaker.before_call("submit")
+
+    circuit_breaker.record("submit", False, probe=True)
+
+    assert circuit_breaker.before_call("submit") is False
+    assert circuit_breaker.state()['submit']['state'] == "closed"
+    assert storage.get_connection().execute("SELECT COUNT(*) FROM circuit_breakers").fetchone()[0] == 0
+
+
+def test_shared_state_is_written_outside_the_lock(monkeypatch):
+    held = []
+    get_connection = storage.get_connection
+
+    def checked_connection():
+        held.append(circuit_breaker._circuits_lock.locked())
+        return get_connection()
+
+    monkeypatch.setattr(storage, "get_connection", checked_connection)
+    fail("poll", 4)
+    circuit_breaker.record("poll", False, probe=True)
+
+    assert held and not any(held)
+
+
+def half_open(endpoint):
+    fail(endpoint, 4)
+    # OPEN_SECONDS have passed
+    circuit_breaker._circuits[endpoint].open_until = 1.0
+
+
+def no_rate_limit_slot(api_key, lease_seconds, max_wait):
+    raise rate_limiter.RateLimitTimeout("no slot")
+
+
+def broken_session(*args, **kwargs):
+    raise requests.exceptions.ChunkedEncodingError("connection broken mid-body")
+
+
+@pytest.mark.parametrize("patch", [
+    (rate_limiter, "acquire", no_rate_limit_slot),
+    (http_client.get_session(), "request", broken_session),
+])
+def test_probe_that_gets_no_answer_lets_the_next_call_probe(api_key, monkeypatch, patch):
+    half_open("poll")
+    monkeypatch.setattr(*patch)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        http_client.fetch_results(api_key, "req-probe")
+
+    # Nothing was learnt about the API, so the circuit is not held shut for another OPEN_SECONDS
+    assert circuit_breaker.before_call("poll") is True
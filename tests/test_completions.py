@@ -0,0 +1,90 @@
+import os
+import socket
+
+import pytest
+import requests
+
+from src.core import completions
+
+
+@pytest.mark.parametrize("url", [
+    "http://169.254.169.254/latest/meta-data/",
+    "http://127.0.0.1:8080/hook",
+    "http://localhost/hook",
+    "https://10.1.2.3/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://100.64.0.1/hook",
+])
+def test_callbacks_to_internal_addresses_are_refused(url):
+    assert completions.callback_url_error(url) is not None
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/hook", "example.com/hook", "http:///hook", "http://host:port/"])
+def test_callbacks_must_be_http_urls(url):
+    assert completions.callback_url_error(url) is not None
+
+
+def test_callbacks_to_public_addresses_are_allowed():
+    assert completions.callback_url_error("https://93.184.216.34/hook") is None
+
+
+def test_allowed_hosts_replace_the_address_check(monkeypatch):
+    monkeypatch.setattr(completions, "CALLBACK_ALLOWED_HOSTS", ["127.0.0.1", "hooks.example.com"])
+
+    assert completions.callback_url_error("http://127.0.0.1:9000/__callback") is None
+    assert completions.callback_url_error("https://eu.hooks.example.com/x") is None
+    assert completions.callback_url_error("https://93.184.216.34/hook") is not None
+    assert completions.callback_url_error("https://evilhooks.example.com/x") is not None
+
+
+def test_delivery_to_an_internal_address_is_skipped(monkeypatch):
+    sent = []
+    monkeypatch.setattr(completions, "_send_pinned", lambda *args: sent.append(args))
+
+    completions._post_callback("http://169.254.169.254/latest", {"request_id": "abc"})
+
+    assert sent == []
+
+
+def test_webhook_is_not_used_without_a_secret(monkeypatch):
+    monkeypatch.setattr(completions, "WEBHOOK_URL", "https://connector.example.com/enrichment_callbacks/v1/webhook")
+    monkeypatch.setattr(completions, "WEBHOOK_SECRET", "")
+    assert completions.webhook_url() is None
+
+    monkeypatch.setattr(completions, "WEBHOOK_SECRET", "s3cret")
+    # The secret signs pushes; it is never part of the URL
+    assert completions.webhook_url() == "https://connector.example.com/enrichment_callbacks/v1/webhook"
+
+
+def test_delivery_connects_to_the_address_that_was_checked(monkeypatch):
+    answers = iter(["93.184.216.34", "127.0.0.1"])
+
+    def rebinding_dns(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (next(answers), port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", rebinding_dns)
+    sent = []
+
+    def post(self, url, **kwargs):
+        sent.append((url, kwargs['headers']))
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(requests.Session, "post", post)
+
+    completions._post_callback("http://hooks.example.com:8080/done?x=1", {"request_id": "abc"})
+
+    assert sent == [("http://93.184.216.34:8080/done?x=1", {"Host": "hooks.example.com:8080"})]
+
+
+def test_pinned_delivery_reaches_the_checked_address(mock_api):
+    port = int(os.environ["BETTERCONTACT_BASE_URL"].rsplit(":", 1)[1])
+
+    response = completions._send_pinned(
+        f"http://hooks.example.invalid:{port}/__callback", "127.0.0.1", {"request_id": "pinned"}
+    )
+
+    assert response.status_code == 200
+    assert mock_api.callbacks == [{"request_id": "pinned"}]
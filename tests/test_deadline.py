@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from src.core import deadline
+
+
+def test_bound_cuts_timeouts_to_the_time_left():
+    deadline.start(10)
+    try:
+        assert deadline.bound(30) <= 10 - deadline.RESPONSE_MARGIN
+        assert deadline.bound(1) == 1
+    finally:
+        deadline.clear()
+
+
+def test_expired_deadline_fails_calls():
+    deadline.until(time.time() - 1)
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.bound(5)
+        assert not deadline.allows(0)
+    finally:
+        deadline.clear()
+
+
+def test_cleared_deadline_no_longer_limits_calls():
+    deadline.until(time.time() - 1)
+
+    deadline.clear()
+
+    assert deadline.remaining() is None
+    assert deadline.bound(5) == 5
+
+
+def test_budget_is_kept_within_limits():
+    assert deadline.budget(None, 45) == 45
+    assert deadline.budget(0, 45) == deadline.MIN_BUDGET
+    assert deadline.budget(10 ** 6, 45) == deadline.MAX_BUDGET
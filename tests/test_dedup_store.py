@@ -0,0 +1,51 @@
+import uuid
+
+from src.core import dedup_store
+
+
+def fingerprint():
+    return uuid.uuid4().hex
+
+
+def test_lookup_reports_how_many_leads_share_the_request():
+    alone, shared = fingerprint(), fingerprint()
+    dedup_store.record_submission("key", alone, "request-alone", "ann")
+    dedup_store.record_submission("key", shared, "request-shared", "bob", lead_count=3)
+
+    assert dedup_store.lookup(alone)['lead_count'] == 1
+    assert dedup_store.lookup(shared)['lead_count'] == 3
+
+
+def test_lead_result_keeps_only_the_looked_up_lead():
+    request_id = f"request-{uuid.uuid4().hex}"
+    fingerprints = {name: fingerprint() for name in ("ann", "bob", "cid")}
+    for name, lead_fingerprint in fingerprints.items():
+        dedup_store.record_submission("key", lead_fingerprint, request_id, name, lead_count=3)
+    dedup_store.record_result(request_id, {
+        "id": request_id,
+        "status": "terminated",
+        "data": [{"contact_first_name": name, "custom_fields": {"uuid": name}} for name in fingerprints]
+    })
+
+    result = dedup_store.lead_result(dedup_store.lookup(fingerprints['bob']))
+
+    assert result['id'] is None
+    assert 'credits_consumed' not in result
+    assert [lead['custom_fields']['uuid'] for lead in result['data']] == ["bob"]
+
+
+def test_lead_result_is_none_until_the_request_completes():
+    lead_fingerprint = fingerprint()
+    dedup_store.record_submission("key", lead_fingerprint, f"request-{uuid.uuid4().hex}", "ann", lead_count=2)
+
+    assert dedup_store.lead_result(dedup_store.lookup(lead_fingerprint)) is None
+
+
+def test_forgotten_request_is_no_longer_reused():
+    lead_fingerprint = fingerprint()
+    request_id = f"request-{uuid.uuid4().hex}"
+    dedup_store.record_submission("key", lead_fingerprint, request_id, "ann")
+
+    dedup_store.forget_request(request_id)
+
+    assert dedup_store.lookup(lead_fingerprint) is None
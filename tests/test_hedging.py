@@ -0,0 +1,89 @@
+import time
+
+import pytest
+import requests
+
+from src.core import hedging, http_client, metrics, rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_hedging(monkeypatch):
+    monkeypatch.setattr(hedging, "MIN_SAMPLES", 3)
+    monkeypatch.setattr(hedging, "MIN_DELAY", 0.05)
+    monkeypatch.setattr(hedging, "MAX_RATIO", 1.0)
+    # The next call starts afresh, as in a new worker
+    hedging._state_pid = None
+    yield
+    hedging._state_pid = None
+
+
+def answer(text):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = text.encode("utf-8")
+    return response
+
+
+def warm_up(endpoint, api_key):
+    for _ in range(3):
+        hedging.send(endpoint, api_key, 10, lambda: answer("fast"))
+
+
+def slow_then_fast():
+    sends = []
+
+    def call():
+        sends.append(time.perf_counter())
+        if len(sends) == 1:
+            time.sleep(1)
+            return answer("first")
+        return answer("hedge")
+
+    return call, sends
+
+
+def test_calls_are_not_hedged_before_enough_samples(api_key):
+    call, sends = slow_then_fast()
+
+    assert hedging.send("poll", api_key, 10, call).text == "first"
+    assert len(sends) == 1
+
+
+def test_slow_call_is_hedged_and_the_first_answer_wins(api_key, monkeypatch):
+    counted = []
+    monkeypatch.setattr(metrics, "increment", lambda name, amount=1, **labels: counted.append((name, labels)))
+    warm_up("poll", api_key)
+    call, sends = slow_then_fast()
+
+    started = time.perf_counter()
+    assert hedging.send("poll", api_key, 10, call).text == "hedge"
+    assert time.perf_counter() - started < 0.5
+    assert len(sends) == 2
+    assert ("bettercontact_hedged_calls_total", {"endpoint": "poll", "winner": "hedge"}) in counted
+
+
+def test_no_hedge_without_a_free_rate_limit_slot(api_key, monkeypatch):
+    warm_up("poll", api_key)
+
+    def no_slot(api_key, lease_seconds, max_wait):
+        raise rate_limiter.RateLimitTimeout("no slot")
+
+    monkeypatch.setattr(rate_limiter, "acquire", no_slot)
+    call, sends = slow_then_fast()
+
+    assert hedging.send("poll", api_key, 10, call).text == "first"
+    assert len(sends) == 1
+
+
+def test_submits_are_never_hedged(mock_api, api_key, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGING_ENABLED", True)
+    hedged = []
+    monkeypatch.setattr(hedging, "send", lambda endpoint, *args: hedged.append(endpoint))
+
+    response = http_client.submit_leads(api_key, {"data": [{
+        "first_name": "Ann", "last_name": "Lee", "company_domain": "example.com"
+    }]})
+
+    assert response.status_code == 201
+    assert hedged == []
+    assert mock_api.stats['submits'] == 1
@@ -0,0 +1,66 @@
+import os
+import stat
+import time
+import uuid
+
+from src.core import job_store, storage
+
+
+def stored_key(request_id):
+    return storage.get_connection().execute(
+        "SELECT api_key, api_key_hash FROM enrichment_jobs WHERE request_id = ?", (request_id,)
+    ).fetchone()
+
+
+def test_api_keys_are_not_stored_without_recovery(monkeypatch):
+    monkeypatch.setattr(job_store, "RECOVERY_ENABLED", False)
+    request_id = uuid.uuid4().hex
+
+    job_store.watch("secret-key", request_id, time.time(), time.time())
+
+    row = stored_key(request_id)
+    assert row['api_key'] is None
+    assert row['api_key_hash'] != "secret-key"
+    assert job_store.claim_orphans() == []
+
+
+def test_recovery_stores_the_key_until_the_request_finishes(monkeypatch):
+    monkeypatch.setattr(job_store, "RECOVERY_ENABLED", True)
+    request_id = uuid.uuid4().hex
+    job_store.watch("secret-key", request_id, time.time(), time.time())
+    assert stored_key(request_id)['api_key'] == "secret-key"
+
+    job_store.finish(request_id, "completed", 2)
+
+    assert stored_key(request_id)['api_key'] is None
+
+
+def test_orphaned_request_is_claimed_by_one_worker(monkeypatch):
+    monkeypatch.setattr(job_store, "RECOVERY_ENABLED", True)
+    request_id = uuid.uuid4().hex
+    # Its lease ran out: the next poll was due long ago
+    job_store.watch("secret-key", request_id, time.time() - 120, time.time() - 2 * job_store.LEASE_GRACE)
+
+    claimed = [orphan for orphan in job_store.claim_orphans() if orphan['request_id'] == request_id]
+    again = [orphan for orphan in job_store.claim_orphans() if orphan['request_id'] == request_id]
+
+    assert [orphan['api_key'] for orphan in claimed] == ["secret-key"]
+    assert again == []
+    job_store.finish(request_id, "completed")
+
+
+def test_single_lead_submission_can_be_reattached_to():
+    request_id = uuid.uuid4().hex
+    fingerprint = uuid.uuid4().hex
+    job_store.record_submission("key", request_id, fingerprint)
+
+    assert job_store.lookup(fingerprint)['request_id'] == request_id
+
+    job_store.finish(request_id, "completed")
+    assert job_store.lookup(fingerprint) is None
+
+
+def test_state_database_is_private():
+    storage.get_connection()
+
+    assert stat.S_IMODE(os.stat(storage.STATE_DB).st_mode) == 0o600
@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from src.core import lazy_routes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter with lazy routes: reports the route modules
+# imported before and after one module is called
+APP = textwrap.dedent("""
+    import json
+    import sys
+    import main
+
+    def route_modules():
+        return sorted(name for name in sys.modules if name.startswith("src.modules."))
+
+    before = route_modules()
+    response = main.app.test_client().post("/enrich_leads_batch/v1/execute", json={"data": {}})
+    print(json.dumps({"before": before, "after": route_modules(), "status": response.status_code}))
+""")
+
+
+def test_routes_are_read_without_importing_the_module():
+    route_path = os.path.join(REPO_ROOT, "src", "modules", "enrichment_callbacks", "v1", "route.py")
+
+    assert sorted(lazy_routes.declared_routes(route_path)) == [("/execute", ["POST"]), ("/webhook", ["POST"])]
+
+
+def test_module_is_imported_on_its_first_call(tmp_path):
+    pytest.importorskip("workflows_cdk")
+    env = dict(
+        os.environ,
+        BETTERCONTACT_LAZY_ROUTES="true",
+        BETTERCONTACT_STATE_DB=str(tmp_path / "state.db"),
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")]))
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", APP], cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    report = json.loads(result.stdout.splitlines()[-1])
+
+    assert report['before'] == []
+    assert report['after'] == ["src.modules.enrich_leads_batch.v1.route"]
+    # Answered by the module itself: its input validation refused the empty request
+    assert report['status'] == 400
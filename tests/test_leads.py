@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+from src.core import leads
+
+
+def lines(data, **options):
+    return list(leads.iter_lines(io.BytesIO(data), **options))
+
+
+def test_lines_are_split_across_reads():
+    assert lines(b"\xef\xbb\xbfone\ntwo\nthree", read_size=3) == ["one\n", "two\n", "three"]
+
+
+def test_overlong_line_is_reported_and_skipped():
+    data = b"short\n" + b"x" * 50 + b"\nafter\n"
+
+    assert lines(data, read_size=8, max_line=20) == ["short\n", None, "after\n"]
+    # A line of exactly the limit is kept
+    assert lines(b"x" * 20 + b"\n", max_line=20) == ["x" * 20 + "\n"]
+
+
+def test_overlong_ndjson_row_is_invalid(monkeypatch):
+    monkeypatch.setattr(leads, "MAX_LINE_BYTES", 30)
+    upload = io.BytesIO(b'{"first_name": "Ann"}\n{"first_name": "' + b"x" * 40 + b'"}\n{"first_name": "Bob"}\n')
+
+    rows = list(leads.iter_ndjson_leads(upload))
+
+    assert [(row, error) for row, _, error in rows] == [
+        (0, None), (1, "Row is longer than 30 bytes"), (2, None)
+    ]
+    assert rows[2][1] == {"first_name": "Bob"}
+
+
+def test_overlong_csv_line_ends_the_upload(monkeypatch):
+    monkeypatch.setattr(leads, "MAX_LINE_BYTES", 30)
+    upload = io.BytesIO(b"first_name,company\nAnn,Acme\n" + b"x" * 40 + b",Acme\nBob,Acme\n")
+    rows = leads.iter_csv_leads(upload)
+
+    assert next(rows)[1] == {"first_name": "Ann", "company": "Acme"}
+    with pytest.raises(leads.UploadError):
+        next(rows)
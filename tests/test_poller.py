@@ -0,0 +1,93 @@
+import sqlite3
+import time
+
+from src.core import dedup_store, http_client, job_store, poller, storage
+
+
+def submit(api_key, *names):
+    response = http_client.submit_leads(api_key, {
+        "data": [
+            {"first_name": name, "last_name": "Lee", "company_domain": "example.com", "custom_fields": {"uuid": name}}
+            for name in names
+        ],
+        "enrich_email_address": True,
+        "enrich_phone_number": False
+    })
+    assert response.status_code == 201
+    return response.json()['id']
+
+
+def test_completed_request_resolves_with_results(mock_api, api_key):
+    request_id = submit(api_key, "ann", "bob")
+
+    outcome = poller.ResultPoller().register(api_key, request_id, max_wait=10, initial_delay=0.3).result(timeout=10)
+
+    assert outcome['status'] == "completed"
+    assert [lead['custom_fields']['uuid'] for lead in outcome['data']['data']] == ["ann", "bob"]
+    assert outcome['poll_count'] >= 1
+
+
+def test_waiters_on_one_request_share_its_polls(mock_api, api_key):
+    request_id = submit(api_key, "ann")
+    result_poller = poller.ResultPoller()
+
+    first = result_poller.register(api_key, request_id, max_wait=10, initial_delay=0.3)
+    second = result_poller.register(api_key, request_id, max_wait=10, initial_delay=0.3)
+
+    assert first is second
+    assert first.result(timeout=10)['status'] == "completed"
+    assert mock_api.stats['polls'] == first.result()['poll_count']
+
+
+def test_failing_store_does_not_leave_waiters_hanging(mock_api, api_key, monkeypatch):
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(dedup_store, "record_result", locked)
+    monkeypatch.setattr(job_store, "finish", locked)
+    request_id = submit(api_key, "ann")
+
+    outcome = poller.ResultPoller().register(api_key, request_id, max_wait=10, initial_delay=0.3).result(timeout=10)
+
+    assert outcome['status'] == "completed"
+    assert outcome['data']['id'] == request_id
+
+
+def test_missing_request_resolves_as_not_found(mock_api, api_key):
+    mock_api.not_found_rate = 1.0
+    request_id = submit(api_key, "ann")
+
+    outcome = poller.ResultPoller().register(api_key, request_id, max_wait=10, initial_delay=0).result(timeout=10)
+
+    assert outcome['status'] == "not_found"
+
+
+def test_request_still_processing_at_expiry_times_out(mock_api, api_key):
+    mock_api.enrichment_seconds = 30
+    request_id = submit(api_key, "ann")
+
+    outcome = poller.ResultPoller().register(api_key, request_id, max_wait=1, initial_delay=0).result(timeout=10)
+
+    assert outcome['status'] == "timeout"
+    assert outcome['last_status'] == "processing"
+
+
+def test_request_left_by_a_stopped_worker_is_recovered_and_finished(mock_api, api_key, monkeypatch):
+    monkeypatch.setattr(job_store, "RECOVERY_ENABLED", True)
+    request_id = submit(api_key, "ann")
+    # Its watcher went away: the lease ran out long ago
+    job_store.watch(api_key, request_id, time.time() - 5, time.time() - 2 * job_store.LEASE_GRACE)
+
+    recovering = poller.ResultPoller()
+    recovering._recover_orphans()
+
+    assert request_id in [job['request_id'] for job in recovering._jobs.values()]
+    for _ in range(100):
+        row = storage.get_connection().execute(
+            "SELECT status, api_key FROM enrichment_jobs WHERE request_id = ?", (request_id,)
+        ).fetchone()
+        if row['status'] == "completed":
+            break
+        time.sleep(0.05)
+    assert row['status'] == "completed"
+    assert row['api_key'] is None
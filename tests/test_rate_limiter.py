@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from src.core import rate_limiter, storage
+
+
+@pytest.fixture(autouse=True)
+def clean_limiter(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limiter, "RATE_PER_SECOND", 20)
+    monkeypatch.setattr(rate_limiter, "RATE_BURST", 4)
+    monkeypatch.setattr(rate_limiter, "MAX_IN_FLIGHT", 0)
+
+    def reset():
+        connection = storage.get_connection()
+        connection.execute("DELETE FROM rate_limit_workers")
+        connection.execute("DELETE FROM rate_limit_pauses")
+        # The next call starts every bucket afresh, as in a new worker
+        rate_limiter._buckets_pid = None
+
+    reset()
+    yield
+    reset()
+
+
+def test_burst_is_spent_then_calls_queue(api_key):
+    for _ in range(4):
+        rate_limiter.acquire(api_key, 10, max_wait=0)
+
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        rate_limiter.acquire(api_key, 10, max_wait=0)
+
+    tracker = rate_limiter.track_queue_wait()
+    rate_limiter.acquire(api_key, 10, max_wait=1)
+    assert tracker['throttled_calls'] == 1
+    assert tracker['queue_wait_seconds'] > 0
+
+
+def test_in_flight_cap_frees_slots_on_release(api_key, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_PER_SECOND", 0)
+    monkeypatch.setattr(rate_limiter, "MAX_IN_FLIGHT", 2)
+
+    first = rate_limiter.acquire(api_key, 10, max_wait=0)
+    rate_limiter.acquire(api_key, 10, max_wait=0)
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        rate_limiter.acquire(api_key, 10, max_wait=0)
+
+    rate_limiter.release(first)
+    assert rate_limiter.acquire(api_key, 10, max_wait=0) is not None
+
+
+def test_expired_slots_are_reclaimed(api_key, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_PER_SECOND", 0)
+    monkeypatch.setattr(rate_limiter, "MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(rate_limiter, "LEASE_MARGIN", 0)
+
+    rate_limiter.acquire(api_key, 0.05, max_wait=0)
+    assert rate_limiter.acquire(api_key, 10, max_wait=1) is not None
+
+
+def test_throttled_key_pauses_until_retry_after(api_key):
+    rate_limiter.acquire(api_key, 10, max_wait=0)
+    rate_limiter.throttled(api_key, "1")
+
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        rate_limiter.acquire(api_key, 10, max_wait=0.5)
+
+    # Other workers pick the pause up from the shared database
+    row = storage.get_connection().execute("SELECT paused_until FROM rate_limit_pauses").fetchone()
+    assert row['paused_until'] > time.time()
+
+
+def test_active_workers_split_the_limits(api_key, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_PER_SECOND", 0)
+    monkeypatch.setattr(rate_limiter, "MAX_IN_FLIGHT", 4)
+    key_hash = rate_limiter.api_key_hash(api_key)
+    storage.get_connection().execute(
+        "INSERT INTO rate_limit_workers (api_key_hash, worker, active_until) VALUES (?, 'other', ?)",
+        (key_hash, time.time() + 60)
+    )
+
+    rate_limiter.acquire(api_key, 10, max_wait=0)
+    rate_limiter.acquire(api_key, 10, max_wait=0)
+    with pytest.raises(rate_limiter.RateLimitTimeout):
+        rate_limiter.acquire(api_key, 10, max_wait=0)
+
+
+def test_calls_between_syncs_do_not_touch_the_database(api_key, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_BURST", 100)
+    rate_limiter.acquire(api_key, 10, max_wait=0)
+
+    calls = []
+    real_get_connection = storage.get_connection
+    monkeypatch.setattr(storage, "get_connection", lambda: calls.append(1) or real_get_connection())
+    for _ in range(50):
+        rate_limiter.release(rate_limiter.acquire(api_key, 10, max_wait=0))
+
+    assert calls == []
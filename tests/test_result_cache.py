@@ -0,0 +1,66 @@
+import os
+import time
+
+from src.core import result_cache
+
+
+def disk_cache(tmp_path, **settings):
+    return result_cache.ResultCache(disk_dir=str(tmp_path), **settings)
+
+
+def disk_files(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if name.endswith(".json"))
+
+
+def age(cache, request_id, seconds, used_seconds_ago=None):
+    path = cache._disk_path((result_cache.api_key_hash("key"), request_id))
+    written = time.time() - seconds
+    used = written if used_seconds_ago is None else time.time() - used_seconds_ago
+    os.utime(path, (used, written))
+    return os.path.basename(path)
+
+
+def test_sweep_deletes_expired_entries_that_are_never_read(tmp_path):
+    cache = disk_cache(tmp_path, ttl=60)
+    cache.put_completed("key", "req-old", {"n": 1})
+    cache.put_completed("key", "req-new", {"n": 2})
+    old = age(cache, "req-old", 120)
+    (tmp_path / "orphan.tmp").write_text("{")
+    os.utime(tmp_path / "orphan.tmp", (time.time() - 3600, time.time() - 3600))
+
+    cache._sweep_disk()
+
+    assert old not in disk_files(tmp_path)
+    assert len(disk_files(tmp_path)) == 1
+    assert not (tmp_path / "orphan.tmp").exists()
+
+
+def test_sweep_trims_least_recently_used_entries_over_the_size_cap(tmp_path):
+    cache = disk_cache(tmp_path, ttl=3600, disk_max_mb=0)
+    for request_id in ("req-a", "req-b", "req-c"):
+        cache.put_completed("key", request_id, {"blob": "x" * 1000})
+    cache.disk_max_bytes = 2500
+    age(cache, "req-a", 30, used_seconds_ago=1)
+    stale = age(cache, "req-b", 20)
+    age(cache, "req-c", 10)
+
+    cache._sweep_disk()
+
+    assert stale not in disk_files(tmp_path)
+    assert len(disk_files(tmp_path)) == 2
+
+
+def test_a_write_starts_a_sweep_once_due(tmp_path):
+    cache = disk_cache(tmp_path, ttl=60)
+    cache.put_completed("key", "req-old", {"n": 1})
+    old = age(cache, "req-old", 120)
+    cache._next_sweep = 0
+
+    cache.put_completed("key", "req-new", {"n": 2})
+
+    for _ in range(50):
+        if old not in disk_files(tmp_path):
+            break
+        time.sleep(0.05)
+    assert old not in disk_files(tmp_path)
+    assert cache._next_sweep > time.time()
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+pytest.importorskip("gevent")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh gevent-patched interpreter: one greenlet writes while the
+# parent test holds the write lock, another counts how often it gets to run
+WORKER = textwrap.dedent("""
+    from gevent import monkey
+    monkey.patch_all()
+
+    import sys
+    import time
+    import gevent
+    from src.core import dedup_store, job_store, storage
+
+    storage.get_connection()
+    print("ready", flush=True)
+    ticks = []
+
+    def tick():
+        while True:
+            ticks.append(time.time())
+            gevent.sleep(0.01)
+
+    sys.stdin.readline()
+    ticker = gevent.spawn(tick)
+    gevent.sleep(0.05)
+    started = time.time()
+    job_store.finish("req-locked", "completed")
+    dedup_store.record_submission("key", "fingerprint", "req-locked")
+    waited = time.time() - started
+    ticker.kill()
+    print(f"{waited:.2f} {sum(1 for at in ticks if at >= started)}", flush=True)
+""")
+
+
+def test_waiting_for_the_write_lock_does_not_stall_other_greenlets(tmp_path):
+    state_db = str(tmp_path / "state.db")
+    env = dict(os.environ, BETTERCONTACT_STATE_DB=state_db, PYTHONPATH=REPO_ROOT)
+    worker = subprocess.Popen(
+        [sys.executable, "-c", WORKER], cwd=REPO_ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert worker.stdout.readline().strip() == "ready"
+        # Another worker holds the write lock for a second
+        holder = sqlite3.connect(state_db, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+        worker.stdin.write("go\n")
+        worker.stdin.flush()
+        time.sleep(1.0)
+        holder.execute("COMMIT")
+        holder.close()
+
+        waited, ticks = worker.communicate(timeout=30)[0].split()
+    finally:
+        worker.kill()
+
+    assert float(waited) >= 0.5
+    # Roughly one tick per 10 ms while the write waited, not one at its end
+    assert int(ticks) >= float(waited) * 30
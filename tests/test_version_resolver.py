@@ -0,0 +1,73 @@
+import requests
+
+from src.core import http_client, version_resolver
+
+
+def fake_api(monkeypatch, known):
+    """
+    Answer fetch_results with 200 for the (request_id, version) pairs in
+    `known` and 404 otherwise; return the list of calls made.
+    """
+    calls = []
+
+    def fetch_results(api_key, request_id, version=None):
+        calls.append((request_id, version))
+        response = requests.Response()
+        response.status_code = 200 if (request_id, version) in known else 404
+        response._content = b"{}"
+        return response
+
+    monkeypatch.setattr(http_client, "fetch_results", fetch_results)
+    return calls
+
+
+def test_missing_id_costs_one_call_once_both_endpoints_said_404(monkeypatch, api_key):
+    calls = fake_api(monkeypatch, {("req-legacy", None)})
+    resolver = version_resolver.VersionResolver()
+    resolver.fetch(api_key, "req-legacy")
+    assert resolver.fetch(api_key, "req-new")[2] == "preferred"
+    calls.clear()
+
+    response, label, strategy = resolver.fetch(api_key, "req-new")
+
+    assert (response.status_code, label, strategy) == (404, "legacy", "not_found")
+    assert calls == [("req-new", None)]
+
+
+def test_missing_id_that_appears_is_found(monkeypatch, api_key):
+    known = set()
+    fake_api(monkeypatch, known)
+    resolver = version_resolver.VersionResolver()
+    assert resolver.fetch(api_key, "req-late")[0].status_code == 404
+
+    known.add(("req-late", "v2"))
+    response, label, _ = resolver.fetch(api_key, "req-late")
+    assert (response.status_code, label) == (200, "v2")
+    assert resolver.fetch(api_key, "req-late")[2] == "remembered"
+
+
+def test_missing_ids_are_retried_on_both_endpoints_after_the_ttl(monkeypatch, api_key):
+    monkeypatch.setattr(version_resolver, "NOT_FOUND_SECONDS", 0)
+    calls = fake_api(monkeypatch, set())
+    resolver = version_resolver.VersionResolver()
+    resolver.fetch(api_key, "req-gone")
+    calls.clear()
+
+    assert resolver.fetch(api_key, "req-gone")[2] == "parallel"
+    assert len(calls) == 2
+
+
+def test_remembered_endpoint_answering_404_is_not_asked_again(monkeypatch, api_key):
+    known = {("req-moved", "v2")}
+    calls = fake_api(monkeypatch, known)
+    resolver = version_resolver.VersionResolver()
+    resolver.fetch(api_key, "req-moved")
+    assert resolver.fetch(api_key, "req-moved")[2] == "remembered"
+
+    known.clear()
+    known.add(("req-moved", None))
+    calls.clear()
+    response, label, strategy = resolver.fetch(api_key, "req-moved")
+
+    assert (response.status_code, label, strategy) == (200, "legacy", "remembered")
+    assert calls == [("req-moved", "v2"), ("req-moved", None)]